@@ -1,6 +1,6 @@
 #!/bin/bash
 
-# Optional: Add any setup or pre-start commands here
 echo "Started DoHome Addon"
-# Start your addon's main service or script as the main process
-exec python3 /src/__init__.py
+# The gateway daemon owns discovery, polling and commands and serves the
+# integration on the configured port; it reads the add-on options itself.
+exec python3 -m dohome_client.daemon --options /data/options.json
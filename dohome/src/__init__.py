@@ -2,11 +2,12 @@ import socket
 import logging
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
-from threading import Thread, Lock
-from collections import defaultdict
 from homeassistant.helpers import discovery
 from homeassistant.helpers.entity import Entity
 
+from dohome_client import (DEVICE_PORT, DeviceRegistry, DoHomeMetrics, DoHomeTransport,
+                           PacketTrace, discover_broadcast)
+
 DOMAIN = 'dohome'
 CONF_GATEWAYS = 'discovery_ip'
 CONF_DISCOVERY_RETRY = 'discovery_retry'
@@ -20,15 +21,16 @@ CONFIG_SCHEMA = vol.Schema({
     })
 }, extra=vol.ALLOW_EXTRA)
 
-GATEWAY_DISCOVERY_PORT = 6091
-SOCKET_BUFSIZE = 1024
-
 # Define DOHOME_COMPONENTS
 DOHOME_COMPONENTS = ['switch', 'light', 'sensor', 'binary_sensor']
 
 # Initialize DISCOVERY_IP
 DISCOVERY_IP = ''
 
+DOHOME_GATEWAY = None
+DOHOME_METRICS = DoHomeMetrics()
+PACKET_TRACE = PacketTrace()
+
 _LOGGER = logging.getLogger(__name__)
 
 
@@ -40,54 +42,24 @@ def get_alias(name):
 
 
 class DoHomeGateway:
+    """Run broadcast discovery and keep the devices in a dohome_client registry."""
+
     def __init__(self):
-        self.devices = defaultdict(list)
-        self.devices_lock = Lock()
+        self.registry = DeviceRegistry()
+        self.devices = self.registry.devices
 
     def _discover_devices(self):
-        _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        _socket.bind(('', GATEWAY_DISCOVERY_PORT))
-
         try:
-            _socket.sendto('cmd=ping\r\n'.encode(),
-                           (DISCOVERY_IP, GATEWAY_DISCOVERY_PORT))
-            _socket.settimeout(1.0)
-
-            while True:
-                data, addr = _socket.recvfrom(SOCKET_BUFSIZE)
-
-                if len(data) < 70:
-                    continue
-
-                _LOGGER.debug('DoHome devices %s ', data.decode("utf-8"))
-                resp = {i.split("=")[0]: i.split("=")[1]
-                        for i in data.decode("utf-8").split("&")}
-                if resp["cmd"] != 'pong':
-                    continue
-
-                device_type = resp["device_type"]
-
-                dohome_device = {
-                    "sid": resp["device_name"][-4:],
-                    "name": resp["device_name"],
-                    "sta_ip": resp["sta_ip"],
-                    "type": device_type
-                }
-
-                with self.devices_lock:
-                    if dohome_device not in self.devices[device_type]:
-                        self.devices[device_type].append(dohome_device)
-
-        except socket.timeout:
-            _LOGGER.info("Gateway finding finished in 5 seconds")
-
-        finally:
-            _socket.close()
+            devices, _ = discover_broadcast((DISCOVERY_IP, DEVICE_PORT), 1.0)
+        except OSError as err:
+            _LOGGER.error("Socket error: %s", err)
+            return
+        for device in self.registry.add_all(devices):
+            _LOGGER.info("Discovered DoHome Device: %s", device)
 
 
 def setup(hass, config):
-    global DISCOVERY_IP
+    global DISCOVERY_IP, DOHOME_GATEWAY
     DISCOVERY_IP = config[DOMAIN][CONF_GATEWAYS]
     discovery_retry = config[DOMAIN][CONF_DISCOVERY_RETRY]
 
@@ -101,10 +73,10 @@ def setup(hass, config):
                     addlist[1] + '.' + addlist[2] + '.255'
     _LOGGER.info("DoHome discovery_ip:%s", DISCOVERY_IP)
 
-    dohome_gateway = DoHomeGateway()
+    DOHOME_GATEWAY = DoHomeGateway()
 
     for _ in range(discovery_retry):
-        dohome_gateway._discover_devices()
+        DOHOME_GATEWAY._discover_devices()
 
     for component in DOHOME_COMPONENTS:
         discovery.load_platform(hass, component, DOMAIN, {}, config)
@@ -114,10 +86,12 @@ def setup(hass, config):
 
 class DoHomeDevice(Entity):
     def __init__(self, name, device):
+        self._device = device
         self._sid = device['sid']
         self._name = get_alias(name)
         self._sta_ip = device['sta_ip']
         self._device_state_attributes = {}
+        self._transport = DoHomeTransport(metrics=DOHOME_METRICS, trace=PACKET_TRACE)
 
     @property
     def name(self):
@@ -132,6 +106,9 @@ class DoHomeDevice(Entity):
         """Generate a unique entity ID based on the SID."""
         return f"{DOMAIN}_{self._sid}"
 
-     # def update(self):
-        # Implement logic to fetch the actual state and attributes here
-        # Update self._device_state_attributes accordingly
+    def _send_cmd(self, frame, rtn_cmd, retries=0):
+        """Send an encoded frame to the device and return its reply op, or None."""
+        return self._transport.send_cmd(self._device, frame, rtn_cmd, retries)
+
+    def will_remove_from_hass(self):
+        self._transport.close()
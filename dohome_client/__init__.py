@@ -0,0 +1,55 @@
+"""
+Async client library for DoHome Wi-Fi devices.
+
+Everything here is independent of Home Assistant: the UDP codec, the
+transports, broadcast and unicast discovery and the jobs that run it, the
+device registry, color encoding, the capability table and the link metrics. The Home Assistant
+integration and the add-on are entity adapters on top of it.
+"""
+from .budget import PacketBudget
+from .capabilities import CAPABILITIES, DEVICE_PLATFORMS, EntitySpec, entity_name, entity_specs
+from .client import DoHomeClient
+from .codec import DEVICE_PORT, ctrl_frame, parse_pong, parse_reply, power_op, status_frame
+from .color import DoHomeColorEngine
+from .discovery import DiscoveryStats, discover_broadcast, expand_hosts, probe_hosts
+from .jobs import DiscoveryJob, DiscoveryJobManager
+from .metrics import DoHomeMetrics
+from .models import DeviceInfo
+from .protocol import DoHomeAsyncTransport, DoHomeTransport, TransportStats
+from .registry import DeviceRegistry
+from .shadow import DeviceShadow, ShadowStore
+from .trace import PacketTrace
+
+__version__ = '0.1.0'
+
+__all__ = [
+    'CAPABILITIES',
+    'DEVICE_PLATFORMS',
+    'DEVICE_PORT',
+    'DeviceInfo',
+    'DeviceRegistry',
+    'DeviceShadow',
+    'DiscoveryJob',
+    'DiscoveryJobManager',
+    'DiscoveryStats',
+    'DoHomeAsyncTransport',
+    'DoHomeClient',
+    'DoHomeColorEngine',
+    'DoHomeMetrics',
+    'DoHomeTransport',
+    'EntitySpec',
+    'PacketBudget',
+    'PacketTrace',
+    'ShadowStore',
+    'TransportStats',
+    'ctrl_frame',
+    'discover_broadcast',
+    'entity_name',
+    'entity_specs',
+    'expand_hosts',
+    'parse_pong',
+    'parse_reply',
+    'power_op',
+    'probe_hosts',
+    'status_frame',
+]
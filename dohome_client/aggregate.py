@@ -0,0 +1,56 @@
+"""
+Windowed aggregation of sensor samples.
+
+Sensors read their device every second but publish once per window: the mean
+as the state, with the minimum and maximum alongside. Missing readings (the
+device's sentinel values) are counted but left out of the statistics.
+"""
+from collections import namedtuple
+
+WindowSummary = namedtuple('WindowSummary', 'mean minimum maximum samples missing')
+
+
+class WindowAggregator:
+    """Running min, max and mean of the samples in the current window."""
+
+    __slots__ = ('window', '_start', '_count', '_missing', '_total', '_minimum', '_maximum')
+
+    def __init__(self, window):
+        self.window = window
+        self._start = None
+        self._reset(None)
+
+    def _reset(self, start):
+        self._start = start
+        self._count = 0
+        self._missing = 0
+        self._total = 0
+        self._minimum = None
+        self._maximum = None
+
+    def add(self, value, now):
+        """Add a sample, None for a missing reading; now is in seconds.
+
+        Return the summary of the window when the sample closes it, else None.
+        """
+        if self._start is None:
+            self._start = now
+        if value is None:
+            self._missing += 1
+        else:
+            self._count += 1
+            self._total += value
+            if self._minimum is None or value < self._minimum:
+                self._minimum = value
+            if self._maximum is None or value > self._maximum:
+                self._maximum = value
+        if now - self._start < self.window:
+            return None
+        summary = self.summary()
+        self._reset(now)
+        return summary
+
+    def summary(self):
+        """Return the summary of the samples so far; mean is None without any."""
+        mean = self._total / self._count if self._count else None
+        return WindowSummary(mean, self._minimum, self._maximum, self._count, self._missing)
@@ -0,0 +1,157 @@
+"""
+Batched status polling with multi-sid cmd 25 frames.
+
+A cmd 25 frame can name many devices, ``devices={[b33b,e84c,...]}``; sent
+to the broadcast address, every listed device whose firmware honors device
+lists answers for itself. One frame per group of ``max_batch`` devices
+replaces one frame per device.
+
+Not every firmware does this, so batching is decided per device model
+(``type``). The first poll of a model with two or more devices is the
+probe: its devices are asked in batches, and the model is recorded as
+batching when any of them answered, single otherwise. Devices that did not
+answer a batch are polled singly in the same round, so a model that does
+not batch, a lost frame or an older device of a batching model costs a
+round trip, not a missed poll. A device of a batching model that keeps
+missing batches but answers singly is left out of later batches; a batching model
+whose batches stop being answered while single polls are is recorded as
+single again. Both are probed again every ``reprobe_rounds`` rounds.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+
+from .codec import CMD_STATUS, batch_status_frame, status_frame
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_REPROBE_ROUNDS = 3600
+# Batches in a row a device must miss, while answering singly, before it is
+# polled singly; a lost frame alone does not do it.
+EXCLUDE_AFTER_MISSES = 3
+
+MODE_BATCH = 'batch'
+MODE_SINGLE = 'single'
+
+
+class BatchStatusPoller:
+    """Poll device status with multi-sid frames where the firmware allows."""
+
+    def __init__(self, transport, target, max_batch=DEFAULT_MAX_BATCH,
+                 reprobe_rounds=DEFAULT_REPROBE_ROUNDS):
+        self._transport = transport
+        self.target = target
+        self._max_batch = max_batch
+        self._reprobe_rounds = reprobe_rounds
+        # type -> (mode, round it was decided)
+        self.modes = {}
+        # sid -> round since which a device of a batching model is polled singly
+        self._single_sids = {}
+        self._batch_misses = defaultdict(int)
+        self.rounds = 0
+        self.batch_frames = 0
+        self.batch_replies = 0
+        self.single_polls = 0
+
+    async def async_poll(self, devices):
+        """Poll devices once; returns {sid: status reply, or None}."""
+        self.rounds += 1
+        by_type = defaultdict(list)
+        for device in devices:
+            by_type[device['type']].append(device)
+
+        batched = []
+        singles = []
+        for device_type, group in by_type.items():
+            members = []
+            excluded = []
+            for device in group:
+                (excluded if self._excluded(device['sid']) else members).append(device)
+            if self._batches(device_type, members):
+                batched.append((device_type, members))
+                singles += excluded
+            else:
+                singles += group
+        results = await asyncio.gather(
+            *(self._async_poll_batched(device_type, group) for device_type, group in batched),
+            self._async_poll_single(singles))
+
+        replies = {}
+        for result in results:
+            replies.update(result)
+        return replies
+
+    def _batches(self, device_type, group):
+        if len(group) < 2:
+            return False
+        mode, decided = self.modes.get(device_type, (None, 0))
+        if mode == MODE_SINGLE and self.rounds - decided >= self._reprobe_rounds:
+            mode = None
+        return mode != MODE_SINGLE
+
+    def _excluded(self, sid):
+        excluded = self._single_sids.get(sid)
+        if excluded is not None and self.rounds - excluded >= self._reprobe_rounds:
+            del self._single_sids[sid]
+            return False
+        return excluded is not None
+
+    async def _async_poll_batched(self, device_type, group):
+        chunks = [group[start:start + self._max_batch]
+                  for start in range(0, len(group), self._max_batch)]
+        self.batch_frames += len(chunks)
+        replies = {}
+        for result in await asyncio.gather(*(
+                self._transport.async_send_batch(
+                    chunk, batch_status_frame([device['sid'] for device in chunk]),
+                    CMD_STATUS, self.target)
+                for chunk in chunks)):
+            replies.update(result)
+
+        answered = sum(resp is not None for resp in replies.values())
+        self.batch_replies += answered
+        missing = [device for device in group if replies.get(device['sid']) is None]
+        for sid, resp in replies.items():
+            if resp is not None:
+                self._batch_misses.pop(sid, None)
+        replies.update(await self._async_poll_single(missing))
+
+        mode, _ = self.modes.get(device_type, (None, 0))
+        if answered:
+            if mode != MODE_BATCH:
+                _LOGGER.info("%s devices answer multi-device status frames", device_type)
+                self.modes[device_type] = (MODE_BATCH, self.rounds)
+            # Devices of a batching model that keep answering only singly,
+            # e.g. on older firmware, are left out of its batches.
+            for device in missing:
+                sid = device['sid']
+                if replies[sid] is None:
+                    continue
+                self._batch_misses[sid] += 1
+                if self._batch_misses[sid] >= EXCLUDE_AFTER_MISSES:
+                    del self._batch_misses[sid]
+                    self._single_sids[sid] = self.rounds
+        elif any(replies[device['sid']] is not None for device in missing):
+            _LOGGER.info("%s devices do not answer multi-device status frames, polling singly",
+                         device_type)
+            self.modes[device_type] = (MODE_SINGLE, self.rounds)
+        return replies
+
+    async def _async_poll_single(self, devices):
+        self.single_polls += len(devices)
+        replies = await asyncio.gather(*(
+            self._transport.async_send_cmd(device, status_frame(device['sid']), CMD_STATUS)
+            for device in devices))
+        return {device['sid']: resp for device, resp in zip(devices, replies)}
+
+    def as_dict(self):
+        return {
+            'target': self.target,
+            'rounds': self.rounds,
+            'modes': {device_type: mode for device_type, (mode, _) in self.modes.items()},
+            'single_devices': sorted(self._single_sids),
+            'batch_frames': self.batch_frames,
+            'batch_replies': self.batch_replies,
+            'single_polls': self.single_polls,
+        }
@@ -0,0 +1,158 @@
+"""
+Site-wide packet budget.
+
+Every datagram a transport sends takes a slot from one PacketBudget, which
+caps the site at ``rate`` packets per second. Status polls (cmd 25) and
+commands (everything else) are paced separately: commands have a reserved
+``command_share`` of the rate, so a backlog of polls never delays a user's
+switch or color change, and polls share the rest.
+
+Slots are handed out by virtual scheduling: each request learns how long
+to wait before sending, and a backlog spreads the requests evenly instead
+of letting them burst onto the air. When polls are backlogged, each device
+also gets at most an equal share of the poll rate, so a device polled by
+several entities cannot crowd out the others. Poll loops that await their
+slot stretch their interval on their own; blocking callers pass
+``max_delay`` and skip a poll whose slot is further away than that.
+"""
+import time
+from threading import Lock
+
+POLL = 'poll'
+COMMAND = 'command'
+
+DEFAULT_RATE = 200
+DEFAULT_COMMAND_SHARE = 0.2
+# Packets of each kind that may go out back to back before pacing starts.
+POLL_BURST = 10
+COMMAND_BURST = 20
+# Seconds a device counts towards the fair share after its last poll.
+ACTIVE_WINDOW = 30.0
+# Length of the telemetry window.
+WINDOW = 10.0
+
+
+class PacketBudget:
+    """Pace the datagrams of every transport of a site."""
+
+    def __init__(self, rate=DEFAULT_RATE, command_share=DEFAULT_COMMAND_SHARE):
+        self._lock = Lock()
+        self._tat = {POLL: 0.0, COMMAND: 0.0}
+        self._device_tat = {}
+        self._last_poll = {}
+        self._active = 0
+        self._active_counted = None
+        self.sent = {POLL: 0, COMMAND: 0}
+        self.deferred = 0
+        self._window_start = time.monotonic()
+        self._window = self._new_window()
+        self._last_window = None
+        self.configure(rate, command_share)
+
+    def configure(self, rate, command_share=DEFAULT_COMMAND_SHARE):
+        """Set the site rate in packets per second; 0 or None removes the cap."""
+        with self._lock:
+            self.rate = rate or None
+            self.command_share = command_share
+
+    def reserve(self, kind, sid=None, max_delay=None, now=None):
+        """Take a slot for one packet and return the seconds to wait before sending it.
+
+        kind is POLL or COMMAND. Returns None, and takes nothing, when the
+        slot is more than max_delay seconds away.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._roll_window(now)
+            if self.rate is None:
+                self._count(kind, 0.0)
+                return 0.0
+
+            share = self.command_share if kind == COMMAND else 1 - self.command_share
+            interval = 1 / (self.rate * share)
+            burst = (COMMAND_BURST if kind == COMMAND else POLL_BURST) * interval
+            tat = self._tat[kind]
+            at = max(now, tat - burst)
+            fair = kind == POLL and sid is not None
+            if fair:
+                self._last_poll[sid] = now
+                # The fair share only applies while polls are backlogged, so
+                # an idle budget never holds a device back.
+                if tat - burst > now:
+                    at = max(at, self._device_tat.get(sid, 0.0))
+            if max_delay is not None and at - now > max_delay:
+                self.deferred += 1
+                self._window['deferred'] += 1
+                return None
+
+            # From the granted slot: a fair share slot can lie beyond tat.
+            self._tat[kind] = max(tat, at) + interval
+            if fair:
+                self._device_tat[sid] = at + self._active_devices(now) * interval
+            self._count(kind, at - now)
+            return at - now
+
+    def _active_devices(self, now):
+        # Recounted at most once a second; pruning is linear in the devices.
+        if self._active_counted is None or now - self._active_counted >= 1:
+            self._last_poll = {sid: last for sid, last in self._last_poll.items()
+                               if now - last < ACTIVE_WINDOW}
+            self._active = len(self._last_poll)
+            self._active_counted = now
+        return max(self._active, 1)
+
+    def _count(self, kind, delay):
+        self.sent[kind] += 1
+        window = self._window
+        window[kind] += 1
+        if kind == POLL:
+            window['poll_delay'] += delay
+            window['max_poll_delay'] = max(window['max_poll_delay'], delay)
+        else:
+            window['max_command_delay'] = max(window['max_command_delay'], delay)
+
+    @staticmethod
+    def _new_window():
+        return {POLL: 0, COMMAND: 0, 'deferred': 0, 'poll_delay': 0.0,
+                'max_poll_delay': 0.0, 'max_command_delay': 0.0}
+
+    def _roll_window(self, now):
+        elapsed = now - self._window_start
+        if elapsed < WINDOW:
+            return
+        window = self._window
+        packets = window[POLL] + window[COMMAND]
+        self._last_window = {
+            'seconds': round(elapsed, 1),
+            'packets_per_second': round(packets / elapsed, 1),
+            'polls_per_second': round(window[POLL] / elapsed, 1),
+            'commands_per_second': round(window[COMMAND] / elapsed, 1),
+            'use': round(packets / elapsed / self.rate, 3) if self.rate else None,
+            'deferred': window['deferred'],
+            'mean_poll_delay': round(window['poll_delay'] / window[POLL], 3) if window[POLL] else 0.0,
+            'max_poll_delay': round(window['max_poll_delay'], 3),
+            'max_command_delay': round(window['max_command_delay'], 3),
+        }
+        self._window_start = now
+        self._window = self._new_window()
+
+    @property
+    def use(self):
+        """Return the share of the budget the last window used, or None."""
+        with self._lock:
+            self._roll_window(time.monotonic())
+            return self._last_window['use'] if self._last_window else None
+
+    def as_dict(self):
+        now = time.monotonic()
+        with self._lock:
+            self._roll_window(now)
+            return {
+                'rate': self.rate,
+                'command_share': self.command_share,
+                'active_devices': self._active,
+                'poll_backlog': round(max(0.0, self._tat[POLL] - now), 3),
+                'sent': dict(self.sent),
+                'deferred': self.deferred,
+                'last_window': self._last_window,
+            }
@@ -0,0 +1,65 @@
+"""
+Device capability table.
+
+Every supported device type maps each platform to the entities it gets.
+An EntitySpec names the cmd 25 status key an entity reads, how its name is
+formed, and the per-type quirks the platforms used to hard-code: sensor
+units, the sentinel value a sensor reports when it has no reading, and
+status keys that read inverted, such as the plug's ``soft_poweroff``.
+Supporting a new device type only takes a new row.
+"""
+from collections import namedtuple
+
+# key: cmd 25 status key the entity reads.
+# name: name format, filled with the device's name and sid.
+# command: cmd 5 op key used to switch the entity, for switches.
+# inverted: the status key reads 1 for off.
+# unit: unit of measurement, for sensors.
+# unavailable: status value meaning the sensor has no reading.
+# device_class: Home Assistant device class.
+EntitySpec = namedtuple(
+    'EntitySpec', 'key name command inverted unit unavailable device_class',
+    defaults=(None, False, None, None, None))
+
+TEMPERATURE = EntitySpec('temp', 'Temperature_{sid}', unit='°C', unavailable=100,
+                         device_class='temperature')
+HUMIDITY = EntitySpec('humi', 'Humidity_{sid}', unit='%', unavailable=0, device_class='humidity')
+ILLUMINATION = EntitySpec('illu', 'illumination_{sid}', unit='lx', unavailable=-1,
+                          device_class='illuminance')
+MOTION = EntitySpec('motion', 'Motion_{sid}', device_class='motion')
+LIGHT = EntitySpec(None, '{name}')
+
+
+def _relays(count):
+    return tuple(EntitySpec(f'relay{index}', f'Relay_{{sid}}_{index}', command=f'relay{index}')
+                 for index in range(1, count + 1))
+
+
+CAPABILITIES = {
+    '_DT-PLUG': {
+        'switch': (EntitySpec('soft_poweroff', '{name}', command='op', inverted=True),),
+    },
+    '_THIMR': {
+        'switch': (EntitySpec('relay', '{name}', command='op'),),
+        'sensor': (TEMPERATURE, HUMIDITY, ILLUMINATION),
+        'binary_sensor': (MOTION,),
+    },
+    '_REALY2': {'switch': _relays(2)},
+    '_REALY4': {'switch': _relays(4)},
+    '_STRIPE': {'light': (LIGHT,)},
+    '_DT-WYRGB': {'light': (LIGHT,)},
+    '_MOTION': {'binary_sensor': (MOTION,)},
+}
+
+# Platforms each device type needs.
+DEVICE_PLATFORMS = {device_type: list(platforms) for device_type, platforms in CAPABILITIES.items()}
+
+
+def entity_specs(device, platform):
+    """Return the specs of the entities platform creates for device."""
+    return CAPABILITIES.get(device['type'], {}).get(platform, ())
+
+
+def entity_name(spec, device):
+    """Return the entity name spec gives for device."""
+    return spec.name.format(name=device['name'], sid=device['sid'])
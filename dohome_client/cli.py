@@ -0,0 +1,261 @@
+"""
+Command-line access to DoHome devices without Home Assistant.
+
+    dohome scan [--broadcast ADDR] [--hosts HOST_OR_CIDR ...] [--duration 2]
+    dohome poll [--devices FILE] [--sid SID ...] [--interval 1] [--count 0]
+    dohome send COMMANDS [--devices FILE] [--parallel 32] [--repeat 1]
+
+Devices come from ``--devices``, a file written by ``dohome scan``, or are
+found first by probing ``--hosts`` or broadcasting to ``--broadcast``
+(255.255.255.255 when neither is given). Output is JSON: ``scan`` and
+``send`` print one document, ``poll`` prints one line per round with the
+last round trip time and the loss so far of every device, then a summary
+with the full per-device metrics when ``--count`` rounds are done or it is
+interrupted.
+
+``send`` reads a JSON list, or one JSON object per line, of commands:
+
+    {"sid": "b33b", "power": true}
+    {"sid": "b33b", "power": false, "key": "relay2"}
+    {"sid": "e84c", "color": [255, 128, 0, 0, 0], "brightness": 200}
+
+``power`` switches the ``key`` relay (``op`` by default) and turns lights
+off when false. ``color`` takes Home Assistant rgbww values and a 0-255
+brightness. ``--repeat`` sends the list again for load tests. Commands
+that are malformed are not sent and are listed in ``failed`` with the
+reason.
+"""
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+
+from .capabilities import entity_specs
+from .client import DoHomeClient
+from .codec import DEVICE_PORT
+
+DEFAULT_BROADCAST = '255.255.255.255'
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))], 2)
+
+
+def _read_json(path):
+    """Return the JSON document in path, or the list of its JSON lines."""
+    with open(path, encoding='utf-8') as source:
+        text = source.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _read_commands(path):
+    """Return the commands in path as a list, also when the file holds just one."""
+    commands = _read_json(path)
+    return [commands] if isinstance(commands, dict) else commands
+
+
+def _command_error(command):
+    """Return why command cannot be sent, or None."""
+    if not isinstance(command, dict):
+        return 'not a JSON object'
+    if 'sid' not in command:
+        return 'missing sid'
+    if 'color' in command:
+        color = command['color']
+        if not isinstance(color, list) or len(color) != 5 or \
+                not all(isinstance(value, int) for value in color):
+            return 'color must be a list of 5 integers'
+        if not isinstance(command.get('brightness', 255), int):
+            return 'brightness must be an integer'
+    elif 'power' not in command:
+        return 'needs color or power'
+    return None
+
+
+def _print(document, indent=2):
+    print(json.dumps(document, indent=indent))
+    sys.stdout.flush()
+
+
+async def _async_find(client, args):
+    """Fill the client's registry from --devices, --hosts or --broadcast."""
+    if getattr(args, 'devices', None):
+        document = _read_json(args.devices)
+        client.registry.add_all(document['devices'] if isinstance(document, dict) else document)
+        return
+    if args.hosts:
+        await client.async_probe(args.hosts)
+    if args.broadcast or not args.hosts:
+        await client.async_discover((args.broadcast or DEFAULT_BROADCAST, DEVICE_PORT),
+                                    args.duration, ('', args.bind_port))
+
+
+async def async_scan(args):
+    client = DoHomeClient(timeout=args.timeout)
+    start = time.monotonic()
+    try:
+        await _async_find(client, args)
+    finally:
+        client.close()
+    stats = client.last_discovery_stats
+    return {
+        'devices': sorted(client.registry.all(), key=lambda device: device['name']),
+        'seconds': round(time.monotonic() - start, 3),
+        'broadcast': stats.as_dict() if stats else None,
+    }
+
+
+async def async_poll(args):
+    client = DoHomeClient(timeout=args.timeout)
+    await _async_find(client, args)
+    devices = client.registry.all()
+    if args.sid:
+        devices = [device for device in devices if device['sid'] in args.sid]
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def timed_status(device):
+        sent = loop.time()
+        resp = await client.async_status(device)
+        return None if resp is None else round((loop.time() - sent) * 1000, 2)
+
+    rounds = 0
+    start = loop.time()
+    try:
+        while not stop.is_set() and (not args.count or rounds < args.count):
+            tick = loop.time()
+            rtts = await asyncio.gather(*(timed_status(device) for device in devices))
+            rounds += 1
+            _print({
+                'round': rounds,
+                'seconds': round(loop.time() - start, 3),
+                'answered': sum(rtt is not None for rtt in rtts),
+                'devices': {
+                    device['sid']: {'rtt_ms': rtt, 'loss': client.metrics.get(device['sid']).loss}
+                    for device, rtt in zip(devices, rtts)
+                },
+            }, indent=None)
+            try:
+                await asyncio.wait_for(stop.wait(), max(0, tick + args.interval - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        client.close()
+
+    metrics = client.metrics.as_dict()
+    for snapshot in metrics.values():
+        del snapshot['rtt_histogram']
+    return {
+        'rounds': rounds,
+        'devices': len(devices),
+        'seconds': round(loop.time() - start, 3),
+        'transport': client.transport.stats.as_dict(),
+        'worst': client.metrics.worst(),
+        'metrics': metrics,
+    }
+
+
+async def async_send(args):
+    commands = []
+    invalid = []
+    for command in _read_commands(args.commands):
+        error = _command_error(command)
+        if error is None:
+            commands.append(command)
+        else:
+            invalid.append({'sid': command.get('sid') if isinstance(command, dict) else None,
+                            'ok': False, 'error': error, 'command': command})
+    client = DoHomeClient(timeout=args.timeout)
+    needs_lookup = any('sta_ip' not in command for command in commands)
+    if needs_lookup:
+        await _async_find(client, args)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(args.parallel)
+
+    async def send(command):
+        device = client.registry.get(command['sid'])
+        if device is None:
+            if 'sta_ip' not in command:
+                return {'sid': command['sid'], 'error': 'unknown device'}
+            device = {'sid': command['sid'], 'name': command['sid'],
+                      'sta_ip': command['sta_ip'], 'type': command.get('type')}
+        async with semaphore:
+            sent = loop.time()
+            if 'color' in command:
+                resp = await client.async_set_color(
+                    device, tuple(command['color']), command.get('brightness', 255), args.retries)
+            elif not command['power'] and entity_specs(device, 'light'):
+                resp = await client.async_set_color(device, None, 0, args.retries)
+            else:
+                resp = await client.async_set_power(
+                    device, command['power'], command.get('key', 'op'), args.retries)
+            rtt = round((loop.time() - sent) * 1000, 2)
+        return {'sid': device['sid'], 'ok': resp is not None, 'rtt_ms': rtt if resp else None}
+
+    start = loop.time()
+    try:
+        results = await asyncio.gather(*(send(command)
+                                         for _ in range(args.repeat) for command in commands))
+    finally:
+        client.close()
+    elapsed = loop.time() - start
+    sends = len(results)
+    results = invalid + results
+    rtts = [result['rtt_ms'] for result in results if result.get('rtt_ms') is not None]
+    return {
+        'commands': len(results),
+        'answered': len(rtts),
+        'failed': [result for result in results if not result.get('ok')],
+        'seconds': round(elapsed, 3),
+        'commands_per_second': round(sends / elapsed, 1) if elapsed else None,
+        'p50_ms': _percentile(rtts, 50) if rtts else None,
+        'p99_ms': _percentile(rtts, 99) if rtts else None,
+        'transport': client.transport.stats.as_dict(),
+    }
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='dohome', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--timeout', type=float, default=1.0, help='request timeout in seconds')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('scan', help='find devices')
+    poll_parser = commands.add_parser('poll', help='poll status and report RTT and loss')
+    poll_parser.add_argument('--sid', action='append', help='device to poll, repeatable (default: all)')
+    poll_parser.add_argument('--interval', type=float, default=1.0)
+    poll_parser.add_argument('--count', type=int, default=0, help='rounds to run, 0 until interrupted')
+    send_parser = commands.add_parser('send', help='send the commands in a file')
+    send_parser.add_argument('commands', help='JSON or JSON lines file of commands')
+    send_parser.add_argument('--parallel', type=int, default=32, help='commands in flight at once')
+    send_parser.add_argument('--repeat', type=int, default=1)
+    send_parser.add_argument('--retries', type=int, default=1)
+    for name, sub in commands.choices.items():
+        if name != 'scan':
+            sub.add_argument('--devices', help='device list written by dohome scan')
+        sub.add_argument('--hosts', nargs='+', default=[], help='addresses or CIDR ranges to probe')
+        sub.add_argument('--broadcast', help='broadcast address to ping')
+        sub.add_argument('--duration', type=float, default=2.0, help='broadcast listen time')
+        sub.add_argument('--bind-port', type=int, default=6091,
+                         help='local port for broadcast replies, 0 for any')
+    return parser
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    handler = {'scan': async_scan, 'poll': async_poll, 'send': async_send}[args.command]
+    result = asyncio.run(handler(args))
+    _print(result)
+    if args.command == 'send':
+        return 1 if result['failed'] else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
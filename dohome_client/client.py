@@ -0,0 +1,73 @@
+"""
+Async DoHome client.
+
+Ties the pieces of the library together for callers that do not need to
+manage them separately: discovery fills a device registry, and status,
+power and color requests go out through one shared async transport whose
+exchanges are recorded in the metrics and the packet trace.
+"""
+from .codec import (CMD_COLOR, CMD_POWER, CMD_STATUS, DEVICE_PORT, ctrl_frame, power_op,
+                    status_frame)
+from .color import OP_OFF, DoHomeColorEngine, channels_op
+from .discovery import expand_hosts
+from .jobs import DiscoveryJobManager
+from .metrics import DoHomeMetrics
+from .protocol import DoHomeAsyncTransport
+from .registry import DeviceRegistry
+from .trace import PacketTrace
+
+
+class DoHomeClient:
+    """Discover DoHome devices and send them requests from an event loop."""
+
+    def __init__(self, timeout=1.0, metrics=None, trace=None, gamma=None, budget=None):
+        self.timeout = timeout
+        self.budget = budget
+        self.metrics = metrics if metrics is not None else DoHomeMetrics()
+        self.trace = trace if trace is not None else PacketTrace()
+        self.registry = DeviceRegistry()
+        self.color = DoHomeColorEngine(gamma)
+        self.transport = DoHomeAsyncTransport(timeout, self.metrics, self.trace, budget)
+        self.discovery = DiscoveryJobManager(self.registry)
+        self.last_discovery_stats = None
+
+    async def async_discover(self, target, duration=1, bind=('', DEVICE_PORT)):
+        """Broadcast a ping to target and return the devices that are new.
+
+        Joins the discovery job already running, if any.
+        """
+        job = self.discovery.request(duration, target=target, bind=bind)
+        await job.async_wait()
+        self.last_discovery_stats = job.stats
+        return job.new_devices
+
+    async def async_probe(self, entries):
+        """Unicast-ping addresses and CIDR ranges and return the devices that are new."""
+        job = self.discovery.request(hosts=expand_hosts(entries))
+        await job.async_wait()
+        return job.new_devices
+
+    async def async_status(self, device, retries=0):
+        """Return the cmd 25 status of device, or None if it did not answer."""
+        return await self.transport.async_send_cmd(
+            device, status_frame(device["sid"]), CMD_STATUS, retries)
+
+    async def async_set_power(self, device, on, key='op', retries=1):
+        """Switch the relay key of device and return its reply, or None."""
+        frame = ctrl_frame(device["sid"], power_op(key, 1 if on else 0))
+        return await self.transport.async_send_cmd(device, frame, CMD_POWER, retries)
+
+    async def async_set_color(self, device, rgbww, brightness, retries=1):
+        """Set a light to an HA rgbww color and brightness (0-255), or off for None."""
+        op = OP_OFF if rgbww is None else self.color.encode_op(rgbww, brightness)
+        return await self.transport.async_send_cmd(
+            device, ctrl_frame(device["sid"], op), CMD_COLOR, retries)
+
+    async def async_set_channels(self, device, values, retries=1):
+        """Set a light's raw (r, g, b, w, m) device values and return its reply, or None."""
+        return await self.transport.async_send_cmd(
+            device, ctrl_frame(device["sid"], channels_op(values)), CMD_COLOR, retries)
+
+    def close(self):
+        """Close the transport's sockets."""
+        self.transport.close()
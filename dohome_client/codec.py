@@ -0,0 +1,76 @@
+"""
+DoHome frame encoding and decoding.
+
+Requests are ``cmd=ctrl&devices={[sid]}&op={json}`` frames and replies carry
+the device MAC in ``dev``, whose characters 8 to 12 are the sid. The device
+list can name several sids, ``devices={[b33b,e84c]}``, for a frame that is
+broadcast to all of them; each device answers for itself. Discovery
+pings are answered with a ``cmd=pong`` frame describing the device.
+"""
+import json
+
+DEVICE_PORT = 6091
+SOCKET_BUFSIZE = 1024
+PING = 'cmd=ping\r\n'.encode()
+
+CMD_POWER = 5
+CMD_COLOR = 6
+CMD_STATUS = 25
+STATUS_OP = '{"cmd":25}'
+
+
+def ctrl_frame(sid, op):
+    """Return the encoded cmd=ctrl frame for one device."""
+    return f'cmd=ctrl&devices={{[{sid}]}}&op={op}'.encode()
+
+
+def multi_ctrl_frame(sids, op):
+    """Return the encoded cmd=ctrl frame addressed to several devices."""
+    return f'cmd=ctrl&devices={{[{",".join(sids)}]}}&op={op}'.encode()
+
+
+def power_op(key, value):
+    """Return the cmd 5 op setting the switch key (``op`` or ``relayN``) to value."""
+    return '{"cmd":5,"%s":%d }' % (key, value)
+
+
+def status_frame(sid):
+    """Return the encoded cmd 25 status request for one device."""
+    return ctrl_frame(sid, STATUS_OP)
+
+
+def batch_status_frame(sids):
+    """Return the encoded cmd 25 status request for several devices."""
+    return multi_ctrl_frame(sids, STATUS_OP)
+
+
+def parse_reply(data):
+    """Return (sid, op) from a device reply, raising ValueError if malformed."""
+    try:
+        dic = {i.split("=")[0]: i.split("=")[1] for i in data.decode("utf-8").split("&")}
+        sid, op = dic["dev"][8:12], json.loads(dic["op"])
+    except (UnicodeDecodeError, IndexError, KeyError) as err:
+        raise ValueError(f"malformed reply: {data!r}") from err
+    # Callers look the reply's cmd up in op; valid JSON is not always an object.
+    if not isinstance(op, dict):
+        raise ValueError(f"malformed reply: {data!r}")
+    return sid, op
+
+
+def parse_pong(data):
+    """Return the device dict for a pong frame, or None for anything else."""
+    if len(data) < 70:
+        return None
+    try:
+        resp = {i.split("=")[0]: i.split("=")[1] for i in data.decode("utf-8").split("&")}
+    except (UnicodeDecodeError, IndexError):
+        return None
+    if resp.get("cmd") != 'pong' or "device_name" not in resp:
+        return None
+
+    return {
+        "sid": resp["device_name"][-4:],
+        "name": resp["device_name"],
+        "sta_ip": resp.get("sta_ip"),
+        "type": resp.get("device_type")
+    }
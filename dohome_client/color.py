@@ -0,0 +1,107 @@
+"""
+Color encoding for DoHome cmd 6 frames.
+
+The firmware takes five channels (r, g, b, w, m) on a 0-5000 scale: 50 steps
+per brightness percent. Every value a channel can take for a given Home
+Assistant brightness is computed once up front, so encoding a color is five
+table lookups.
+"""
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, batches fall back to plain lookups
+    np = None
+
+DEVICE_SCALE = 5000
+CHANNEL_STEP = 50
+CHANNELS = ('r', 'g', 'b', 'w', 'm')
+
+_OP_FORMAT = '{"cmd": 6, "r": %d, "g": %d, "b": %d, "w": %d, "m": %d}'
+OP_OFF = _OP_FORMAT % (0, 0, 0, 0, 0)
+
+
+def channels_op(values):
+    """Return the cmd 6 op payload for raw (r, g, b, w, m) device values."""
+    return _OP_FORMAT % tuple(values)
+
+
+def device_brightness(brightness):
+    """Convert HA brightness (0-255) to device brightness (0-100)."""
+    return int(100 * brightness / 255)
+
+
+class DoHomeColorEngine:
+    """Lookup-table encoder from HA rgbww/brightness to cmd 6 channel values."""
+
+    def __init__(self, gamma=None):
+        self.set_gamma(gamma)
+
+    def set_gamma(self, gamma):
+        """Rebuild the tables for a new per-channel gamma, or None for linear."""
+        self._gamma = gamma
+        if gamma is None:
+            levels = range(256)
+        else:
+            levels = [255 * (level / 255) ** gamma for level in range(256)]
+
+        # One row per device brightness, shared by the HA brightness values
+        # that map onto it.
+        rows = [
+            tuple(int(CHANNEL_STEP * level / 255 * percent) for level in levels)
+            for percent in range(101)
+        ]
+        self._rows = tuple(rows[device_brightness(b)] for b in range(256))
+        self._array = None
+        if np is not None:
+            self._array = np.array(self._rows, dtype=np.int32)
+
+    @property
+    def gamma(self):
+        """Return the gamma applied to each channel, or None."""
+        return self._gamma
+
+    def encode(self, rgbww, brightness):
+        """Return the (r, g, b, w, m) device values for one color."""
+        row = self._rows[brightness]
+        r, g, b, w, m = rgbww
+        return (row[r], row[g], row[b], row[w], row[m])
+
+    def encode_op(self, rgbww, brightness):
+        """Return the cmd 6 op payload for one color."""
+        return _OP_FORMAT % self.encode(rgbww, brightness)
+
+    def decode(self, values):
+        """Return (rgbww, brightness) for device channel values.
+
+        Returns None when every channel is off, since the color cannot be
+        recovered from an all-zero frame.
+        """
+        peak = min(max(values), DEVICE_SCALE)
+        if peak <= 0:
+            return None
+
+        percent = -(-peak // CHANNEL_STEP)
+        scale = CHANNEL_STEP * percent
+        levels = [min(max(value, 0), scale) * 255 / scale for value in values]
+        if self._gamma is not None:
+            levels = [255 * (level / 255) ** (1 / self._gamma) for level in levels]
+
+        return tuple(round(level) for level in levels), -(-percent * 255 // 100)
+
+    def encode_batch(self, colors, brightness):
+        """Encode many colors at once.
+
+        ``colors`` is a sequence of rgbww tuples and ``brightness`` is either a
+        single HA brightness or one per color. With NumPy installed this
+        returns an ``(N, 5)`` int32 array, otherwise a list of tuples.
+        """
+        if self._array is None:
+            if isinstance(brightness, int):
+                row = self._rows[brightness]
+                return [tuple(row[c] for c in color) for color in colors]
+            return [self.encode(color, b) for color, b in zip(colors, brightness)]
+
+        colors = np.asarray(colors, dtype=np.intp)
+        brightness = np.asarray(brightness, dtype=np.intp)
+        if brightness.ndim:
+            brightness = brightness[:, None]
+        return self._array[brightness, colors]
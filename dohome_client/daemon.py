@@ -0,0 +1,365 @@
+"""
+Standalone DoHome gateway daemon.
+
+The daemon owns discovery, status polling and command delivery, so none of
+the UDP traffic runs in Home Assistant's process. Subscribers connect over a
+Unix socket or TCP, on the loopback interface unless told otherwise, and
+exchange newline-delimited JSON messages.
+
+A subscriber's first message must be a hello with the daemon's shared
+token; the connection is closed after any other first message:
+
+    {"op": "hello", "token": "..."}
+
+Without a configured token the daemon makes one up at startup and logs it.
+
+The daemon sends:
+
+    {"event": "devices", "devices": [...]}            known devices, on connect and when new ones appear
+    {"event": "state", "sid": "b33b", "status": {...}} a cmd 25 reply that differs from the last one
+    {"event": "reply", "id": 7, "result": ...}        the answer to a request
+
+A subscriber gets the devices and the last state of every device right
+after its hello. Requests carry an ``id`` chosen by the subscriber:
+
+    {"id": 7, "op": "send", "sid": "b33b", "frame": "cmd=ctrl&...", "cmd": 5, "retries": 1}
+    {"id": 8, "op": "discover"}
+    {"id": 9, "op": "metrics"}
+
+``send`` answers with the reply op or null and polls the device right away
+so the new state is streamed without waiting for the next round.
+``discover`` answers with the devices that were new.
+
+When discovering on a broadcast address, status is polled with
+multi-device frames to it for the device models that answer them (see
+BatchStatusPoller); ``--no-batch-status`` turns that off.
+
+With ``--workers N`` the periodic polling runs in N worker processes of a
+ShardedPoller instead of the daemon's event loop, for sites with thousands
+of devices; commands and their follow-up polls still go out from the daemon.
+
+    python3 -m dohome_client.daemon [--options /data/options.json]
+        [--socket PATH] [--listen HOST:PORT] [--token TOKEN] [--broadcast ADDR]
+        [--hosts ...] [--workers N]
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import signal
+import sys
+import time
+
+from .batch import BatchStatusPoller
+from .budget import DEFAULT_RATE, PacketBudget
+from .client import DoHomeClient
+from .codec import DEVICE_PORT
+from .sharded import ShardedPoller
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 6092
+# Seconds a new connection has to send its hello.
+HELLO_TIMEOUT = 10.0
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_DISCOVERY_INTERVAL = 300
+DISCOVERY_DURATION = 2.0
+# A subscriber that lets this much output pile up is dropped rather than
+# buffered without bound.
+MAX_SUBSCRIBER_BUFFER = 1 << 20
+
+EVENT_DEVICES = 'devices'
+EVENT_STATE = 'state'
+EVENT_REPLY = 'reply'
+EVENT_ERROR = 'error'
+OP_HELLO = 'hello'
+OP_SEND = 'send'
+OP_DISCOVER = 'discover'
+OP_METRICS = 'metrics'
+
+
+def encode_message(message):
+    """Return one JSON line."""
+    return (json.dumps(message, separators=(',', ':')) + '\n').encode()
+
+
+class DoHomeDaemon:
+    """Poll every known device and stream state changes to subscribers."""
+
+    def __init__(self, client, token, broadcast=None, hosts=(), poll_interval=DEFAULT_POLL_INTERVAL,
+                 discovery_interval=DEFAULT_DISCOVERY_INTERVAL, workers=0, batch_status=True):
+        self.client = client
+        self._token = token
+        self._broadcast = broadcast
+        self._hosts = list(hosts)
+        self._poll_interval = poll_interval
+        self._discovery_interval = discovery_interval
+        self._states = {}
+        self._writers = set()
+        self._servers = []
+        self._tasks = []
+        # Request and follow-up poll tasks; the loop only keeps weak references.
+        self._background = set()
+        self._discover_lock = asyncio.Lock()
+        self._sharded = None
+        self._batch = None
+        if batch_status and broadcast and not workers:
+            self._batch = BatchStatusPoller(client.transport, broadcast)
+        if workers:
+            self._sharded = ShardedPoller(workers, poll_interval, client.timeout,
+                                          client.budget.rate if client.budget else None)
+            self._sharded.add_listener(self._handle_delta)
+        self.rounds = 0
+
+    async def async_start(self, socket_path=None, listen=None):
+        """Discover, start serving and start the poll and rediscovery loops."""
+        await self.async_discover()
+        if socket_path:
+            self._servers.append(await asyncio.start_unix_server(self._async_serve, socket_path))
+            _LOGGER.info("Serving on %s", socket_path)
+        if listen:
+            host, port = listen
+            self._servers.append(await asyncio.start_server(self._async_serve, host, port))
+            _LOGGER.info("Serving on %s:%d", host or '*', port)
+        if self._sharded is not None:
+            self._sharded.start(self.client.registry.all())
+        else:
+            self._tasks.append(asyncio.create_task(self._async_poll_loop()))
+        if self._discovery_interval:
+            self._tasks.append(asyncio.create_task(self._async_discovery_loop()))
+
+    async def async_stop(self):
+        for task in self._tasks + list(self._background):
+            task.cancel()
+        for server in self._servers:
+            server.close()
+        for writer in list(self._writers):
+            writer.close()
+        if self._sharded is not None:
+            self._sharded.stop()
+        self.client.close()
+
+    async def async_discover(self):
+        """Broadcast and probe for devices and announce the new ones."""
+        async with self._discover_lock:
+            new = []
+            if self._hosts:
+                new += await self.client.async_probe(self._hosts)
+            if self._broadcast:
+                new += await self.client.async_discover(
+                    (self._broadcast, DEVICE_PORT), DISCOVERY_DURATION)
+        if new:
+            _LOGGER.info("Found %d new DoHome devices, %d known", len(new), len(self.client.registry))
+            if self._sharded is not None and self._sharded.running:
+                self._sharded.set_devices(self.client.registry.all())
+            self._publish({'event': EVENT_DEVICES, 'devices': self.client.registry.all()})
+        return new
+
+    async def _async_discovery_loop(self):
+        while True:
+            await asyncio.sleep(self._discovery_interval)
+            try:
+                await self.async_discover()
+            except OSError as err:
+                _LOGGER.warning("Rediscovery failed: %s", err)
+
+    async def _async_poll_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            devices = self.client.registry.all()
+            if self._batch is not None:
+                replies = await self._batch.async_poll(devices)
+                for device in devices:
+                    self._update_state(device, replies.get(device['sid']))
+            else:
+                await asyncio.gather(*(self._async_poll_device(device) for device in devices))
+            self.rounds += 1
+            await asyncio.sleep(max(0, start + self._poll_interval - loop.time()))
+
+    async def _async_poll_device(self, device):
+        self._update_state(device, await self.client.async_status(device))
+
+    def _update_state(self, device, resp):
+        if resp is None:
+            return
+        sid = device['sid']
+        # The reply sequence number changes every time; compare the rest.
+        status = {key: value for key, value in resp.items() if key != 'seq'}
+        if self._states.get(sid) != status:
+            self._states[sid] = status
+            self._publish({'event': EVENT_STATE, 'sid': sid, 'status': status})
+
+    def _handle_delta(self, sid, changes):
+        status = self._sharded.states[sid]
+        if self._states.get(sid) != status:
+            self._states[sid] = dict(status)
+            self._publish({'event': EVENT_STATE, 'sid': sid, 'status': status})
+
+    def _publish(self, message):
+        data = encode_message(message)
+        for writer in list(self._writers):
+            if writer.transport.get_write_buffer_size() > MAX_SUBSCRIBER_BUFFER:
+                _LOGGER.warning("Dropping a subscriber that stopped reading")
+                self._writers.discard(writer)
+                writer.close()
+                continue
+            writer.write(data)
+
+    async def _async_serve(self, reader, writer):
+        if not await self._async_hello(reader, writer):
+            writer.close()
+            return
+        self._writers.add(writer)
+        writer.write(encode_message({'event': EVENT_DEVICES, 'devices': self.client.registry.all()}))
+        for sid, status in self._states.items():
+            writer.write(encode_message({'event': EVENT_STATE, 'sid': sid, 'status': status}))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    _LOGGER.debug("Ignoring malformed request %r", line)
+                    continue
+                self._spawn(self._async_answer(request, writer))
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _async_hello(self, reader, writer):
+        try:
+            hello = json.loads(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT))
+            accepted = (hello.get('op') == OP_HELLO
+                        and hmac.compare_digest(str(hello.get('token', '')), self._token))
+        except (asyncio.TimeoutError, ConnectionError, ValueError, AttributeError):
+            accepted = False
+        if not accepted:
+            _LOGGER.warning("Refused a subscriber from %s without the daemon's token",
+                            writer.get_extra_info('peername') or 'the Unix socket')
+            writer.write(encode_message({'event': EVENT_ERROR, 'error': 'unauthorized'}))
+        return accepted
+
+    async def _async_answer(self, request, writer):
+        try:
+            result = await self._async_handle(request)
+        except (KeyError, TypeError, ValueError) as err:
+            _LOGGER.debug("Bad request %s: %s", request, err)
+            result = None
+        if not writer.is_closing():
+            writer.write(encode_message({'event': EVENT_REPLY, 'id': request.get('id'), 'result': result}))
+
+    async def _async_handle(self, request):
+        op = request.get('op')
+        if op == OP_SEND:
+            device = self.client.registry.get(request['sid'])
+            if device is None:
+                return None
+            resp = await self.client.transport.async_send_cmd(
+                device, request['frame'].encode(), request['cmd'], request.get('retries', 0))
+            if resp is not None:
+                self._spawn(self._async_poll_device(device))
+            return resp
+        if op == OP_DISCOVER:
+            return await self.async_discover()
+        if op == OP_METRICS:
+            return {
+                'rounds': self.rounds,
+                'sharded': self._sharded.as_dict() if self._sharded is not None else None,
+                'batch_status': self._batch.as_dict() if self._batch is not None else None,
+                'subscribers': len(self._writers),
+                'transport': self.client.transport.stats.as_dict(),
+                'packet_budget': self.client.budget.as_dict() if self.client.budget else None,
+                'metrics': self.client.metrics.as_dict(),
+            }
+        raise ValueError(f"unknown op {op!r}")
+
+
+def _listen_address(value):
+    host, _, port = value.rpartition(':')
+    return host, int(port)
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='dohome-daemon', description=__doc__.split('\n\n')[0])
+    parser.add_argument('--options', help='add-on options.json; command-line values take precedence')
+    parser.add_argument('--socket', help='Unix socket path to serve on')
+    parser.add_argument('--listen', type=_listen_address,
+                        help=f'HOST:PORT to serve on (default {DEFAULT_HOST}:{DEFAULT_PORT})')
+    parser.add_argument('--token', help='shared token subscribers must send (default: generated and logged)')
+    parser.add_argument('--broadcast', help='broadcast address to discover on')
+    parser.add_argument('--hosts', nargs='+', help='addresses or CIDR ranges to probe')
+    parser.add_argument('--poll-interval', type=float)
+    parser.add_argument('--discovery-interval', type=float, help='seconds between rediscoveries, 0 for never')
+    parser.add_argument('--timeout', type=float, default=1.0, help='request timeout in seconds')
+    parser.add_argument('--workers', type=int, help='poll from this many worker processes, 0 in-process')
+    parser.add_argument('--packet-budget', type=int,
+                        help=f'packets per second for the whole site, 0 for no limit (default {DEFAULT_RATE})')
+    parser.add_argument('--no-batch-status', dest='batch_status', action='store_const', const=False,
+                        help='never poll with multi-device frames to the broadcast address')
+    parser.add_argument('--log-level', default='info')
+    return parser
+
+
+async def async_main(args):
+    options = {}
+    if args.options:
+        with open(args.options, encoding='utf-8') as options_file:
+            options = json.load(options_file)
+
+    def setting(name, default=None):
+        value = getattr(args, name)
+        return value if value is not None else options.get(name, default)
+
+    listen = args.listen or (options.get('host') or DEFAULT_HOST, options.get('port', DEFAULT_PORT))
+    token = setting('token')
+    if not token:
+        token = secrets.token_urlsafe(24)
+        _LOGGER.warning("No token configured, subscribers must use the generated token %s", token)
+    hosts = setting('hosts', [])
+    broadcast = setting('broadcast') or (None if hosts else '255.255.255.255')
+    daemon = DoHomeDaemon(
+        DoHomeClient(timeout=args.timeout,
+                     budget=PacketBudget(setting('packet_budget', DEFAULT_RATE))),
+        token, broadcast=broadcast, hosts=hosts,
+        poll_interval=setting('poll_interval', DEFAULT_POLL_INTERVAL),
+        discovery_interval=setting('discovery_interval', DEFAULT_DISCOVERY_INTERVAL),
+        workers=setting('workers', 0),
+        batch_status=setting('batch_status', True))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    started = time.monotonic()
+    await daemon.async_start(setting('socket'), listen)
+    _LOGGER.info("DoHome daemon running with %d devices", len(daemon.client.registry))
+    await stop.wait()
+    await daemon.async_stop()
+    _LOGGER.info("DoHome daemon stopped after %.0f s and %d poll rounds",
+                 time.monotonic() - started, daemon.rounds)
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(),
+                        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    asyncio.run(async_main(args))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
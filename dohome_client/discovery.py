@@ -0,0 +1,240 @@
+"""
+DoHome device discovery helpers.
+
+Devices answer ``cmd=ping`` with a ``cmd=pong`` frame describing themselves.
+Besides the broadcast ping done by the gateway, a static inventory of
+addresses and CIDR ranges can be swept by unicast, which works across
+routed networks where the broadcast does not reach.
+"""
+import ipaddress
+import logging
+import selectors
+import socket
+import struct
+import sys
+import time
+from collections import OrderedDict
+
+from .codec import DEVICE_PORT, PING, SOCKET_BUFSIZE, parse_pong
+
+_LOGGER = logging.getLogger(__name__)
+
+PROBE_IN_FLIGHT = 256
+PROBE_TIMEOUT = 0.5
+PROBE_RCVBUF = 1 << 20
+DISCOVERY_RCVBUF = 4 << 20
+
+# Linux reports datagrams the kernel dropped on a full receive buffer as
+# ancillary data once this option is set. Python does not export the name.
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+_OVFL_CMSG_SPACE = socket.CMSG_SPACE(4) if hasattr(socket, 'CMSG_SPACE') else 0
+
+
+class DiscoveryStats:
+    """Counters for one broadcast discovery run."""
+
+    __slots__ = ('received', 'duplicates', 'malformed', 'dropped', 'devices')
+
+    def __init__(self):
+        self.received = 0
+        self.duplicates = 0
+        self.malformed = 0
+        self.dropped = 0
+        self.devices = 0
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+def expand_hosts(entries):
+    """Expand IP addresses and CIDR ranges into a list of unique hosts."""
+    hosts = {}
+    for entry in entries:
+        network = ipaddress.ip_network(entry, strict=False)
+        if network.num_addresses == 1:
+            hosts[str(network.network_address)] = None
+        else:
+            hosts.update((str(host), None) for host in network.hosts())
+    return list(hosts)
+
+
+def probe_hosts(hosts, max_in_flight=PROBE_IN_FLIGHT, timeout=PROBE_TIMEOUT, port=DEVICE_PORT):
+    """Ping every host by unicast and return the devices that answered.
+
+    At most ``max_in_flight`` pings are outstanding at once and each host
+    gets ``timeout`` seconds to answer, so a sweep takes roughly
+    ``len(hosts) / max_in_flight * timeout`` seconds when nobody is home.
+    """
+    pending = iter(hosts)
+    in_flight = OrderedDict()
+    found = {}
+
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PROBE_RCVBUF)
+    _socket.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(_socket, selectors.EVENT_READ)
+
+    try:
+        exhausted = False
+        while True:
+            now = time.monotonic()
+            while in_flight and next(iter(in_flight.values())) <= now:
+                in_flight.popitem(last=False)
+
+            while not exhausted and len(in_flight) < max_in_flight:
+                host = next(pending, None)
+                if host is None:
+                    exhausted = True
+                    break
+                try:
+                    _socket.sendto(PING, (host, port))
+                except OSError as err:
+                    _LOGGER.debug("Could not probe %s: %s", host, err)
+                    continue
+                in_flight[host] = now + timeout
+
+            if not in_flight:
+                break
+
+            selector.select(max(next(iter(in_flight.values())) - now, 0))
+            while True:
+                try:
+                    data, addr = _socket.recvfrom(SOCKET_BUFSIZE)
+                except (BlockingIOError, InterruptedError):
+                    break
+                device = parse_pong(data)
+                if device is None:
+                    continue
+                if not device["sta_ip"]:
+                    device["sta_ip"] = addr[0]
+                found[addr[0]] = device
+                in_flight.pop(addr[0], None)
+    finally:
+        selector.close()
+        _socket.close()
+
+    return list(found.values())
+
+
+def discover_broadcast(target, duration, bind=('', DEVICE_PORT)):
+    """Broadcast a ping to target and collect pongs for duration seconds.
+
+    Hundreds of devices answer the same broadcast within milliseconds, so the
+    receive buffer is enlarged and the socket is drained in a tight loop that
+    only stores raw datagrams. Decoding, de-duplication and logging happen
+    once the window has closed. Returns (devices, stats).
+    """
+    stats = DiscoveryStats()
+    raw = []
+
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DISCOVERY_RCVBUF)
+        track_drops = _set_overflow_reporting(_socket)
+        _socket.bind(bind)
+        _socket.setblocking(False)
+
+        _socket.sendto(PING, target)
+        deadline = time.monotonic() + duration
+        with selectors.DefaultSelector() as selector:
+            selector.register(_socket, selectors.EVENT_READ)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if not selector.select(remaining):
+                    continue
+                if track_drops:
+                    stats.dropped = max(stats.dropped, _drain_counting_drops(_socket, raw))
+                else:
+                    _drain(_socket, raw)
+    finally:
+        _socket.close()
+
+    decoder = PongDecoder(stats)
+    decoder.decode(raw)
+    decoder.log()
+    return list(decoder.devices.values()), stats
+
+
+class PongDecoder:
+    """Turn received datagrams into devices, counting duplicates and junk.
+
+    decode can be called again with more datagrams as they arrive.
+    """
+
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else DiscoveryStats()
+        self.devices = {}
+        self._seen = set()
+
+    def decode(self, datagrams):
+        """Decode (data, addr) pairs and return the devices not seen before."""
+        stats = self.stats
+        new = []
+        for data, addr in datagrams:
+            stats.received += 1
+            if data in self._seen:
+                stats.duplicates += 1
+                continue
+            self._seen.add(data)
+            device = parse_pong(data)
+            if device is None:
+                stats.malformed += 1
+                continue
+            if device["name"] in self.devices:
+                stats.duplicates += 1
+                continue
+            if not device["sta_ip"] and addr is not None:
+                device["sta_ip"] = addr[0]
+            self.devices[device["name"]] = device
+            new.append(device)
+            _LOGGER.debug("Pong from DoHome Device: %s", device)
+        stats.devices = len(self.devices)
+        return new
+
+    def log(self):
+        stats = self.stats
+        _LOGGER.info("Discovery received %d pongs from %d devices "
+                     "(%d duplicate, %d malformed, %d dropped by the kernel)",
+                     stats.received, stats.devices, stats.duplicates, stats.malformed, stats.dropped)
+
+
+def _set_overflow_reporting(sock):
+    if SO_RXQ_OVFL is None or not _OVFL_CMSG_SPACE:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _drain(sock, raw):
+    """Append every (data, addr) waiting on a non-blocking socket to raw."""
+    append = raw.append
+    recvfrom = sock.recvfrom
+    try:
+        while True:
+            append(recvfrom(SOCKET_BUFSIZE))
+    except (BlockingIOError, InterruptedError):
+        pass
+
+
+def _drain_counting_drops(sock, raw):
+    """_drain for a socket with overflow reporting; returns the kernel's drop count."""
+    append = raw.append
+    recvmsg = sock.recvmsg
+    dropped = 0
+    try:
+        while True:
+            data, ancdata, _, addr = recvmsg(SOCKET_BUFSIZE, _OVFL_CMSG_SPACE)
+            append((data, addr))
+            for level, kind, value in ancdata:
+                if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                    dropped = struct.unpack('=I', value[:4])[0]
+    except (BlockingIOError, InterruptedError):
+        pass
+    return dropped
@@ -0,0 +1,355 @@
+"""
+Discovery jobs: one cancellable scan at a time, shared by every caller.
+
+Broadcast discovery binds the DoHome port, so two scans at once fight over
+it and each sees only part of the answers. A DiscoveryJobManager runs at
+most one scan, on the event loop: a request made while a scan is running
+joins it instead of starting another, moving its deadline out to the
+longest one requested and adding its broadcast targets and unicast hosts
+to it. Every caller gets the same DiscoveryJob and can await it or cancel
+it.
+
+While a job runs, the broadcast ping is repeated ``PING_INTERVAL``
+seconds after the first and twice as long after each following one, up to
+``MAX_PING_INTERVAL``; a joining request pings again at once.
+broadcast_window turns a number of pings into the duration that sends that
+many. Unicast hosts are pinged with at most ``PROBE_IN_FLIGHT`` outstanding.
+
+Sockets are drained by event loop readers the same way discover_broadcast
+drains its socket, counting what the kernel dropped, and the job sleeps
+until datagrams arrive or its next ping, probe timeout or progress report
+is due. Listeners get the job's progress every ``PROGRESS_INTERVAL``
+seconds and when the job ends.
+"""
+import asyncio
+import logging
+import socket
+import time
+from collections import OrderedDict
+
+from .codec import DEVICE_PORT, PING
+from .discovery import (DISCOVERY_RCVBUF, PROBE_IN_FLIGHT, PROBE_RCVBUF, PROBE_TIMEOUT,
+                        PongDecoder, _drain, _drain_counting_drops, _set_overflow_reporting)
+
+_LOGGER = logging.getLogger(__name__)
+
+PING_INTERVAL = 1.0
+MAX_PING_INTERVAL = 16.0
+PROGRESS_INTERVAL = 1.0
+
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_CANCELLED = 'cancelled'
+STATE_FAILED = 'failed'
+
+
+def broadcast_window(pings):
+    """Return the scan duration in which a new job sends pings broadcasts.
+
+    The window ends PING_INTERVAL after the last ping, which is before the
+    next one is due, so that ping's answers are still collected.
+    """
+    offset, interval = 0.0, PING_INTERVAL
+    for _ in range(pings - 1):
+        offset += interval
+        interval = min(interval * 2, MAX_PING_INTERVAL)
+    return offset + PING_INTERVAL
+
+
+class _PongCollector:
+    """Drain one socket into a list whenever the event loop finds it readable."""
+
+    def __init__(self, loop, sock, wakeup):
+        self._loop = loop
+        self._socket = sock
+        self._wakeup = wakeup
+        self._track_drops = _set_overflow_reporting(sock)
+        self.received = []
+        self.dropped = 0
+        loop.add_reader(sock.fileno(), self._readable)
+
+    def _readable(self):
+        if self._track_drops:
+            self.dropped = max(self.dropped, _drain_counting_drops(self._socket, self.received))
+        else:
+            _drain(self._socket, self.received)
+        if self.received:
+            self._wakeup.set()
+
+    def send(self, addr):
+        try:
+            self._socket.sendto(PING, addr)
+        except OSError as err:
+            _LOGGER.debug("Could not ping %s: %s", addr[0], err)
+            return False
+        return True
+
+    def take(self):
+        received, self.received = self.received, []
+        return received
+
+    def close(self):
+        self._loop.remove_reader(self._socket.fileno())
+        self._socket.close()
+
+
+class DiscoveryJob:
+    """One running or finished scan; every request that joined it shares it."""
+
+    def __init__(self, deadline):
+        self.started = time.monotonic()
+        self.deadline = deadline
+        self.finished = None
+        self.state = STATE_RUNNING
+        self.error = None
+        self.requests = 1
+        self.targets = []
+        self.decoder = PongDecoder()
+        # Devices the registry did not know before this job.
+        self.new_devices = []
+        self.hosts_total = 0
+        self.hosts_probed = 0
+        self.pending_hosts = OrderedDict()
+        # target -> [next ping, interval]
+        self.pings = {}
+        # Set when datagrams arrive or a request joins.
+        self.wakeup = asyncio.Event()
+        self._task = None
+
+    @property
+    def stats(self):
+        return self.decoder.stats
+
+    @property
+    def devices(self):
+        """Return every device that answered so far."""
+        return list(self.decoder.devices.values())
+
+    @property
+    def done(self):
+        return self.state != STATE_RUNNING
+
+    def remaining(self, now=None):
+        """Return the seconds until the broadcast window closes."""
+        if self.done:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.deadline - now)
+
+    def add_hosts(self, hosts):
+        added = [host for host in hosts if host not in self.pending_hosts]
+        self.pending_hosts.update((host, None) for host in added)
+        self.hosts_total += len(added)
+
+    def cancel(self):
+        """Stop the scan; the devices found so far are kept."""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+    async def async_wait(self):
+        """Wait for the job to end and return the devices it found that were new."""
+        if self._task is not None:
+            await asyncio.wait({self._task})
+        return self.new_devices
+
+    def as_dict(self, now=None):
+        now = time.monotonic() if now is None else now
+        end = self.finished if self.finished is not None else now
+        return {
+            'state': self.state,
+            'found': len(self.decoder.devices),
+            'new': len(self.new_devices),
+            'elapsed': round(end - self.started, 1),
+            'remaining': round(self.remaining(now), 1),
+            'requests': self.requests,
+            'hosts_probed': self.hosts_probed,
+            'hosts_total': self.hosts_total,
+            'error': self.error,
+            'stats': self.stats.as_dict(),
+        }
+
+
+class DiscoveryJobManager:
+    """Run discovery scans one at a time and merge overlapping requests."""
+
+    def __init__(self, registry, max_in_flight=PROBE_IN_FLIGHT, probe_timeout=PROBE_TIMEOUT,
+                 port=DEVICE_PORT):
+        self._registry = registry
+        self._max_in_flight = max_in_flight
+        self._probe_timeout = probe_timeout
+        self._port = port
+        self._listeners = []
+        self.job = None
+        self.last_job = None
+
+    @property
+    def running(self):
+        return self._running_job() is not None
+
+    def _running_job(self):
+        """Return the job whose scan is still running, if any.
+
+        self.job is only cleared by the done-callback, which runs a loop
+        iteration after the task ends; a job whose task is done is over.
+        """
+        job = self.job
+        if job is None or job.done or job._task.done():
+            return None
+        return job
+
+    def add_listener(self, progress_callback):
+        """Call progress_callback(job) as a job progresses and when it ends; returns a remover."""
+        self._listeners.append(progress_callback)
+        return lambda: self._listeners.remove(progress_callback)
+
+    def request(self, duration=0, target=None, hosts=(), bind=('', DEVICE_PORT)):
+        """Start a scan, or join the running one, and return its DiscoveryJob.
+
+        target is a broadcast (host, port) to ping for duration seconds and
+        hosts are addresses to ping by unicast. bind only applies when a new
+        scan starts. Must be called from the event loop.
+        """
+        deadline = time.monotonic() + duration
+        job = self._running_job()
+        if job is not None:
+            job.requests += 1
+            job.deadline = max(job.deadline, deadline)
+            _LOGGER.debug("Discovery request joined the running scan, %.1f s left",
+                          job.remaining())
+        else:
+            job = self.job = DiscoveryJob(deadline)
+            job._task = asyncio.get_running_loop().create_task(self._async_run(job, bind))
+            job._task.add_done_callback(lambda task: self._finished(job, task))
+        if target is not None and target not in job.targets:
+            job.targets.append(target)
+        # A new request wants a fresh answer: ping at once and back off again.
+        job.pings.clear()
+        job.add_hosts(hosts)
+        job.wakeup.set()
+        return job
+
+    def cancel(self):
+        """Cancel the running scan; returns False when there is none."""
+        job = self._running_job()
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    async def _async_run(self, job, bind):
+        loop = asyncio.get_running_loop()
+        broadcast = probe = None
+        in_flight = OrderedDict()
+        next_progress = 0.0
+        try:
+            while True:
+                job.wakeup.clear()
+                now = time.monotonic()
+                if job.targets and broadcast is None:
+                    broadcast = _PongCollector(loop, _broadcast_socket(bind), job.wakeup)
+                if job.pending_hosts and probe is None:
+                    probe = _PongCollector(loop, _probe_socket(), job.wakeup)
+
+                # Answers collected first free their probe slots for this pass.
+                self._collect(job, broadcast, probe, in_flight)
+                due = [job.deadline]
+                if now < job.deadline:
+                    for target in job.targets:
+                        ping = job.pings.setdefault(target, [now, PING_INTERVAL])
+                        if now >= ping[0]:
+                            broadcast.send(target)
+                            ping[0] = now + ping[1]
+                            ping[1] = min(ping[1] * 2, MAX_PING_INTERVAL)
+                        due.append(ping[0])
+                self._probe(job, probe, in_flight, now)
+                if in_flight:
+                    due.append(next(iter(in_flight.values())))
+
+                if now >= next_progress:
+                    next_progress = now + PROGRESS_INTERVAL
+                    self._notify(job)
+                if now >= job.deadline and not job.pending_hosts and not in_flight:
+                    break
+                due.append(next_progress)
+
+                timeout = min(when for when in due if when > now) - now
+                try:
+                    await asyncio.wait_for(job.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._collect(job, broadcast, probe, in_flight)
+            for collector in (broadcast, probe):
+                if collector is not None:
+                    collector.close()
+
+    def _finished(self, job, task):
+        job.finished = time.monotonic()
+        if task.cancelled():
+            job.state = STATE_CANCELLED
+        elif task.exception() is not None:
+            job.state = STATE_FAILED
+            job.error = str(task.exception())
+            _LOGGER.error("Discovery failed: %s", job.error)
+        else:
+            job.state = STATE_DONE
+        # A request in the gap before this callback may already have started
+        # the next job.
+        if self.job is job:
+            self.job = None
+        self.last_job = job
+        job.decoder.log()
+        self._notify(job)
+
+    def _probe(self, job, probe, in_flight, now):
+        while in_flight and next(iter(in_flight.values())) <= now:
+            in_flight.popitem(last=False)
+        while job.pending_hosts and len(in_flight) < self._max_in_flight:
+            host, _ = job.pending_hosts.popitem(last=False)
+            job.hosts_probed += 1
+            if probe.send((host, self._port)):
+                in_flight[host] = now + self._probe_timeout
+
+    def _collect(self, job, broadcast, probe, in_flight):
+        dropped = 0
+        for collector in (broadcast, probe):
+            if collector is None:
+                continue
+            received = collector.take()
+            dropped += collector.dropped
+            if collector is probe:
+                for _, addr in received:
+                    in_flight.pop(addr[0], None)
+            job.new_devices += self._registry.add_all(job.decoder.decode(received))
+        job.stats.dropped = max(job.stats.dropped, dropped)
+
+    def _notify(self, job):
+        for progress_callback in list(self._listeners):
+            try:
+                progress_callback(job)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("Discovery progress listener failed")
+
+    def as_dict(self):
+        job = self.job or self.last_job
+        return None if job is None else job.as_dict()
+
+
+def _broadcast_socket(bind):
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DISCOVERY_RCVBUF)
+        _socket.bind(bind)
+    except OSError:
+        _socket.close()
+        raise
+    _socket.setblocking(False)
+    return _socket
+
+
+def _probe_socket():
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PROBE_RCVBUF)
+    _socket.setblocking(False)
+    return _socket
@@ -0,0 +1,178 @@
+"""
+Per-device latency and reliability metrics.
+
+The transports record every exchange here: round trip times into a fixed
+bucket histogram, plus timeout, mismatch, late reply and retry counters and
+a short packet rate window. Recording is a handful of integer updates so it
+stays on for every request.
+"""
+import time
+from bisect import bisect_left
+
+# Upper bounds of the RTT histogram buckets in milliseconds; the last bucket
+# collects everything slower.
+RTT_BUCKETS_MS = (2, 5, 10, 20, 50, 100, 200, 500, 1000)
+RATE_WINDOW = 10
+
+
+class DeviceMetrics:
+    """Counters and RTT histogram for one device."""
+
+    __slots__ = ('sid', 'requests', 'replies', 'timeouts', 'mismatched', 'late',
+                 'retries', 'rtt_buckets', 'rtt_total', 'rtt_max',
+                 '_rate_slots', '_rate_second')
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.requests = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.mismatched = 0
+        self.late = 0
+        self.retries = 0
+        self.rtt_buckets = [0] * (len(RTT_BUCKETS_MS) + 1)
+        self.rtt_total = 0.0
+        self.rtt_max = 0.0
+        self._rate_slots = [0] * RATE_WINDOW
+        self._rate_second = 0
+
+    def record_request(self, retry=False):
+        self.requests += 1
+        if retry:
+            self.retries += 1
+        self._count_packet()
+
+    def record_reply(self, rtt):
+        """Record a matched reply; rtt is in seconds."""
+        rtt_ms = rtt * 1000
+        self.replies += 1
+        self.rtt_buckets[bisect_left(RTT_BUCKETS_MS, rtt_ms)] += 1
+        self.rtt_total += rtt_ms
+        if rtt_ms > self.rtt_max:
+            self.rtt_max = rtt_ms
+        self._count_packet()
+
+    def record_timeout(self):
+        self.timeouts += 1
+
+    def record_mismatch(self):
+        self.mismatched += 1
+
+    def record_late(self):
+        self.late += 1
+        self._count_packet()
+
+    def _count_packet(self):
+        second = int(time.monotonic())
+        if second != self._rate_second:
+            self._rotate(second)
+        self._rate_slots[second % RATE_WINDOW] += 1
+
+    def _rotate(self, second):
+        stale = min(second - self._rate_second, RATE_WINDOW)
+        for offset in range(1, stale + 1):
+            self._rate_slots[(self._rate_second + offset) % RATE_WINDOW] = 0
+        self._rate_second = second
+
+    @property
+    def packets_per_second(self):
+        """Return sent plus received packets per second over the last window."""
+        self._rotate(int(time.monotonic()))
+        return sum(self._rate_slots) / RATE_WINDOW
+
+    @property
+    def loss(self):
+        """Return the share of requests that timed out, in percent."""
+        if not self.requests:
+            return None
+        return round(100 * self.timeouts / self.requests, 1)
+
+    @property
+    def rtt_mean(self):
+        if not self.replies:
+            return None
+        return round(self.rtt_total / self.replies, 1)
+
+    def rtt_percentile(self, percentile):
+        """Return the upper bound of the bucket holding the percentile, in ms."""
+        if not self.replies:
+            return None
+        rank = self.replies * percentile / 100
+        seen = 0
+        for bound, count in zip(RTT_BUCKETS_MS, self.rtt_buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return round(self.rtt_max, 1)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'replies': self.replies,
+            'timeouts': self.timeouts,
+            'mismatched': self.mismatched,
+            'late': self.late,
+            'retries': self.retries,
+            'loss': self.loss,
+            'packets_per_second': self.packets_per_second,
+            'rtt_mean': self.rtt_mean,
+            'rtt_p50': self.rtt_percentile(50),
+            'rtt_p90': self.rtt_percentile(90),
+            'rtt_p99': self.rtt_percentile(99),
+            'rtt_max': round(self.rtt_max, 1),
+            'rtt_histogram': dict(zip(
+                [f'le_{bound}' for bound in RTT_BUCKETS_MS] + ['inf'], self.rtt_buckets)),
+        }
+
+
+class ResourceCounters:
+    """Live periodic pollers and open sockets, to spot leaks across reloads."""
+
+    __slots__ = ('pollers', 'sockets', 'sockets_opened', 'sockets_closed')
+
+    def __init__(self):
+        self.pollers = 0
+        self.sockets = 0
+        self.sockets_opened = 0
+        self.sockets_closed = 0
+
+    def poller_started(self):
+        self.pollers += 1
+
+    def poller_stopped(self):
+        self.pollers -= 1
+
+    def socket_opened(self):
+        self.sockets += 1
+        self.sockets_opened += 1
+
+    def socket_closed(self):
+        self.sockets -= 1
+        self.sockets_closed += 1
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class DoHomeMetrics:
+    """Registry of DeviceMetrics keyed by device sid."""
+
+    def __init__(self):
+        self._devices = {}
+        self.resources = ResourceCounters()
+
+    def get(self, sid):
+        """Return the metrics for sid, creating them on first use."""
+        metrics = self._devices.get(sid)
+        if metrics is None:
+            metrics = self._devices[sid] = DeviceMetrics(sid)
+        return metrics
+
+    def as_dict(self):
+        return {sid: metrics.as_dict() for sid, metrics in self._devices.items()}
+
+    def worst(self, count=5):
+        """Return the sids with the most timeouts, worst first."""
+        ranked = sorted(self._devices.values(),
+                        key=lambda m: (m.timeouts, m.rtt_max), reverse=True)
+        return [metrics.sid for metrics in ranked[:count]]
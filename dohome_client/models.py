@@ -0,0 +1,20 @@
+"""
+Typed DoHome device records.
+
+Devices are passed around as plain dicts, the shape discovery builds from a
+pong frame, so they serialize into captures and diagnostics as they are.
+"""
+from typing import Optional, TypedDict
+
+
+class DeviceInfo(TypedDict):
+    """A discovered device."""
+
+    # Last four characters of the device name, which replies carry in ``dev``.
+    sid: str
+    # Full device name, such as ``Plug_b33b``.
+    name: str
+    # Address the device answers on.
+    sta_ip: Optional[str]
+    # Firmware device type, such as ``_DT-PLUG``; see capabilities.CAPABILITIES.
+    type: Optional[str]
@@ -0,0 +1,399 @@
+"""
+DoHome UDP request/response handling.
+
+DoHome frames carry no request id, so a reply is matched on the device sid
+and the op cmd, and each request is tagged by the socket it was sent from.
+When a request times out its socket is retired and later requests go out
+from a fresh one, so a reply that turns up late can only land on the
+retired socket, where it is counted instead of being taken as the answer
+to the next request.
+
+Consecutive requests also alternate between two sockets, per device and
+cmd in the async transport, so a duplicated reply to one request arrives on
+the socket that is not waiting for the next.
+"""
+import asyncio
+import contextlib
+import functools
+import logging
+import socket
+import time
+from collections import defaultdict
+from threading import Lock
+
+from .budget import COMMAND, POLL
+from .codec import CMD_STATUS, DEVICE_PORT, SOCKET_BUFSIZE, parse_reply
+from .metrics import DoHomeMetrics
+from .trace import RX, TX, UNKNOWN_SID, PacketTrace
+
+_LOGGER = logging.getLogger(__name__)
+
+MAX_RETIRED = 4
+# The shared async socket receives the replies of a whole polling batch at
+# once, which overflows the default receive buffer on large sites.
+ASYNC_RCVBUF = 2 << 20
+
+
+class TransportStats:
+    """Counters for one transport."""
+
+    # requests counts the devices asked, frames the datagrams sent; they
+    # differ for frames addressed to several devices.
+    __slots__ = ('requests', 'frames', 'replies', 'timeouts', 'mismatched', 'late')
+
+    def __init__(self):
+        self.requests = 0
+        self.frames = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.mismatched = 0
+        self.late = 0
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class DoHomeTransport:
+    """Blocking request/response for the synchronous entity callbacks."""
+
+    def __init__(self, timeout=0.5, metrics=None, trace=None, budget=None):
+        self._timeout = timeout
+        self._metrics = metrics if metrics is not None else DoHomeMetrics()
+        self._trace = trace if trace is not None else PacketTrace()
+        self._budget = budget
+        self._sockets = [None, None]
+        self._slot = 0
+        self._retired = []
+        self._lock = Lock()
+        self.stats = TransportStats()
+
+    def send_cmd(self, device, frame, rtn_cmd, retries=0):
+        """Send an encoded frame and return the matching reply op, or None.
+
+        A request that times out is sent again up to retries times.
+        """
+        metrics = self._metrics.get(device["sid"])
+        for attempt in range(retries + 1):
+            # The budget is waited for outside the lock, so a paced request
+            # does not hold up the ones whose slots come first.
+            if not self._wait_for_slot(device, rtn_cmd):
+                continue
+            with self._lock:
+                resp = self._exchange(device, frame, rtn_cmd, metrics, attempt > 0)
+            if resp is not None:
+                return resp
+        return None
+
+    def close(self):
+        """Close the active and retired sockets."""
+        with self._lock:
+            for slot in range(len(self._sockets)):
+                self._retire(slot)
+            for sock in self._retired:
+                self._close_socket(sock)
+            self._retired.clear()
+
+    def _wait_for_slot(self, device, rtn_cmd):
+        """Sleep until the budget's slot for the request; False when it was skipped."""
+        if self._budget is None:
+            return True
+        # A poll whose slot is further away than a timeout is skipped
+        # rather than holding the calling thread; the next tick retries.
+        poll = rtn_cmd == CMD_STATUS
+        delay = self._budget.reserve(POLL if poll else COMMAND, device["sid"],
+                                     self._timeout if poll else None)
+        if delay is None:
+            return False
+        if delay:
+            time.sleep(delay)
+        return True
+
+    def _exchange(self, device, frame, rtn_cmd, metrics, retry):
+        self._drain()
+        self._slot = slot = 1 - self._slot
+        sock = self._sockets[slot]
+        if sock is None:
+            sock = self._sockets[slot] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._metrics.resources.socket_opened()
+
+        trace = self._trace
+        self.stats.requests += 1
+        self.stats.frames += 1
+        metrics.record_request(retry)
+        sock.settimeout(self._timeout)
+        sent = time.monotonic()
+        sock.sendto(frame, (device["sta_ip"], DEVICE_PORT))
+        if trace.enabled:
+            trace.record(device["sid"], TX, frame, 'retry' if retry else 'sent')
+        deadline = sent + self._timeout
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            sock.settimeout(remaining)
+            try:
+                data, _ = sock.recvfrom(SOCKET_BUFSIZE)
+            except socket.timeout:
+                break
+
+            _LOGGER.debug("result :%s", data)
+            try:
+                sid, resp = parse_reply(data)
+            except ValueError:
+                self.stats.mismatched += 1
+                metrics.record_mismatch()
+                if trace.enabled:
+                    trace.record(device["sid"], RX, data, 'malformed')
+                continue
+            if sid == device["sid"] and resp.get('cmd') == rtn_cmd:
+                self.stats.replies += 1
+                metrics.record_reply(time.monotonic() - sent)
+                if trace.enabled:
+                    trace.record(sid, RX, data, 'reply')
+                return resp
+            self.stats.mismatched += 1
+            metrics.record_mismatch()
+            if trace.enabled:
+                trace.record(device["sid"], RX, data, 'mismatch')
+            _LOGGER.debug("Non matching response. Expecting %s/%s, but got %s/%s",
+                          device["sid"], rtn_cmd, sid, resp.get('cmd'))
+
+        self.stats.timeouts += 1
+        metrics.record_timeout()
+        if trace.enabled:
+            trace.record(device["sid"], RX, None, 'timeout')
+        self._retire(slot)
+        return None
+
+    def _retire(self, slot):
+        if self._sockets[slot] is None:
+            return
+        self._retired.append(self._sockets[slot])
+        self._sockets[slot] = None
+        while len(self._retired) > MAX_RETIRED:
+            self._close_socket(self._retired.pop(0))
+
+    def _close_socket(self, sock):
+        sock.close()
+        self._metrics.resources.socket_closed()
+
+    def _drain(self):
+        for sock in [sock for sock in self._sockets if sock] + self._retired:
+            sock.setblocking(False)
+            try:
+                while True:
+                    data, _ = sock.recvfrom(SOCKET_BUFSIZE)
+                    self.stats.late += 1
+                    _record_late(self._metrics, self._trace, data)
+            except (BlockingIOError, InterruptedError):
+                pass
+
+
+def _record_late(metrics, trace, data):
+    try:
+        sid, _ = parse_reply(data)
+    except ValueError:
+        sid = None
+    if sid is not None:
+        metrics.get(sid).record_late()
+    if trace.enabled:
+        trace.record(sid or UNKNOWN_SID, RX, data, 'late')
+
+
+def _record_batch_reply(metrics, sent, future):
+    if not future.cancelled():
+        metrics.record_reply(asyncio.get_running_loop().time() - sent)
+
+
+class _Endpoint(asyncio.DatagramProtocol):
+    """One socket of an async transport and the requests sent from it."""
+
+    def __init__(self, stats, metrics, trace):
+        self.stats = stats
+        self.metrics = metrics
+        self.trace = trace
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.metrics.resources.socket_opened()
+
+    def connection_lost(self, exc):
+        self.metrics.resources.socket_closed()
+
+    def datagram_received(self, data, addr):
+        try:
+            sid, resp = parse_reply(data)
+        except ValueError:
+            self.stats.mismatched += 1
+            if self.trace.enabled:
+                self.trace.record(UNKNOWN_SID, RX, data, 'malformed')
+            return
+        future = self.pending.get((sid, resp.get('cmd')))
+        if future is None or future.done():
+            self.stats.late += 1
+            self.metrics.get(sid).record_late()
+            if self.trace.enabled:
+                self.trace.record(sid, RX, data, 'late')
+            return
+        future.set_result(resp)
+        if self.trace.enabled:
+            self.trace.record(sid, RX, data, 'reply')
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class DoHomeAsyncTransport:
+    """Asyncio request/response shared by any number of devices."""
+
+    def __init__(self, timeout=1.0, metrics=None, trace=None, budget=None):
+        self._timeout = timeout
+        self._metrics = metrics if metrics is not None else DoHomeMetrics()
+        self._trace = trace if trace is not None else PacketTrace()
+        self._budget = budget
+        self._endpoints = [None, None]
+        self._slots = {}
+        self._batch_slot = 0
+        self._retired = []
+        self._locks = defaultdict(asyncio.Lock)
+        self._endpoint_lock = asyncio.Lock()
+        self.stats = TransportStats()
+
+    async def async_send_cmd(self, device, frame, rtn_cmd, retries=0):
+        """Send an encoded frame and return the matching reply op, or None.
+
+        A request that times out is sent again up to retries times.
+        """
+        key = (device["sid"], rtn_cmd)
+        metrics = self._metrics.get(device["sid"])
+        for attempt in range(retries + 1):
+            # The slot is reserved and waited for before the request lock
+            # is taken, so the lock is only held for the exchange itself.
+            await self._async_wait_for_slot(POLL if rtn_cmd == CMD_STATUS else COMMAND, key[0])
+            async with self._locks[key]:
+                resp = await self._async_exchange(device, frame, key, metrics, attempt > 0)
+            if resp is not None:
+                return resp
+        return None
+
+    async def _async_wait_for_slot(self, kind, sid=None):
+        """Sleep until the budget's slot for a packet of kind."""
+        if self._budget is not None:
+            delay = self._budget.reserve(kind, sid)
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def _async_exchange(self, device, frame, key, metrics, retry):
+        loop = asyncio.get_running_loop()
+        slot = self._slots[key] = 1 - self._slots.get(key, 1)
+        endpoint = await self._async_endpoint(slot)
+        future = loop.create_future()
+        endpoint.pending[key] = future
+        self.stats.requests += 1
+        self.stats.frames += 1
+        metrics.record_request(retry)
+        sent = loop.time()
+        try:
+            endpoint.transport.sendto(frame, (device["sta_ip"], DEVICE_PORT))
+            if self._trace.enabled:
+                self._trace.record(key[0], TX, frame, 'retry' if retry else 'sent')
+            resp = await asyncio.wait_for(future, self._timeout)
+        except asyncio.TimeoutError:
+            self.stats.timeouts += 1
+            metrics.record_timeout()
+            if self._trace.enabled:
+                self._trace.record(key[0], RX, None, 'timeout')
+            self._retire(endpoint)
+            _LOGGER.debug("Timeout waiting for %s from %s", key[1], device["sta_ip"])
+            return None
+        finally:
+            del endpoint.pending[key]
+        self.stats.replies += 1
+        metrics.record_reply(loop.time() - sent)
+        return resp
+
+    async def async_send_batch(self, devices, frame, rtn_cmd, target):
+        """Send one frame addressed to several devices to target, usually a broadcast address.
+
+        Returns {sid: reply op, or None for a device that did not answer}.
+        The devices' request locks are held for the exchange, so it cannot
+        take a reply meant for a single request to one of them.
+        """
+        loop = asyncio.get_running_loop()
+        keys = sorted((device["sid"], rtn_cmd) for device in devices)
+        await self._async_wait_for_slot(POLL if rtn_cmd == CMD_STATUS else COMMAND)
+        async with contextlib.AsyncExitStack() as stack:
+            for key in keys:
+                await stack.enter_async_context(self._locks[key])
+            self._batch_slot = slot = 1 - self._batch_slot
+            endpoint = await self._async_endpoint(slot)
+            sent = loop.time()
+            futures = {}
+            for key in keys:
+                # The next single request to the device goes out from the other socket.
+                self._slots[key] = slot
+                metrics = self._metrics.get(key[0])
+                metrics.record_request(False)
+                future = endpoint.pending[key] = loop.create_future()
+                future.add_done_callback(functools.partial(_record_batch_reply, metrics, sent))
+                futures[key] = future
+            self.stats.requests += len(keys)
+            self.stats.frames += 1
+            try:
+                endpoint.transport.sendto(frame, (target, DEVICE_PORT))
+                if self._trace.enabled:
+                    for sid, _ in keys:
+                        self._trace.record(sid, TX, frame, 'batch')
+                if futures:
+                    await asyncio.wait(futures.values(), timeout=self._timeout)
+            finally:
+                for key in keys:
+                    del endpoint.pending[key]
+
+        replies = {}
+        for (sid, _), future in futures.items():
+            if future.done():
+                self.stats.replies += 1
+                replies[sid] = future.result()
+                continue
+            future.cancel()
+            self.stats.timeouts += 1
+            self._metrics.get(sid).record_timeout()
+            if self._trace.enabled:
+                self._trace.record(sid, RX, None, 'timeout')
+            replies[sid] = None
+        if None in replies.values():
+            self._retire(endpoint)
+        return replies
+
+    def close(self):
+        """Close every endpoint."""
+        for endpoint in self._endpoints:
+            if endpoint is not None:
+                self._retire(endpoint)
+        for endpoint in self._retired:
+            endpoint.close()
+        self._retired.clear()
+
+    async def _async_endpoint(self, slot):
+        async with self._endpoint_lock:
+            if self._endpoints[slot] is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, ASYNC_RCVBUF)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                sock.bind(('', 0))
+                _, self._endpoints[slot] = await asyncio.get_running_loop().create_datagram_endpoint(
+                    lambda: _Endpoint(self.stats, self._metrics, self._trace), sock=sock)
+            return self._endpoints[slot]
+
+    def _retire(self, endpoint):
+        if endpoint not in self._endpoints:
+            return
+        self._endpoints[self._endpoints.index(endpoint)] = None
+        self._retired.append(endpoint)
+        while len(self._retired) > MAX_RETIRED:
+            self._retired.pop(0).close()
@@ -0,0 +1,42 @@
+"""
+Registry of the devices found so far.
+
+Broadcast discovery, unicast probes and repeated runs of both report the
+same devices again; the registry keeps one record per device and tells the
+caller which ones are new.
+"""
+from collections import defaultdict
+from threading import Lock
+
+
+class DeviceRegistry:
+    """Known devices, grouped by device type."""
+
+    def __init__(self):
+        self.devices = defaultdict(list)
+        self._by_sid = {}
+        self._lock = Lock()
+
+    def add(self, device):
+        """Record device and return True if it was not known yet."""
+        with self._lock:
+            if device in self.devices[device["type"]]:
+                return False
+            self.devices[device["type"]].append(device)
+            self._by_sid[device["sid"]] = device
+            return True
+
+    def add_all(self, devices):
+        """Record devices and return the ones that were new."""
+        return [device for device in devices if self.add(device)]
+
+    def get(self, sid):
+        """Return the device with sid, or None."""
+        return self._by_sid.get(sid)
+
+    def all(self):
+        """Return every known device."""
+        return [device for devices in self.devices.values() for device in devices]
+
+    def __len__(self):
+        return len(self._by_sid)
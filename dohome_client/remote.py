@@ -0,0 +1,199 @@
+"""
+Subscriber side of the gateway daemon.
+
+DoHomeRemote keeps a connection to the daemon, mirrors its device list and
+the last state of every device, and calls listeners with each state the
+daemon streams. It offers the same ``async_send_cmd`` as the async
+transport, so callers written against a transport can send through the
+daemon unchanged, and a blocking ``send_cmd`` for executor threads.
+
+Every connection starts with a hello carrying the daemon's shared token.
+The connection is re-established after it drops; requests made while it is
+down answer None, like a request that timed out.
+"""
+import asyncio
+import json
+import logging
+from collections import defaultdict
+
+from .daemon import (DEFAULT_PORT, EVENT_DEVICES, EVENT_ERROR, EVENT_REPLY, EVENT_STATE,
+                     OP_DISCOVER, OP_HELLO, OP_SEND, encode_message)
+from .protocol import TransportStats
+from .registry import DeviceRegistry
+
+_LOGGER = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 5
+REQUEST_TIMEOUT = 5.0
+STREAM_LIMIT = 1 << 20
+
+
+def parse_address(address):
+    """Return a Unix socket path, or (host, port) for ``host[:port]``."""
+    if address.startswith('/'):
+        return address
+    host, _, port = address.partition(':')
+    return host, int(port) if port else DEFAULT_PORT
+
+
+class DoHomeRemote:
+    """Connection to a DoHome gateway daemon."""
+
+    def __init__(self, address, token, timeout=REQUEST_TIMEOUT):
+        self.address = address
+        self._token = token
+        self._timeout = timeout
+        self.registry = DeviceRegistry()
+        self.states = {}
+        self.stats = TransportStats()
+        self._listeners = defaultdict(list)
+        self._device_listeners = []
+        self._pending = {}
+        self._next_id = 0
+        self._writer = None
+        self._loop = None
+        self._task = None
+        self._ready = None
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    async def async_start(self, wait=REQUEST_TIMEOUT):
+        """Connect and wait up to wait seconds for the device list."""
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._task = self._loop.create_task(self._async_run())
+        try:
+            await asyncio.wait_for(self._ready.wait(), wait)
+        except asyncio.TimeoutError:
+            _LOGGER.warning("DoHome daemon at %s is not answering yet", self.address)
+
+    def stop(self):
+        """Disconnect and stop reconnecting."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._close()
+
+    def add_listener(self, sid, update_callback):
+        """Call update_callback with every state of sid; returns a remover."""
+        self._listeners[sid].append(update_callback)
+        if sid in self.states:
+            update_callback(self.states[sid])
+
+        def remove_listener():
+            self._listeners[sid].remove(update_callback)
+            if not self._listeners[sid]:
+                del self._listeners[sid]
+        return remove_listener
+
+    def add_devices_listener(self, devices_callback):
+        """Call devices_callback with the devices the daemon reports as new."""
+        self._device_listeners.append(devices_callback)
+        return lambda: self._device_listeners.remove(devices_callback)
+
+    async def async_send_cmd(self, device, frame, rtn_cmd, retries=0):
+        """Have the daemon send an encoded frame and return the reply op, or None."""
+        self.stats.requests += 1
+        resp = await self.async_request(OP_SEND, sid=device['sid'], frame=frame.decode(),
+                                        cmd=rtn_cmd, retries=retries)
+        if resp is None:
+            self.stats.timeouts += 1
+        else:
+            self.stats.replies += 1
+        return resp
+
+    def send_cmd(self, device, frame, rtn_cmd, retries=0):
+        """Blocking async_send_cmd, for threads other than the event loop's."""
+        return asyncio.run_coroutine_threadsafe(
+            self.async_send_cmd(device, frame, rtn_cmd, retries), self._loop).result()
+
+    async def async_discover(self):
+        """Have the daemon rediscover and return the devices that were new."""
+        return await self.async_request(OP_DISCOVER) or []
+
+    async def async_request(self, op, **fields):
+        """Send one request and return its result, or None."""
+        if self._writer is None:
+            return None
+        self._next_id += 1
+        request_id = self._next_id
+        future = self._pending[request_id] = self._loop.create_future()
+        self._writer.write(encode_message({'id': request_id, 'op': op, **fields}))
+        try:
+            return await asyncio.wait_for(future, self._timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _async_run(self):
+        while True:
+            try:
+                if isinstance(parse_address(self.address), str):
+                    reader, self._writer = await asyncio.open_unix_connection(
+                        self.address, limit=STREAM_LIMIT)
+                else:
+                    host, port = parse_address(self.address)
+                    reader, self._writer = await asyncio.open_connection(
+                        host, port, limit=STREAM_LIMIT)
+                self._writer.write(encode_message({'op': OP_HELLO, 'token': self._token}))
+                _LOGGER.info("Connected to the DoHome daemon at %s", self.address)
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._handle_line(line)
+            except (OSError, ValueError) as err:
+                # ValueError: a line longer than STREAM_LIMIT.
+                _LOGGER.debug("DoHome daemon connection: %s", err)
+            except Exception:  # pylint: disable=broad-except
+                _LOGGER.exception("DoHome daemon connection failed")
+            self._close()
+            _LOGGER.warning("Lost the DoHome daemon at %s, reconnecting", self.address)
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _handle_line(self, line):
+        # A bad message or a failing listener costs that message, not the
+        # connection and every entity's updates with it.
+        try:
+            self._dispatch(json.loads(line))
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("Error handling DoHome daemon message %r", line[:200])
+
+    def _dispatch(self, message):
+        event = message.get('event')
+        if event == EVENT_STATE:
+            sid = message['sid']
+            self.states[sid] = message['status']
+            for listener in list(self._listeners.get(sid, ())):
+                _call_listener(listener, message['status'])
+        elif event == EVENT_REPLY:
+            future = self._pending.get(message.get('id'))
+            if future is not None and not future.done():
+                future.set_result(message.get('result'))
+        elif event == EVENT_ERROR:
+            _LOGGER.warning("The DoHome daemon at %s refused the connection: %s",
+                            self.address, message.get('error'))
+        elif event == EVENT_DEVICES:
+            new = self.registry.add_all(message['devices'])
+            self._ready.set()
+            if new:
+                for listener in list(self._device_listeners):
+                    _call_listener(listener, new)
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(None)
+
+
+def _call_listener(listener, value):
+    try:
+        listener(value)
+    except Exception:  # pylint: disable=broad-except
+        _LOGGER.exception("DoHome daemon listener failed")
@@ -0,0 +1,206 @@
+"""
+Device shadows: desired versus reported state.
+
+A shadow keeps, per device, the cmd 25 status values Home Assistant wants
+(desired) and the ones the device last reported. Entities record the state
+they want with ``set_desired``, which returns only the values that differ
+from the reported ones; an empty result means the device is already there
+and nothing needs sending. Status replies go to ``report``.
+
+A desired value stays pending until a report confirms it. A value that
+drifts away from desired is handled according to why it drifted:
+
+* the device was unreachable for ``stale_after`` seconds, e.g. it lost
+  power or WiFi and came back in its default state: the desired value is
+  pending again, so reconciliation restores it;
+* the device was reachable: someone used the device's own button or app,
+  and the desired value follows the report instead of fighting it.
+
+``async_reconcile`` resends the values that stayed pending for ``settle``
+seconds through the reconcilers the entities registered, and gives up on a
+value after ``max_attempts`` sends by adopting what the device reports. A
+reconciler registers how often its entity reads the device back, and a
+device's settle time is at least ``SETTLE_INTERVALS`` of those intervals:
+a command is only resent once a report could have confirmed it.
+"""
+import asyncio
+import logging
+import time
+from threading import Lock
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_STALE_AFTER = 30.0
+DEFAULT_SETTLE = 5.0
+DEFAULT_MAX_ATTEMPTS = 3
+SETTLE_INTERVALS = 2
+
+_UNKNOWN = object()
+
+
+class DeviceShadow:
+    """Desired and reported status values of one device."""
+
+    def __init__(self, sid):
+        self.sid = sid
+        self.desired = {}
+        self.reported = {}
+        self.reported_at = None
+        # key -> [time sent, times sent] for desired values not confirmed yet.
+        self._pending = {}
+        self._offline = False
+        self._reconcilers = []
+        self._lock = Lock()
+
+    def set_desired(self, values, now=None):
+        """Record values as desired and return the ones the device does not report yet."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.desired.update(values)
+            changes = {key: value for key, value in values.items()
+                       if self.reported.get(key, _UNKNOWN) != value}
+            for key in values:
+                if key in changes:
+                    self._pending[key] = [now, 1]
+                else:
+                    self._pending.pop(key, None)
+            return changes
+
+    def report(self, values, now=None):
+        """Merge reported status values and settle the desired ones they answer."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            came_back, self._offline = self._offline, False
+            self.reported.update(values)
+            self.reported_at = now
+            for key, value in values.items():
+                desired = self.desired.get(key, _UNKNOWN)
+                if desired is _UNKNOWN:
+                    continue
+                if desired == value:
+                    self._pending.pop(key, None)
+                elif came_back:
+                    self._pending.setdefault(key, [now, 0])
+                elif key not in self._pending:
+                    self.desired[key] = value
+
+    def check_stale(self, stale_after, now=None):
+        """Mark the device offline when it has not reported for stale_after seconds."""
+        now = time.monotonic() if now is None else now
+        if self.reported_at is not None and now - self.reported_at > stale_after:
+            self._offline = True
+        return self._offline
+
+    def settle(self, settle):
+        """Return settle, raised to SETTLE_INTERVALS of the slowest report interval."""
+        report_interval = max((interval for _, _, interval in self._reconcilers), default=0.0)
+        return max(settle, report_interval * SETTLE_INTERVALS)
+
+    def drift(self, settle, max_attempts, now=None):
+        """Return the desired values to send again and count the attempt.
+
+        Values that were already sent max_attempts times are dropped, and
+        desired adopts the reported value; the result's second item counts
+        them.
+        """
+        now = time.monotonic() if now is None else now
+        settle = self.settle(settle)
+        drift = {}
+        adopted = 0
+        with self._lock:
+            for key, attempt in list(self._pending.items()):
+                if now - attempt[0] < settle:
+                    continue
+                if attempt[1] >= max_attempts:
+                    del self._pending[key]
+                    adopted += 1
+                    if key in self.reported:
+                        self.desired[key] = self.reported[key]
+                    continue
+                attempt[0] = now
+                attempt[1] += 1
+                drift[key] = self.desired[key]
+        return drift, adopted
+
+    def pending(self):
+        """Return {key: (desired, reported)} for the values not confirmed yet."""
+        with self._lock:
+            return {key: (self.desired[key], self.reported.get(key)) for key in self._pending}
+
+    def add_reconciler(self, keys, reconcile_callback, report_interval=0.0):
+        """Have reconcile_callback(drift) resend drifted values of keys; returns a remover.
+
+        reconcile_callback returns an awaitable. report_interval is how
+        often, in seconds, the entity reads keys back from the device.
+        """
+        entry = (frozenset(keys), reconcile_callback, report_interval)
+        self._reconcilers.append(entry)
+        return lambda: self._reconcilers.remove(entry)
+
+    def reconcilers(self, drift):
+        """Return (callback, values) for each reconciler of a drifted key."""
+        return [(reconcile_callback, {key: drift[key] for key in keys if key in drift})
+                for keys, reconcile_callback, _ in self._reconcilers
+                if not keys.isdisjoint(drift)]
+
+
+class ShadowStore:
+    """Shadows of every device, with counters and background reconciliation."""
+
+    def __init__(self, stale_after=DEFAULT_STALE_AFTER, settle=DEFAULT_SETTLE,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.stale_after = stale_after
+        self.settle = settle
+        self.max_attempts = max_attempts
+        self._shadows = {}
+        self.sent = 0
+        self.suppressed = 0
+        self.reconciled = 0
+        self.adopted = 0
+
+    def get(self, sid):
+        """Return the shadow of sid, creating it on first use."""
+        shadow = self._shadows.get(sid)
+        if shadow is None:
+            shadow = self._shadows.setdefault(sid, DeviceShadow(sid))
+        return shadow
+
+    def set_desired(self, sid, values, now=None):
+        """DeviceShadow.set_desired, counting sent and suppressed commands."""
+        changes = self.get(sid).set_desired(values, now)
+        if changes:
+            self.sent += 1
+        else:
+            self.suppressed += 1
+        return changes
+
+    async def async_reconcile(self, now=None):
+        """Resend drifted desired values; returns the number of reconciler calls."""
+        now = time.monotonic() if now is None else now
+        sends = []
+        for shadow in list(self._shadows.values()):
+            shadow.check_stale(self.stale_after, now)
+            drift, adopted = shadow.drift(self.settle, self.max_attempts, now)
+            if adopted:
+                self.adopted += adopted
+                _LOGGER.info("Gave up restoring %d values of %s", adopted, shadow.sid)
+            if drift:
+                _LOGGER.debug("Reconciling %s: %s", shadow.sid, drift)
+                for reconcile_callback, values in shadow.reconcilers(drift):
+                    self.reconciled += len(values)
+                    sends.append(reconcile_callback(values))
+        if sends:
+            await asyncio.gather(*sends)
+        return len(sends)
+
+    def as_dict(self):
+        return {
+            'devices': len(self._shadows),
+            'sent': self.sent,
+            'suppressed': self.suppressed,
+            'reconciled': self.reconciled,
+            'adopted': self.adopted,
+            'drifting': {sid: pending for sid, pending in
+                         ((sid, shadow.pending()) for sid, shadow in self._shadows.items())
+                         if pending},
+        }
@@ -0,0 +1,223 @@
+"""
+Sharded multi-process status polling.
+
+One process polling a thousand devices every second spends most of its time
+in per-packet Python overhead under a single GIL. The sharded poller
+partitions the devices by a stable hash of their sid across worker
+processes. Each worker runs its own event loop and async transport with its
+own sockets, polls its shard with cmd 25 and sends back only what changed:
+a list of ``(sid, {key: value})`` deltas per round plus the round's
+counters. The coordinating process merges the deltas into the full state of
+every device and calls its listeners with them.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import zlib
+
+from .budget import PacketBudget
+from .codec import CMD_STATUS, status_frame
+from .metrics import DoHomeMetrics
+from .protocol import DoHomeAsyncTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+# Reply keys that change on every reply and are not device state.
+IGNORED_KEYS = frozenset(('seq',))
+STOP_TIMEOUT = 5
+
+_CONTROL_DEVICES = 'devices'
+_CONTROL_STOP = 'stop'
+
+_MISSING = object()
+
+
+def shard_of(sid, shards):
+    """Return the shard of sid; stable across processes, unlike hash()."""
+    return zlib.crc32(sid.encode()) % shards
+
+
+def partition(devices, shards):
+    """Split devices into shards lists by sid."""
+    parts = [[] for _ in range(shards)]
+    for device in devices:
+        parts[shard_of(device['sid'], shards)].append(device)
+    return parts
+
+
+def status_delta(known, resp):
+    """Return the values of resp that differ from known and merge them into known."""
+    changed = {key: value for key, value in resp.items()
+               if key not in IGNORED_KEYS and known.get(key, _MISSING) != value}
+    known.update(changed)
+    return changed
+
+
+def _worker(conn, devices, interval, timeout, packet_rate):
+    """Worker process entry point."""
+    try:
+        asyncio.run(_async_worker(conn, devices, interval, timeout, packet_rate))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _async_worker(conn, devices, interval, timeout, packet_rate):
+    loop = asyncio.get_running_loop()
+    budget = PacketBudget(packet_rate) if packet_rate else None
+    transport = DoHomeAsyncTransport(timeout, metrics=DoHomeMetrics(), budget=budget)
+    frames = {}
+    last = {}
+    stop = asyncio.Event()
+
+    def set_devices(shard):
+        devices[:] = shard
+        frames.clear()
+        frames.update((device['sid'], status_frame(device['sid'])) for device in shard)
+
+    def on_control():
+        try:
+            while conn.poll():
+                kind, payload = conn.recv()
+                if kind == _CONTROL_DEVICES:
+                    set_devices(payload)
+                elif kind == _CONTROL_STOP:
+                    stop.set()
+        except EOFError:
+            stop.set()
+
+    set_devices(list(devices))
+    loop.add_reader(conn.fileno(), on_control)
+    try:
+        while not stop.is_set():
+            start = loop.time()
+            batch = list(devices)
+            replies = await asyncio.gather(*(
+                transport.async_send_cmd(device, frames[device['sid']], CMD_STATUS)
+                for device in batch))
+            deltas = []
+            answered = 0
+            for device, resp in zip(batch, replies):
+                if resp is None:
+                    continue
+                answered += 1
+                changed = status_delta(last.setdefault(device['sid'], {}), resp)
+                if changed:
+                    deltas.append((device['sid'], changed))
+            conn.send((deltas, len(batch), answered, loop.time() - start))
+            try:
+                await asyncio.wait_for(stop.wait(), max(0, start + interval - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        loop.remove_reader(conn.fileno())
+        transport.close()
+        conn.close()
+
+
+class ShardStats:
+    """Counters for one worker."""
+
+    __slots__ = ('rounds', 'polls', 'answered', 'deltas', 'round_seconds')
+
+    def __init__(self):
+        self.rounds = 0
+        self.polls = 0
+        self.answered = 0
+        self.deltas = 0
+        self.round_seconds = 0.0
+
+    def as_dict(self):
+        return {key: round(getattr(self, key), 4) for key in self.__slots__}
+
+
+class ShardedPoller:
+    """Poll devices from a pool of worker processes and merge their deltas."""
+
+    def __init__(self, workers=None, interval=1.0, timeout=1.0, packet_budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._interval = interval
+        self._timeout = timeout
+        # Each worker paces its polls to an equal part of the site budget.
+        self._packet_rate = packet_budget / self.workers if packet_budget else None
+        self.states = {}
+        self.stats = [ShardStats() for _ in range(self.workers)]
+        self._listeners = []
+        self._processes = []
+        self._conns = []
+        self._loop = None
+
+    @property
+    def running(self):
+        return bool(self._processes)
+
+    def add_listener(self, delta_callback):
+        """Call delta_callback(sid, changes) for every delta; returns a remover."""
+        self._listeners.append(delta_callback)
+        return lambda: self._listeners.remove(delta_callback)
+
+    def start(self, devices):
+        """Start the workers with devices; call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        # Forking a process that runs an event loop and threads is unsafe.
+        context = multiprocessing.get_context('spawn')
+        for index, shard in enumerate(partition(devices, self.workers)):
+            conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker,
+                args=(child_conn, shard, self._interval, self._timeout, self._packet_rate),
+                name=f'dohome_shard_{index}', daemon=True)
+            process.start()
+            child_conn.close()
+            self._loop.add_reader(conn.fileno(), self._receive, index)
+            self._conns.append(conn)
+            self._processes.append(process)
+        _LOGGER.info("Polling %d devices from %d worker processes", len(devices), self.workers)
+
+    def set_devices(self, devices):
+        """Repartition the workers onto a new device list."""
+        for conn, shard in zip(self._conns, partition(devices, self.workers)):
+            conn.send((_CONTROL_DEVICES, shard))
+
+    def stop(self):
+        """Stop and join the workers."""
+        for conn in self._conns:
+            self._loop.remove_reader(conn.fileno())
+            try:
+                conn.send((_CONTROL_STOP, None))
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        for conn in self._conns:
+            conn.close()
+        self._conns.clear()
+        self._processes.clear()
+
+    def _receive(self, index):
+        conn = self._conns[index]
+        stats = self.stats[index]
+        try:
+            while conn.poll():
+                deltas, polls, answered, seconds = conn.recv()
+                stats.rounds += 1
+                stats.polls += polls
+                stats.answered += answered
+                stats.deltas += len(deltas)
+                stats.round_seconds = seconds
+                for sid, changes in deltas:
+                    self.states.setdefault(sid, {}).update(changes)
+                    for listener in self._listeners:
+                        listener(sid, changes)
+        except (EOFError, OSError):
+            _LOGGER.warning("DoHome shard %d exited", index)
+            self._loop.remove_reader(conn.fileno())
+
+    def as_dict(self):
+        return {
+            'workers': self.workers,
+            'devices': len(self.states),
+            'shards': [stats.as_dict() for stats in self.stats],
+        }
@@ -0,0 +1,135 @@
+"""
+Whole-site snapshot and restore of relay and color state.
+
+A snapshot is one concurrent cmd 25 sweep of every device, keeping the
+status values that can be set again: each switch's relay key and a light's
+five color channels, in the same ``{key: value}`` form the device shadows
+use. Restoring sweeps the devices, sends only the relays and colors that
+differ from the snapshot, with at most ``parallel`` requests in flight, and
+sweeps again to verify; devices that still differ, or did not answer, are
+sent again for up to ``attempts`` rounds.
+"""
+import asyncio
+import time
+
+from .capabilities import entity_specs
+from .codec import CMD_COLOR, CMD_POWER, CMD_STATUS, ctrl_frame, power_op, status_frame
+from .color import CHANNELS, channels_op
+
+DEFAULT_PARALLEL = 32
+DEFAULT_ATTEMPTS = 3
+
+
+def restorable_state(device, status):
+    """Return the relay and color values of a status reply that a restore can set."""
+    values = {}
+    for spec in entity_specs(device, 'switch'):
+        if spec.key in status:
+            values[spec.key] = int(bool(status[spec.key]))
+    if entity_specs(device, 'light'):
+        try:
+            values.update((channel, int(status[channel])) for channel in CHANNELS)
+        except (KeyError, TypeError, ValueError):
+            pass
+    return values
+
+
+def restore_frames(device, values):
+    """Return the (frame, cmd) requests that set values on device.
+
+    A light's channels missing from values are sent as 0, so pass all five.
+    """
+    frames = []
+    for spec in entity_specs(device, 'switch'):
+        if spec.key in values:
+            on = bool(values[spec.key]) != spec.inverted
+            frames.append((ctrl_frame(device['sid'], power_op(spec.command, 1 if on else 0)),
+                           CMD_POWER))
+    if entity_specs(device, 'light') and any(channel in values for channel in CHANNELS):
+        frames.append((ctrl_frame(device['sid'], channels_op(
+            [values.get(channel, 0) for channel in CHANNELS])), CMD_COLOR))
+    return frames
+
+
+async def async_sweep(transport, devices, parallel=DEFAULT_PARALLEL, retries=1):
+    """Poll devices concurrently; returns {sid: restorable values, or None}."""
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def status(device):
+        async with semaphore:
+            resp = await transport.async_send_cmd(
+                device, status_frame(device['sid']), CMD_STATUS, retries)
+        return None if resp is None else restorable_state(device, resp)
+
+    states = await asyncio.gather(*(status(device) for device in devices))
+    return {device['sid']: state for device, state in zip(devices, states)}
+
+
+async def async_snapshot(transport, devices, parallel=DEFAULT_PARALLEL, retries=1):
+    """Return a snapshot of every device that answered and the sids that did not."""
+    start = time.monotonic()
+    states = await async_sweep(transport, devices, parallel, retries)
+    return {
+        'taken': time.time(),
+        'seconds': round(time.monotonic() - start, 3),
+        'devices': {device['sid']: {'device': device, 'values': states[device['sid']]}
+                    for device in devices if states[device['sid']]},
+        'missing': [sid for sid, state in states.items() if state is None],
+    }
+
+
+async def async_restore(transport, snapshot, parallel=DEFAULT_PARALLEL,
+                        attempts=DEFAULT_ATTEMPTS, retries=1, registry=None):
+    """Reapply a snapshot and verify it; returns a summary with the sids that failed.
+
+    Devices found in registry are addressed at their current address rather
+    than the one recorded in the snapshot.
+    """
+    start = time.monotonic()
+    semaphore = asyncio.Semaphore(parallel)
+    entries = snapshot['devices']
+    devices = {sid: (registry.get(sid) if registry is not None else None) or entry['device']
+               for sid, entry in entries.items()}
+
+    async def send(device, frame, cmd):
+        async with semaphore:
+            return await transport.async_send_cmd(device, frame, cmd, retries)
+
+    def differences(current):
+        diffs = {}
+        for sid, state in current.items():
+            values = entries[sid]['values']
+            diff = {key: value for key, value in values.items()
+                    if state is None or state.get(key) != value}
+            # One cmd 6 frame sets every channel, so a light that differs in
+            # any channel is sent all of them.
+            if not diff.keys().isdisjoint(CHANNELS):
+                diff.update((channel, values[channel]) for channel in CHANNELS
+                            if channel in values)
+            diffs[sid] = diff
+        return diffs
+
+    pending = {sid: diff for sid, diff in
+               differences(await async_sweep(transport, list(devices.values()),
+                                             parallel)).items() if diff}
+    unchanged = len(entries) - len(pending)
+    rounds = commands = 0
+    while pending and rounds < attempts:
+        rounds += 1
+        requests = [(devices[sid], frame, cmd)
+                    for sid, diff in pending.items()
+                    for frame, cmd in restore_frames(devices[sid], diff)]
+        commands += len(requests)
+        await asyncio.gather(*(send(*request) for request in requests))
+        current = await async_sweep(transport, [devices[sid] for sid in pending], parallel)
+        pending = {sid: diff for sid, diff in differences(current).items() if diff}
+
+    return {
+        'devices': len(entries),
+        'unchanged': unchanged,
+        'restored': len(entries) - unchanged - len(pending),
+        'failed': sorted(pending),
+        'rounds': rounds,
+        'commands': commands,
+        'seconds': round(time.monotonic() - start, 3),
+    }
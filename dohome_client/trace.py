@@ -0,0 +1,121 @@
+"""
+Packet trace ring buffers.
+
+When enabled, the transports keep the most recent raw frames per device with
+a timestamp, direction and outcome. Call sites guard every record with
+``if trace.enabled`` so a disabled trace costs one attribute read. The
+buffers are recorded into from any thread and read from snapshots taken
+under a lock.
+
+A trace can also be saved as a capture: gzipped JSON lines holding the
+devices followed by every frame in time order, which tools/replay.py serves
+back on loopback.
+"""
+import gzip
+import json
+import time
+from collections import deque
+from threading import Lock
+
+DEFAULT_SIZE = 200
+UNKNOWN_SID = 'unknown'
+
+TX = 'tx'
+RX = 'rx'
+
+CAPTURE_VERSION = 1
+
+
+class PacketTrace:
+    """Bounded per-device history of sent and received frames."""
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.enabled = False
+        self._size = size
+        self._buffers = {}
+        self._lock = Lock()
+
+    def enable(self, size=None):
+        """Start recording, optionally resizing the buffers."""
+        if size is not None and size != self._size:
+            with self._lock:
+                self._size = size
+                self._buffers = {sid: deque(buffer, maxlen=size)
+                                 for sid, buffer in self._buffers.items()}
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording and keep what was captured."""
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._buffers = {}
+
+    def record(self, sid, direction, data, outcome):
+        """Append one frame to the buffer of sid."""
+        entry = (time.time(), direction, outcome, data)
+        with self._lock:
+            buffer = self._buffers.get(sid)
+            if buffer is None:
+                buffer = self._buffers[sid] = deque(maxlen=self._size)
+            buffer.append(entry)
+
+    def _snapshot(self):
+        """Return {sid: list of frames}, copied while no frame is being recorded."""
+        with self._lock:
+            return {sid: list(buffer) for sid, buffer in self._buffers.items()}
+
+    def dump(self, sid=None):
+        """Return the captured frames, oldest first, keyed by sid."""
+        buffers = self._snapshot()
+        sids = [sid] if sid is not None else list(buffers)
+        return {
+            key: [
+                {
+                    'time': timestamp,
+                    'direction': direction,
+                    'outcome': outcome,
+                    'data': data.decode('utf-8', 'backslashreplace') if data else None,
+                }
+                for timestamp, direction, outcome, data in buffers.get(key, ())
+            ]
+            for key in sids
+        }
+
+    def save(self, path, devices):
+        """Write the captured frames of all devices to a capture file."""
+        # Sorted by time alone: data can be None, which does not compare with bytes.
+        frames = sorted(
+            ((timestamp, sid, direction, outcome, data)
+             for sid, buffer in self._snapshot().items()
+             for timestamp, direction, outcome, data in buffer),
+            key=lambda frame: frame[0])
+        start = frames[0][0] if frames else time.time()
+        with gzip.open(path, 'wt', encoding='utf-8') as capture:
+            capture.write(json.dumps({'version': CAPTURE_VERSION, 'start': start,
+                                      'devices': devices}) + '\n')
+            for timestamp, sid, direction, outcome, data in frames:
+                capture.write(json.dumps([
+                    round(timestamp - start, 6), sid, direction, outcome,
+                    data.decode('utf-8', 'backslashreplace') if data else None,
+                ], separators=(',', ':')) + '\n')
+        return len(frames)
+
+
+def load_capture(path):
+    """Return (devices, frames) from a capture file written by PacketTrace.save.
+
+    Each frame is a (offset, sid, direction, outcome, data) tuple with the
+    offset in seconds from the first frame and data as bytes or None.
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as capture:
+        header = json.loads(capture.readline())
+        if header.get('version') != CAPTURE_VERSION:
+            raise ValueError(f"unsupported capture version {header.get('version')}")
+        frames = []
+        for line in capture:
+            offset, sid, direction, outcome, data = json.loads(line)
+            frames.append((offset, sid, direction, outcome,
+                           data.encode('utf-8') if data is not None else None))
+    return header['devices'], frames
@@ -1,28 +1,120 @@
+import asyncio
 import socket
+import json
 import logging
 import voluptuous as vol
 import homeassistant.helpers.config_validation as cv
-from concurrent.futures import ThreadPoolExecutor
-from collections import defaultdict
-from homeassistant.helpers import discovery
+from threading import Lock
+from datetime import timedelta
+from homeassistant.config_entries import SOURCE_IMPORT
+from homeassistant.const import EVENT_HOMEASSISTANT_STOP
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect, async_dispatcher_send
 from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.event import async_track_time_interval
+
+from dohome_client import (DEVICE_PLATFORMS, DoHomeClient, DoHomeMetrics, PacketBudget,
+                           PacketTrace, ShadowStore, expand_hosts)
+from dohome_client.codec import DEVICE_PORT
+from dohome_client.budget import DEFAULT_RATE as DEFAULT_PACKET_BUDGET
+from dohome_client.batch import BatchStatusPoller
+from dohome_client.jobs import STATE_DONE, STATE_FAILED, STATE_RUNNING, broadcast_window
+from dohome_client.remote import DoHomeRemote
+from dohome_client.snapshot import (DEFAULT_ATTEMPTS, DEFAULT_PARALLEL, async_restore,
+                                    async_snapshot)
+
+from .poller import DoHomeStatusPoller
+from .profiler import SamplingProfiler
+from .watchdog import DoHomeWatchdog
 
 DOMAIN = 'dohome'
 CONF_GATEWAYS = 'discovery_ip'
 CONF_DISCOVERY_RETRY = 'discovery_retry'
+CONF_COLOR_GAMMA = 'color_gamma'
+CONF_HOSTS = 'hosts'
+CONF_SENSOR_WINDOW = 'sensor_window'
+CONF_DAEMON = 'daemon'
+CONF_DAEMON_TOKEN = 'daemon_token'
+CONF_PACKET_BUDGET = 'packet_budget'
 
 DISCOVERY_IP = ''
 DEFAULT_DISCOVERY_IP = '192.168.1.255'
+DEFAULT_SENSOR_WINDOW = 60
+
+
+def _host_or_network(value):
+    """Validate an IP address or CIDR range."""
+    try:
+        expand_hosts([value])
+    except ValueError as err:
+        raise vol.Invalid(f"Invalid host or network: {value}") from err
+    return value
+
 
 CONFIG_SCHEMA = vol.Schema({
     DOMAIN: vol.Schema({
         vol.Optional(CONF_GATEWAYS, default=DEFAULT_DISCOVERY_IP): cv.string,
-        vol.Optional(CONF_DISCOVERY_RETRY, default=2): cv.positive_int
+        vol.Optional(CONF_DISCOVERY_RETRY, default=2): cv.positive_int,
+        vol.Optional(CONF_COLOR_GAMMA): vol.All(vol.Coerce(float), vol.Range(min=0.1, max=5.0)),
+        vol.Optional(CONF_HOSTS, default=[]): vol.All(cv.ensure_list, [_host_or_network]),
+        vol.Optional(CONF_SENSOR_WINDOW, default=DEFAULT_SENSOR_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+        vol.Optional(CONF_DAEMON): cv.string,
+        vol.Optional(CONF_DAEMON_TOKEN): cv.string,
+        vol.Optional(CONF_PACKET_BUDGET, default=DEFAULT_PACKET_BUDGET): vol.All(vol.Coerce(int), vol.Range(min=0, max=10000))
     })
 }, extra=vol.ALLOW_EXTRA)
 
 DOHOME_COMPONENTS = ['switch', 'light', 'sensor', 'binary_sensor', 'button']
+# The sensor platform carries the link diagnostics of every device and the
+# button platform the discovery button.
+ALWAYS_PLATFORMS = ['sensor', 'button']
+DOHOME_SERVICES = ['discover_devices', 'cancel_discovery', 'set_trace', 'dump_trace',
+                   'save_capture', 'profile', 'snapshot', 'restore']
+SIGNAL_NEW_DEVICES = DOMAIN + '_new_devices'
+
+CONFIG_ENTRY = None
+LOADED_PLATFORMS = []
+DOHOME_CLIENT = None
 DOHOME_GATEWAY = None
+COLOR_ENGINE = None
+DOHOME_METRICS = None
+PACKET_BUDGET = None
+PACKET_TRACE = None
+DOHOME_TRANSPORT = None
+STATUS_POLLER = None
+DEVICE_SHADOWS = None
+WATCHDOG = None
+STATIC_HOSTS = []
+
+LIGHT_STATUS_INTERVAL = timedelta(seconds=10)
+DEVICE_STATUS_INTERVAL = timedelta(seconds=1)
+DEFAULT_DISCOVER_DURATION = 10
+MAX_DISCOVER_DURATION = 60
+RECONCILE_INTERVAL = timedelta(seconds=10)
+
+ATTR_ENABLED = 'enabled'
+ATTR_SIZE = 'size'
+ATTR_DURATION = 'duration'
+ATTR_INTERVAL = 'interval'
+ATTR_PARALLEL = 'parallel'
+ATTR_ATTEMPTS = 'attempts'
+
+SET_TRACE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_ENABLED, default=True): cv.boolean,
+    vol.Optional(ATTR_SIZE): vol.All(vol.Coerce(int), vol.Range(min=10, max=10000))
+})
+
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_DURATION, default=30): vol.All(vol.Coerce(int), vol.Range(min=1, max=300)),
+    vol.Optional(ATTR_INTERVAL, default=5): vol.All(vol.Coerce(int), vol.Range(min=1, max=100))
+})
+
+RESTORE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_PARALLEL, default=DEFAULT_PARALLEL): vol.All(vol.Coerce(int), vol.Range(min=1, max=256)),
+    vol.Optional(ATTR_ATTEMPTS, default=DEFAULT_ATTEMPTS): vol.All(vol.Coerce(int), vol.Range(min=1, max=10))
+})
+
+PROFILE_LOCK = Lock()
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
@@ -37,140 +129,400 @@ def get_alias(name):
     }
     return alias.get(name, name)
 
-def setup(hass, config):
-    global DISCOVERY_IP
-    DISCOVERY_IP = config[DOMAIN][CONF_GATEWAYS]
-    discovery_retry = config[DOMAIN][CONF_DISCOVERY_RETRY]
+async def async_setup(hass, config):
+    """Import a YAML configuration into a config entry."""
+    if DOMAIN in config:
+        hass.async_create_task(hass.config_entries.flow.async_init(
+            DOMAIN, context={'source': SOURCE_IMPORT}, data=dict(config[DOMAIN])))
+    return True
+
+async def async_setup_entry(hass, entry):
+    """Discover devices and forward the entry to the platforms they need."""
+    global CONFIG_ENTRY
+    CONFIG_ENTRY = entry
+    settings = {**entry.data, **entry.options}
+
+    _create_shared(hass, settings)
+    if settings.get(CONF_DAEMON):
+        await _async_connect_daemon(hass, entry, settings[CONF_DAEMON],
+                                    settings.get(CONF_DAEMON_TOKEN) or '')
+    else:
+        await _async_discover(hass, settings)
+
+    global LOADED_PLATFORMS
+    LOADED_PLATFORMS = required_platforms(known_devices())
+    _LOGGER.info("DoHome loading platforms: %s", ', '.join(LOADED_PLATFORMS))
+
+    WATCHDOG.async_start()
+    entry.async_on_unload(async_track_time_interval(hass, _async_reconcile, RECONCILE_INTERVAL))
+    entry.async_on_unload(hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop))
+    entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+
+    # Expose discover_devices entity; discovery jobs keep it up to date.
+    hass.states.async_set(DOMAIN + '.discover_devices', 'idle')
+    entry.async_on_unload(DOHOME_CLIENT.discovery.add_listener(
+        lambda job: _discovery_progress(hass, job)))
+    hass.services.async_register(DOMAIN, 'set_trace', set_trace_service, schema=SET_TRACE_SCHEMA)
+    hass.services.async_register(DOMAIN, 'dump_trace', lambda call: dump_trace_service(hass, call))
+    hass.services.async_register(DOMAIN, 'save_capture', lambda call: save_capture_service(hass, call))
+
+    # Coroutine functions and callbacks, so Home Assistant runs them in the
+    # event loop rather than in an executor thread like the lambdas above.
+    async def async_handle_discover(call):
+        await async_discover_devices_service(hass, call)
+
+    async def async_handle_profile(call):
+        await async_profile_service(hass, call)
+
+    @callback
+    def handle_cancel_discovery(call):
+        cancel_discovery_service(hass, call)
+
+    async def async_handle_snapshot(call):
+        await async_snapshot_service(hass, call)
+
+    async def async_handle_restore(call):
+        await async_restore_service(hass, call)
+
+    hass.services.async_register(DOMAIN, 'discover_devices', async_handle_discover)
+    hass.services.async_register(DOMAIN, 'cancel_discovery', handle_cancel_discovery)
+    hass.services.async_register(DOMAIN, 'snapshot', async_handle_snapshot)
+    hass.services.async_register(DOMAIN, 'restore', async_handle_restore, schema=RESTORE_SCHEMA)
+    hass.services.async_register(DOMAIN, 'profile', async_handle_profile, schema=PROFILE_SCHEMA)
+
+    await hass.config_entries.async_forward_entry_setups(entry, LOADED_PLATFORMS)
+    return True
+
+async def async_unload_entry(hass, entry):
+    """Unload the platforms and release the shared pollers and sockets."""
+    global LOADED_PLATFORMS
+    unloaded = await hass.config_entries.async_unload_platforms(entry, LOADED_PLATFORMS)
+    if unloaded:
+        LOADED_PLATFORMS = []
+        for service in DOHOME_SERVICES:
+            hass.services.async_remove(DOMAIN, service)
+        async_stop(None)
+    return unloaded
+
+async def async_reload_entry(hass, entry):
+    """Reload the entry after its options changed."""
+    await hass.config_entries.async_reload(entry.entry_id)
+
+def _create_shared(hass, settings):
+    """Create the objects the platforms share, once per Home Assistant run.
+
+    Platform modules bind these names when they are first imported, so a
+    reload reuses and reconfigures them instead of replacing them.
+    """
+    global DOHOME_CLIENT, DOHOME_GATEWAY, COLOR_ENGINE, DOHOME_METRICS, PACKET_TRACE
+    global DOHOME_TRANSPORT, WATCHDOG, STATUS_POLLER, DEVICE_SHADOWS, PACKET_BUDGET
+    budget = settings.get(CONF_PACKET_BUDGET, DEFAULT_PACKET_BUDGET)
+    if DOHOME_CLIENT is not None:
+        COLOR_ENGINE.set_gamma(settings.get(CONF_COLOR_GAMMA))
+        PACKET_BUDGET.configure(budget)
+        return
+
+    DOHOME_METRICS = DoHomeMetrics()
+    PACKET_TRACE = PacketTrace()
+    PACKET_BUDGET = PacketBudget(budget)
+    DOHOME_CLIENT = DoHomeClient(metrics=DOHOME_METRICS, trace=PACKET_TRACE,
+                                 gamma=settings.get(CONF_COLOR_GAMMA), budget=PACKET_BUDGET)
+    DOHOME_GATEWAY = DoHomeGateway(DOHOME_CLIENT)
+    COLOR_ENGINE = DOHOME_CLIENT.color
+    DOHOME_TRANSPORT = DOHOME_CLIENT.transport
+    DEVICE_SHADOWS = ShadowStore()
+    WATCHDOG = DoHomeWatchdog(hass, DOMAIN)
+    STATUS_POLLER = DoHomeStatusPoller(hass, DOHOME_TRANSPORT, DEVICE_STATUS_INTERVAL, WATCHDOG,
+                                       DOHOME_METRICS.resources)
+
+async def _async_connect_daemon(hass, entry, address, token):
+    """Take devices, state and command delivery from the add-on's gateway daemon.
+
+    The status poller hands out the daemon's state stream instead of
+    polling, and the client sends through the daemon instead of its own
+    sockets, so no UDP traffic runs in Home Assistant.
+    """
+    remote = DoHomeRemote(address, token)
+    await remote.async_start()
+    STATUS_POLLER.remote = remote
+    DOHOME_CLIENT.transport = remote
+    DOHOME_CLIENT.registry.add_all(remote.registry.all())
+
+    @callback
+    def devices_found(devices):
+        new_devices = DOHOME_CLIENT.registry.add_all(devices)
+        if not new_devices:
+            return
+        if set(required_platforms(new_devices)) - set(LOADED_PLATFORMS):
+            hass.async_create_task(hass.config_entries.async_reload(entry.entry_id))
+        else:
+            async_dispatcher_send(hass, SIGNAL_NEW_DEVICES, new_devices)
+
+    entry.async_on_unload(remote.add_devices_listener(devices_found))
 
-    if DISCOVERY_IP == DEFAULT_DISCOVERY_IP:
+async def _async_reconcile(now):
+    """Restore the state Home Assistant set on devices that lost it."""
+    await DEVICE_SHADOWS.async_reconcile()
+
+def _discovery_ip(discovery_ip):
+    """Return the broadcast address to discover on, resolving the default one."""
+    if discovery_ip == DEFAULT_DISCOVERY_IP:
         hostname = socket.getfqdn(socket.gethostname())
         hosts = socket.gethostbyname_ex(hostname)
         for add in hosts[2]:
             if add.startswith('192.168.'):
                 addlist = add.split(".")
-                DISCOVERY_IP = addlist[0] + '.' + addlist[1] + '.' + addlist[2] + '.255'
+                discovery_ip = addlist[0] + '.' + addlist[1] + '.' + addlist[2] + '.255'
+    return discovery_ip
+
+async def _async_discover(hass, settings):
+    """Broadcast for devices and probe the configured hosts.
+
+    discovery_retry is the number of broadcasts, sent over the window
+    broadcast_window gives for it.
+    """
+    global DISCOVERY_IP, STATIC_HOSTS
+    DISCOVERY_IP = await hass.async_add_executor_job(_discovery_ip, settings[CONF_GATEWAYS])
     _LOGGER.info("DoHome discovery_ip:%s", DISCOVERY_IP)
-    
-    global DOHOME_GATEWAY
-    DOHOME_GATEWAY = DoHomeGateway()
+    STATUS_POLLER.batch = BatchStatusPoller(DOHOME_TRANSPORT, DISCOVERY_IP)
+    STATIC_HOSTS = settings[CONF_HOSTS]
+    await request_discovery(broadcast_window(settings[CONF_DISCOVERY_RETRY])).async_wait()
 
-    with ThreadPoolExecutor() as executor:
-        for _ in range(discovery_retry):
-            executor.submit(DOHOME_GATEWAY._discover_devices)
+@callback
+def request_discovery(duration):
+    """Start a discovery job, or join the running one, and return it."""
+    hosts = expand_hosts(STATIC_HOSTS)
+    _LOGGER.info("DoHome discovery for %.0f seconds, probing %d configured hosts",
+                 duration, len(hosts))
+    return DOHOME_CLIENT.discovery.request(
+        duration, target=(DISCOVERY_IP, DEVICE_PORT), hosts=hosts, bind=('', DEVICE_PORT))
 
-    for component in DOHOME_COMPONENTS:
-        discovery.load_platform(hass, component, DOMAIN, {}, config)
+@callback
+def _discovery_progress(hass, job):
+    """Show a discovery job on the discover_devices entity and add what it found."""
+    if job.state == STATE_RUNNING:
+        state = 'active'
+    elif job.state == STATE_FAILED:
+        state = 'error'
+    else:
+        state = 'idle'
+    progress = job.as_dict()
+    hass.states.async_set(DOMAIN + '.discover_devices', state, {
+        key: progress[key] for key in ('found', 'new', 'elapsed', 'remaining', 'requests',
+                                       'hosts_probed', 'hosts_total')
+    } | {'result': job.state})
+    if not job.done:
+        return
 
-    # Expose discover_devices entity
-    hass.states.set(DOMAIN + '.discover_devices', 'idle')
-    hass.services.register(DOMAIN, 'discover_devices', lambda call: discover_devices_service(hass, call))
+    _LOGGER.info("DoHome discovery %s after %.1f s: %d devices answered, %d new",
+                 job.state, progress['elapsed'], progress['found'], progress['new'])
+    new_devices = job.new_devices
+    if not new_devices:
+        if job.state == STATE_DONE:
+            _LOGGER.warning("No devices discovered")
+        return
+    if set(required_platforms(new_devices)) - set(LOADED_PLATFORMS):
+        # A platform that is not loaded yet is needed; the reload forwards
+        # the entry to it and builds every entity from the known devices.
+        _LOGGER.info("New DoHome device types found, reloading to load their platforms")
+        hass.async_create_task(hass.config_entries.async_reload(CONFIG_ENTRY.entry_id))
+    else:
+        async_dispatcher_send(hass, SIGNAL_NEW_DEVICES, new_devices)
 
-    return True
+@callback
+def async_stop(event):
+    """Stop the shared poller and watchdog and close the shared sockets."""
+    STATUS_POLLER.async_stop()
+    WATCHDOG.async_stop()
+    if STATUS_POLLER.remote is not None:
+        STATUS_POLLER.remote.stop()
+        STATUS_POLLER.remote = None
+        DOHOME_CLIENT.transport = DOHOME_TRANSPORT
+    DOHOME_TRANSPORT.close()
+    _LOGGER.info("DoHome stopped, resources: %s", DOHOME_METRICS.resources.as_dict())
+
+def known_devices():
+    """Return every device discovered so far."""
+    return DOHOME_CLIENT.registry.all()
+
+def required_platforms(devices):
+    """Return the platforms needed for devices, in DOHOME_COMPONENTS order."""
+    needed = set(ALWAYS_PLATFORMS)
+    for device in devices:
+        needed.update(DEVICE_PLATFORMS.get(device['type'], ()))
+    return [component for component in DOHOME_COMPONENTS if component in needed]
+
+async def async_setup_device_platform(hass, entry, async_add_entities, build_entities):
+    """Add a platform's entities for the known devices and for later discoveries.
+
+    build_entities(hass, devices) returns the platform's entities for a list
+    of devices.
+    """
+    @callback
+    def add_devices(devices):
+        entities = build_entities(hass, devices)
+        if entities:
+            async_add_entities(entities)
+
+    add_devices(known_devices())
+    entry.async_on_unload(async_dispatcher_connect(hass, SIGNAL_NEW_DEVICES, add_devices))
 
-def discover_devices_service(hass, call):
-    """Service to trigger device discovery for a specified duration."""
+def set_trace_service(call):
+    """Service to start or stop the packet trace."""
+    if call.data[ATTR_ENABLED]:
+        PACKET_TRACE.enable(call.data.get(ATTR_SIZE))
+        _LOGGER.info("DoHome packet trace enabled")
+    else:
+        PACKET_TRACE.disable()
+        _LOGGER.info("DoHome packet trace disabled")
+
+def dump_trace_service(hass, call):
+    """Service to write the captured packet trace to the config directory."""
+    path = hass.config.path(DOMAIN + '_trace.json')
+    with open(path, 'w', encoding='utf-8') as trace_file:
+        json.dump(PACKET_TRACE.dump(), trace_file, indent=1)
+    _LOGGER.info("DoHome packet trace written to %s", path)
+
+def save_capture_service(hass, call):
+    """Service to write the packet trace as a replayable capture file."""
+    path = hass.config.path(DOMAIN + '_capture.jsonl.gz')
+    devices = known_devices()
+    frames = PACKET_TRACE.save(path, devices)
+    _LOGGER.info("DoHome capture of %d frames from %d devices written to %s",
+                 frames, len(devices), path)
+
+async def async_profile_service(hass, call):
+    """Service to sample the integration's code paths for a while.
+
+    The profiler samples from its own thread while this waits on the event
+    loop, so a profile holds no executor thread for its duration.
+    """
+    if not PROFILE_LOCK.acquire(blocking=False):
+        _LOGGER.warning("A DoHome profile is already running")
+        return
     try:
-        # Validate duration with reasonable limits
-        duration = min(max(call.data.get('duration', 10), 1), 60) if call else 10  # Min 1s, Max 60s
-        
-        hass.states.set(DOMAIN + '.discover_devices', 'active')
-        
-        if not DOHOME_GATEWAY:
-            _LOGGER.error("Gateway not initialized")
-            hass.states.set(DOMAIN + '.discover_devices', 'error')
-            return False
-
-        discovered_devices = DOHOME_GATEWAY._discover_devices(duration)
-        
-        if discovered_devices:
-            device_component_map = {
-                '_STRIPE': 'light',
-                '_DT-WYRGB': 'light',
-                '_DT-PLUG': 'switch',
-                '_THIMR': ['switch', 'sensor', 'binary_sensor'],
-                '_REALY2': 'switch',
-                '_REALY4': 'switch',
-                '_MOTION': 'binary_sensor'
-            }
-            
-            for device_type, devices in discovered_devices.items():
-                components = device_component_map.get(device_type, [])
-                if not isinstance(components, list):
-                    components = [components]
-                    
-                for component in components:
-                    if component:  # Skip empty components
-                        for device in devices:
-                            _LOGGER.info(f"Loading {component} for device type {device_type}: {device['name']}")
-                            discovery.load_platform(hass, component, DOMAIN, {device['sid']: device}, {})
-                            
-            hass.states.set(DOMAIN + '.discover_devices', 'idle')
-            return True
-        else:
-            _LOGGER.warning("No devices discovered")
-            hass.states.set(DOMAIN + '.discover_devices', 'idle')
-            return False
-            
-    except Exception as err:
-        _LOGGER.error("Error during device discovery: %s", str(err))
-        hass.states.set(DOMAIN + '.discover_devices', 'error')
-        return False
-    
-class DoHomeGateway:
-    GATEWAY_DISCOVERY_PORT = 6091
-    SOCKET_BUFSIZE = 1024
-
-    devices = defaultdict(list)
-
-    def _discover_devices(self, duration=1):
-        _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        _socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        _socket.bind(('', self.GATEWAY_DISCOVERY_PORT))
-        
-        discovered_devices = defaultdict(list)
-        
+        duration = call.data[ATTR_DURATION]
+        _LOGGER.info("Profiling DoHome for %d seconds", duration)
+        profiler = SamplingProfiler(call.data[ATTR_INTERVAL] / 1000).start()
         try:
-            _LOGGER.info("Starting gateway finding for %d seconds.", duration)
-            _socket.sendto('cmd=ping\r\n'.encode(), (DISCOVERY_IP, self.GATEWAY_DISCOVERY_PORT))
-            _socket.settimeout(duration)  # Set socket timeout to 30 seconds
-
-            while True:
-                data, addr = _socket.recvfrom(self.SOCKET_BUFSIZE)
-
-                if len(data) >= 70:
-                    resp = {i.split("=")[0]: i.split("=")[1] for i in data.decode("utf-8").split("&")}
-                    if resp.get("cmd") == 'pong':
-                        device_type = resp.get("device_type")
-
-                        dohome_device = {
-                            "sid": resp.get("device_name")[-4:],
-                            "name": resp.get("device_name"),
-                            "sta_ip": resp.get("sta_ip"),
-                            "type": device_type
-                        }
-
-                        if dohome_device not in self.devices[device_type]:
-                            self.devices[device_type].append(dohome_device)
-                            discovered_devices[device_type].append(dohome_device)
-                            _LOGGER.info("Discovered DoHome Device: %s", dohome_device)
-
-        except socket.timeout:
-            _LOGGER.info("Gateway finding finished in %d seconds.", duration)
-        except socket.error as e:
-            _LOGGER.error("Socket error: %s", str(e))
+            await asyncio.sleep(duration)
         finally:
-            _socket.close()
-            
-        return discovered_devices  # Return the discovered devices
+            await hass.async_add_executor_job(profiler.stop)
+    finally:
+        PROFILE_LOCK.release()
+
+    summary = await hass.async_add_executor_job(_write_profile, hass, profiler)
+    _LOGGER.info("DoHome profile: %d of %d samples in the integration, top: %s",
+                 summary['samples_in_integration'], summary['samples'],
+                 ', '.join(f"{entry['function']} {entry['ms']} ms" for entry in summary['self'][:5]))
+
+def _write_profile(hass, profiler):
+    """Write the profile files and return the summary."""
+    profiler.write(hass.config.path(DOMAIN + '_profile.txt'))
+    summary = profiler.summary()
+    with open(hass.config.path(DOMAIN + '_profile.json'), 'w', encoding='utf-8') as summary_file:
+        json.dump(summary, summary_file, indent=1)
+    return summary
+
+async def async_snapshot_service(hass, call):
+    """Service to record the relay and color state of every device."""
+    snapshot = await async_snapshot(DOHOME_CLIENT.transport, known_devices())
+    path = hass.config.path(DOMAIN + '_snapshot.json')
+    # Kept on disk: the outage a snapshot is taken for restarts Home Assistant too.
+    await hass.async_add_executor_job(_write_json, path, snapshot)
+    _LOGGER.info("DoHome snapshot of %d devices taken in %.2f s and written to %s, no answer from: %s",
+                 len(snapshot['devices']), snapshot['seconds'], path,
+                 ', '.join(snapshot['missing']) or 'none')
+
+async def async_restore_service(hass, call):
+    """Service to reapply the last snapshot to every device and verify it."""
+    path = hass.config.path(DOMAIN + '_snapshot.json')
+    try:
+        snapshot = await hass.async_add_executor_job(_read_json, path)
+    except FileNotFoundError:
+        _LOGGER.error("No DoHome snapshot to restore, call dohome.snapshot first")
+        return
+    # Make the snapshot the state the shadows keep, so reconciliation does
+    # not put back what was set before it.
+    for sid, entry in snapshot['devices'].items():
+        DEVICE_SHADOWS.get(sid).set_desired(entry['values'])
+    result = await async_restore(DOHOME_CLIENT.transport, snapshot, call.data[ATTR_PARALLEL],
+                                 call.data[ATTR_ATTEMPTS], registry=DOHOME_CLIENT.registry)
+    _LOGGER.info("DoHome restore: %s", result)
+    if result['failed']:
+        _LOGGER.warning("DoHome restore did not reach: %s", ', '.join(result['failed']))
+
+def _write_json(path, document):
+    with open(path, 'w', encoding='utf-8') as json_file:
+        json.dump(document, json_file, indent=1)
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as json_file:
+        return json.load(json_file)
+
+async def async_discover_devices_service(hass, call):
+    """Service to discover devices for a specified duration.
+
+    A call made while a discovery runs joins it rather than starting a second
+    one, and returns when the joint discovery ends.
+    """
+    # Validate duration with reasonable limits
+    duration = DEFAULT_DISCOVER_DURATION
+    if call:
+        duration = min(max(call.data.get('duration', duration), 1), MAX_DISCOVER_DURATION)
+
+    if STATUS_POLLER.remote is not None:
+        # The daemon announces what it finds through the devices listener.
+        hass.states.async_set(DOMAIN + '.discover_devices', 'active')
+        try:
+            await STATUS_POLLER.remote.async_discover()
+        except Exception as err:  # pylint: disable=broad-except
+            _LOGGER.error("Error during device discovery: %s", str(err))
+            hass.states.async_set(DOMAIN + '.discover_devices', 'error')
+            return
+        hass.states.async_set(DOMAIN + '.discover_devices', 'idle')
+        return
+
+    await request_discovery(duration).async_wait()
+
+def cancel_discovery_service(hass, call):
+    """Service to stop a running discovery; the devices found so far are kept."""
+    if not DOHOME_CLIENT.discovery.cancel():
+        _LOGGER.info("No DoHome discovery is running")
+
+class DoHomeGateway:
+    """The integration's view of the devices discovered so far."""
+
+    def __init__(self, client):
+        self._discovery = client.discovery
+        self.devices = client.registry.devices
+
+    @property
+    def last_discovery(self):
+        """Return the progress of the running or last discovery job, or None."""
+        return self._discovery.as_dict()
 
 class DoHomeDevice(Entity):
 
+    # Entities that follow their device's status set an interval and a
+    # _handle_status(resp) callback for its cmd 25 replies. The shared status
+    # poller reads each device once per the shortest interval its entities
+    # set, only while one of them is added.
+    _update_interval = None
+
     def __init__(self, name, device):
         self._sid = device['sid']
         self._name = get_alias(name)
         self._sta_ip = device['sta_ip']
         self._device_state_attributes = {}
 
+    async def async_added_to_hass(self):
+        """Subscribe to the shared status poll, or to the daemon's state stream."""
+        if self._update_interval is None:
+            return
+        self.async_on_remove(STATUS_POLLER.async_add_listener(
+            self._device, self._handle_status, self._update_interval))
+
     @property
     def name(self):
         """Return the name of the device."""
@@ -4,14 +4,13 @@ Support for DoHome
 Developed by Rave from hogc
 """
 import logging
-import json
-import socket
-from datetime import timedelta
-from homeassistant.helpers.event import track_time_interval
 
 from homeassistant.components.binary_sensor import BinarySensorEntity
+from homeassistant.core import callback
 
-from . import (DOHOME_GATEWAY, DoHomeDevice)
+from dohome_client import entity_name, entity_specs
+
+from . import DEVICE_STATUS_INTERVAL, DoHomeDevice, async_setup_device_platform
 
 NO_CLOSE = 'no_close'
 ATTR_OPEN_SINCE = 'Open since'
@@ -24,36 +23,28 @@ ATTR_NO_MOTION_SINCE = 'No motion since'
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
-    """Perform the setup for DoHome devices."""
-    sensor_devices = []
-    devices = DOHOME_GATEWAY.devices
-    for (device_type, device_info) in devices.items():
-        for device in device_info:
-            _LOGGER.info(device)
-            if(device['type'] == '_MOTION' or device['type'] == '_THIMR'):
-                sensor_devices.append(MotionSensor(hass, device))
-    
-    if(len(sensor_devices) > 0):
-        add_devices(sensor_devices)
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up DoHome binary sensors from a config entry."""
+    await async_setup_device_platform(hass, entry, async_add_entities, build_entities)
+
+
+def build_entities(hass, devices):
+    """Return the binary sensor entities for devices."""
+    return [MotionSensor(hass, spec, device)
+            for device in devices for spec in entity_specs(device, 'binary_sensor')]
 
 
 class MotionSensor(DoHomeDevice, BinarySensorEntity):
 
-    def __init__(self, hass, device):
+    _update_interval = DEVICE_STATUS_INTERVAL
+
+    def __init__(self, hass, spec, device):
         self._device = device
         self._state = False
-        self._data_key = 'motion'
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._data_key = spec.key
+        self._attr_device_class = spec.device_class
 
-        DoHomeDevice.__init__(self, 'Motion_' + device['sid'], device)
-
-        track_time_interval(hass, self.updateStatus, timedelta(seconds=1))
-
-    @property
-    def device_class(self):
-        """Return the class of binary sensor."""
-        return 'motion'
+        DoHomeDevice.__init__(self, entity_name(spec, device), device)
 
     @property
     def is_on(self):
@@ -61,34 +52,11 @@ class MotionSensor(DoHomeDevice, BinarySensorEntity):
         return self._state
 
 
-    def updateStatus(self, now):
-        resp = self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":25}', 25)
-        if resp is not None and self._data_key in resp:
+    @callback
+    def _handle_status(self, resp):
+        if self._data_key in resp:
             if resp[self._data_key] == True:
                 self._state = True
             else:
                 self._state = False
-            self.schedule_update_ha_state()
-
-    def _send_cmd(self, device, cmd, rtn_cmd):
-
-        try:
-            self._socket.settimeout(0.5)
-            self._socket.sendto(cmd.encode(), (device["sta_ip"], 6091))
-            data, addr = self._socket.recvfrom(1024)
-        except socket.timeout:
-            return None
-
-        if data is None:
-            return None
-        dic = {i.split("=")[0]:i.split("=")[1] for i in data.decode("utf-8").split("&")}
-        resp = []
-        if(dic["dev"][8:12] == device["sid"]):
-            resp = json.loads(dic["op"])
-            if resp['cmd'] != rtn_cmd:
-                _LOGGER.debug("Non matching response. Expecting %s, but got %s", rtn_cmd, resp['cmd'])
-                return None
-            return resp
-        else:
-            _LOGGER.debug("Non matching response. device %s, but got %s", device["sid"], dic["dev"][8:12])
-            return None
+            self.async_write_ha_state()
@@ -1,18 +1,17 @@
 import logging
 from homeassistant.components.button import ButtonEntity
+from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 
-from . import DOMAIN, DOHOME_GATEWAY, discover_devices_service
+from . import DOMAIN, async_discover_devices_service
 
 _LOGGER = logging.getLogger(__name__)
 
-async def async_setup_platform(
+async def async_setup_entry(
     hass: HomeAssistant,
-    config: ConfigType,
+    entry: ConfigEntry,
     async_add_entities: AddEntitiesCallback,
-    discovery_info: DiscoveryInfoType | None = None,
 ) -> None:
     """Set up the DoHome button platform."""
     async_add_entities([DoHomeDiscoverDevicesButton(hass)], True)
@@ -27,6 +26,9 @@ class DoHomeDiscoverDevicesButton(ButtonEntity):
         self._attr_unique_id = f"{DOMAIN}_discover_devices_button"
 
     async def async_press(self) -> None:
-        """Handle the button press."""
+        """Start a discovery, or join the running one, without waiting for it.
+
+        The dohome.discover_devices entity shows its progress.
+        """
         _LOGGER.info("Discover Devices button pressed")
-        await self._hass.async_add_executor_job(discover_devices_service, self._hass, None)
\ No newline at end of file
+        self._hass.async_create_task(async_discover_devices_service(self._hass, None))
\ No newline at end of file
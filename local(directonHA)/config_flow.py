@@ -0,0 +1,98 @@
+"""Config flow for DoHome."""
+import voluptuous as vol
+
+from homeassistant import config_entries
+from homeassistant.core import callback
+
+from . import (CONF_COLOR_GAMMA, CONF_DAEMON, CONF_DAEMON_TOKEN, CONF_DISCOVERY_RETRY, CONF_GATEWAYS, CONF_HOSTS,
+               CONF_PACKET_BUDGET, CONF_SENSOR_WINDOW, DEFAULT_DISCOVERY_IP, DEFAULT_PACKET_BUDGET,
+               DEFAULT_SENSOR_WINDOW, DOMAIN, _host_or_network)
+
+TITLE = 'DoHome'
+
+# Optional fields without a default. A field cleared in the options form is
+# left out of the submission, so it is stored as None there; otherwise the
+# value from the initial setup would show through the merged settings.
+UNSET_WHEN_CLEARED = (CONF_COLOR_GAMMA, CONF_DAEMON, CONF_DAEMON_TOKEN)
+
+
+def _settings_schema(defaults):
+    """Return the form schema, prefilled from defaults."""
+    hosts = defaults.get(CONF_HOSTS, [])
+    if not isinstance(hosts, str):
+        hosts = ', '.join(hosts)
+    return vol.Schema({
+        vol.Optional(CONF_GATEWAYS, default=defaults.get(CONF_GATEWAYS, DEFAULT_DISCOVERY_IP)): str,
+        vol.Optional(CONF_DISCOVERY_RETRY, default=defaults.get(CONF_DISCOVERY_RETRY, 2)):
+            vol.All(vol.Coerce(int), vol.Range(min=1, max=10)),
+        vol.Optional(CONF_HOSTS, default=hosts): str,
+        vol.Optional(CONF_SENSOR_WINDOW, default=defaults.get(CONF_SENSOR_WINDOW, DEFAULT_SENSOR_WINDOW)):
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=3600)),
+        vol.Optional(CONF_COLOR_GAMMA, description={'suggested_value': defaults.get(CONF_COLOR_GAMMA)}):
+            vol.All(vol.Coerce(float), vol.Range(min=0.1, max=5.0)),
+        vol.Optional(CONF_DAEMON, description={'suggested_value': defaults.get(CONF_DAEMON)}): str,
+        vol.Optional(CONF_DAEMON_TOKEN,
+                     description={'suggested_value': defaults.get(CONF_DAEMON_TOKEN)}): str,
+        vol.Optional(CONF_PACKET_BUDGET, default=defaults.get(CONF_PACKET_BUDGET, DEFAULT_PACKET_BUDGET)):
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=10000)),
+    })
+
+
+def _parse_settings(user_input, errors):
+    """Return the entry data for a submitted form, filling errors if invalid."""
+    data = dict(user_input)
+    hosts = [host for host in user_input.get(CONF_HOSTS, '').replace(',', ' ').split() if host]
+    try:
+        data[CONF_HOSTS] = [_host_or_network(host) for host in hosts]
+    except vol.Invalid:
+        errors[CONF_HOSTS] = 'invalid_host'
+    return data
+
+
+class DoHomeConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
+    """Set up the single DoHome entry."""
+
+    VERSION = 1
+
+    async def async_step_user(self, user_input=None):
+        await self.async_set_unique_id(DOMAIN)
+        self._abort_if_unique_id_configured()
+
+        errors = {}
+        if user_input is not None:
+            data = _parse_settings(user_input, errors)
+            if not errors:
+                return self.async_create_entry(title=TITLE, data=data)
+
+        return self.async_show_form(
+            step_id='user', data_schema=_settings_schema(user_input or {}), errors=errors)
+
+    async def async_step_import(self, import_data):
+        """Create or update the entry from the YAML configuration."""
+        await self.async_set_unique_id(DOMAIN)
+        self._abort_if_unique_id_configured(updates=import_data)
+        return self.async_create_entry(title=TITLE, data=import_data)
+
+    @staticmethod
+    @callback
+    def async_get_options_flow(config_entry):
+        return DoHomeOptionsFlow(config_entry)
+
+
+class DoHomeOptionsFlow(config_entries.OptionsFlow):
+    """Change the discovery and color settings; saving reloads the entry."""
+
+    def __init__(self, config_entry):
+        self._entry = config_entry
+
+    async def async_step_init(self, user_input=None):
+        errors = {}
+        if user_input is not None:
+            data = _parse_settings(user_input, errors)
+            if not errors:
+                data.update((key, None) for key in UNSET_WHEN_CLEARED if key not in data)
+                return self.async_create_entry(title='', data=data)
+
+        defaults = user_input or {**self._entry.data, **self._entry.options}
+        return self.async_show_form(
+            step_id='init', data_schema=_settings_schema(defaults), errors=errors)
@@ -0,0 +1,35 @@
+"""Diagnostics support for DoHome."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return per-device link metrics and the packet trace for the diagnostics download."""
+    # Home Assistant imports this platform before the entry is set up, when
+    # the shared objects are still None, so they are looked up on each call.
+    from . import (DEVICE_SHADOWS, DOHOME_GATEWAY, DOHOME_METRICS, DOHOME_TRANSPORT,
+                   PACKET_BUDGET, PACKET_TRACE, STATUS_POLLER, WATCHDOG)
+
+    return {
+        "devices": {
+            device["sid"]: {"type": device["type"], "sta_ip": device["sta_ip"]}
+            for devices in DOHOME_GATEWAY.devices.values()
+            for device in devices
+        },
+        "metrics": DOHOME_METRICS.as_dict(),
+        "worst_devices": DOHOME_METRICS.worst(),
+        "async_transport": DOHOME_TRANSPORT.stats.as_dict(),
+        "resources": DOHOME_METRICS.resources.as_dict(),
+        "packet_budget": PACKET_BUDGET.as_dict(),
+        "last_discovery": DOHOME_GATEWAY.last_discovery,
+        "watchdog": WATCHDOG.as_dict(),
+        "shadows": DEVICE_SHADOWS.as_dict(),
+        "batch_status": STATUS_POLLER.batch.as_dict() if STATUS_POLLER.batch else None,
+        "packet_trace": PACKET_TRACE.dump(),
+    }
@@ -1,14 +1,8 @@
 import logging
-import socket
-import json
-import asyncio
 from typing import Any
 from datetime import timedelta
 
-from homeassistant.helpers.event import track_time_interval
-from homeassistant.core import HomeAssistant
-from homeassistant.helpers.entity_platform import AddEntitiesCallback
-from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
+from homeassistant.core import callback
 from homeassistant.components.light import (
     ATTR_BRIGHTNESS,
     ATTR_RGBWW_COLOR,
@@ -16,46 +10,69 @@ from homeassistant.components.light import (
     ColorMode,
 )
 
-from . import (DOHOME_GATEWAY, DoHomeDevice)
+from dohome_client import entity_specs
+from dohome_client.color import CHANNELS
+
+from . import (COLOR_ENGINE, DEVICE_SHADOWS, DOHOME_CLIENT, LIGHT_STATUS_INTERVAL, DoHomeDevice,
+               async_setup_device_platform)
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
 
-async def async_setup_platform(
-    hass: HomeAssistant,
-    config: ConfigType,
-    async_add_entities: AddEntitiesCallback,
-    discovery_info: DiscoveryInfoType | None = None):
-    light_devices = []
-    devices = DOHOME_GATEWAY.devices
-    for (device_type, device_info) in devices.items():
-        for device in device_info:
-            if device['type'] in ['_STRIPE', '_DT-WYRGB']:
-                _LOGGER.info(f"Adding light device: {device['name']} (type: {device['type']})")
-                light_devices.append(DoHomeLight(hass, device))
-            else:
-                _LOGGER.debug(f"Skipping non-light device: {device['name']} (type: {device['type']})")
-    
-    if light_devices:
-        async_add_entities(light_devices)
-        return True
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up DoHome lights from a config entry."""
+    await async_setup_device_platform(hass, entry, async_add_entities, build_entities)
+
+
+def build_entities(hass, devices):
+    """Return the light entities for devices."""
+    return [DoHomeLight(hass, device)
+            for device in devices if entity_specs(device, 'light')]
 
 
 class DoHomeLight(DoHomeDevice, LightEntity):
 
+    _update_interval = LIGHT_STATUS_INTERVAL
+
     def __init__(self, hass, device):
         super().__init__(device['name'], device)
         self._device = device
         self._state = False
         self._rgb = (255, 255, 255, 255, 255)
         self._brightness = 255
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._attr_unique_id = f"dohome_light_{device['sid']}"
         self._attr_name = device['name']
         self._attr_supported_color_modes = {ColorMode.RGBWW}
         self._attr_color_mode = ColorMode.RGBWW
 
 
+    async def async_added_to_hass(self) -> None:
+        """Subscribe to the shared status read-back and to shadow reconciliation."""
+        await super().async_added_to_hass()
+        self.async_on_remove(DEVICE_SHADOWS.get(self._device["sid"]).add_reconciler(
+            CHANNELS, self._async_reconcile, self._update_interval.total_seconds()))
+
+    @callback
+    def _handle_status(self, resp: dict) -> None:
+        """Update state from a cmd 25 reply."""
+        try:
+            values = [int(resp[channel]) for channel in CHANNELS]
+        except (KeyError, TypeError, ValueError):
+            return
+
+        DEVICE_SHADOWS.get(self._device["sid"]).report(dict(zip(CHANNELS, values)))
+        decoded = COLOR_ENGINE.decode(values)
+        if decoded is None:
+            if not self._state:
+                return
+            self._state = False
+        else:
+            if self._state and (self._rgb, self._brightness) == decoded:
+                return
+            self._state = True
+            self._rgb, self._brightness = decoded
+        self.async_write_ha_state()
+
     @property
     def device_info(self):
         """Return device info."""
@@ -108,81 +125,21 @@ class DoHomeLight(DoHomeDevice, LightEntity):
         if ATTR_BRIGHTNESS in kwargs:
             self._brightness = kwargs[ATTR_BRIGHTNESS]
 
-        # Convert HA brightness (0-255) to device brightness (0-100)
-        device_brightness = int(100 * self._brightness / 255)
-        
         self._state = True
-        data = {
-            "cmd": 6,
-            "r": int(50 * self._rgb[0] / 255 * device_brightness),
-            "g": int(50 * self._rgb[1] / 255 * device_brightness),
-            "b": int(50 * self._rgb[2] / 255 * device_brightness),
-            "w": int(50 * self._rgb[3] / 255 * device_brightness),
-            "m": int(50 * self._rgb[4] / 255 * device_brightness)
-        }
-        op = json.dumps(data)
-        cmd_str = f'cmd=ctrl&devices={{[{self._device["sid"]}]}}&op={op}'
-        await self._async_send_cmd(self._device, cmd_str, 6)
+        await self._async_set_desired(COLOR_ENGINE.encode(self._rgb, self._brightness))
 
     async def async_turn_off(self, **kwargs):
         """Turn the light off."""
         self._state = False
-        data = {
-            "cmd": 6,
-            "r": 0,
-            "g": 0,
-            "b": 0,
-            "w": 0,
-            "m": 0
-        }
-        op = json.dumps(data)
-        cmd_str = f'cmd=ctrl&devices={{[{self._device["sid"]}]}}&op={op}'
-        await self._async_send_cmd(self._device, cmd_str, 6)
-
-    async def _async_send_cmd(self, device: dict, cmd: str, rtn_cmd: int) -> dict | None:
-        """Send command to device asynchronously."""
-        try:
-            loop = asyncio.get_event_loop()
-            
-            # Create socket in non-blocking mode
-            if self._socket is None:
-                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            
-            self._socket.settimeout(0.5)
-            
-            # Send command
-            _LOGGER.debug("Sending to %s: %s", device["sta_ip"], cmd)
-            await loop.sock_sendto(self._socket, cmd.encode(), (device["sta_ip"], 6091))
-            
-            # Receive response in a way that doesn't block the event loop
-            try:
-                data, _ = await asyncio.wait_for(
-                    loop.sock_recvfrom(self._socket, 1024),
-                    timeout=1.0
-                )
-                
-                if not data:
-                    _LOGGER.debug("No data received")
-                    return None
-
-                dic = {i.split("=")[0]: i.split("=")[1] for i in data.decode("utf-8").split("&")}
-                _LOGGER.debug("Response: %s", dic)
-                
-                if dic["dev"][8:12] != device["sid"]:
-                    _LOGGER.debug("Non matching device: %s != %s", device["sid"], dic["dev"][8:12])
-                    return None
-
-                resp = json.loads(dic["op"])
-                if resp['cmd'] != rtn_cmd:
-                    _LOGGER.debug("Non matching response cmd: %s != %s", rtn_cmd, resp['cmd'])
-                    return None
-
-                return resp
-
-            except asyncio.TimeoutError:
-                _LOGGER.debug("Timeout receiving response from %s", device["sta_ip"])
-                return None
-                
-        except Exception as ex:
-            _LOGGER.error("Error in async_send_cmd: %s", str(ex))
-            return None
\ No newline at end of file
+        await self._async_set_desired((0,) * len(CHANNELS))
+
+    async def _async_set_desired(self, values):
+        # cmd 6 sets every channel at once, so any changed channel sends the
+        # whole color; nothing is sent when the light already shows it.
+        if DEVICE_SHADOWS.set_desired(self._device["sid"], dict(zip(CHANNELS, values))):
+            await DOHOME_CLIENT.async_set_channels(self._device, values)
+
+    async def _async_reconcile(self, drift):
+        desired = DEVICE_SHADOWS.get(self._device["sid"]).desired
+        await DOHOME_CLIENT.async_set_channels(
+            self._device, [desired.get(channel, 0) for channel in CHANNELS])
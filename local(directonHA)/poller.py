@@ -0,0 +1,139 @@
+"""
+Shared cmd 25 status read-back.
+
+Entities register a listener for their device instead of polling it
+themselves, with how often they want its status. Each device is polled once
+per the shortest interval its listeners asked for, with one status request
+through the shared transport, and the reply goes to all of them: the relay,
+sensors and motion sensor of one device cost one poll between them. The
+poller ticks at its own interval, the shortest any listener may ask for,
+and polls the devices that are due together.
+Once the discovery broadcast address is known the poll goes through a
+BatchStatusPoller, which asks the device models that answer them with
+multi-device frames to that address.
+When the integration runs on the add-on's gateway daemon, listeners are
+subscribed to the state the daemon streams instead and nothing is polled.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+from homeassistant.core import callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from dohome_client.codec import CMD_STATUS, status_frame
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class DoHomeStatusPoller:
+    """Poll every subscribed device once per its interval and fan the reply out."""
+
+    def __init__(self, hass, transport, interval, watchdog=None, resources=None):
+        self._hass = hass
+        self._transport = transport
+        self._interval = interval
+        self._watchdog = watchdog
+        self._resources = resources
+        self._devices = {}
+        self._frames = {}
+        # sid -> [(update_callback, interval in seconds)]
+        self._listeners = defaultdict(list)
+        # sid -> seconds between polls, and when the next one is due
+        self._intervals = {}
+        self._due = {}
+        self._polling = False
+        self._unsub_interval = None
+        # DoHomeRemote of the gateway daemon, when one is configured.
+        self.remote = None
+        # BatchStatusPoller for the discovery broadcast address, once known.
+        self.batch = None
+
+    @callback
+    def async_add_listener(self, device, update_callback, interval=None):
+        """Call update_callback with a cmd 25 reply from device at least every interval.
+
+        interval is a timedelta and defaults to the poller's own.
+        """
+        sid = device['sid']
+        if self.remote is not None:
+            return self.remote.add_listener(sid, update_callback)
+        entry = (update_callback, (interval or self._interval).total_seconds())
+        if sid not in self._devices:
+            self._devices[sid] = device
+            self._frames[sid] = status_frame(sid)
+            self._due[sid] = 0.0
+        self._listeners[sid].append(entry)
+        self._intervals[sid] = min(seconds for _, seconds in self._listeners[sid])
+
+        if self._unsub_interval is None:
+            self._unsub_interval = async_track_time_interval(
+                self._hass, self._async_poll, self._interval)
+            if self._resources is not None:
+                self._resources.poller_started()
+            self._hass.async_create_task(self._async_poll())
+
+        @callback
+        def remove_listener():
+            self._listeners[sid].remove(entry)
+            if self._listeners[sid]:
+                self._intervals[sid] = min(seconds for _, seconds in self._listeners[sid])
+            else:
+                del self._listeners[sid]
+                del self._devices[sid]
+                del self._frames[sid]
+                del self._intervals[sid]
+                del self._due[sid]
+            if not self._listeners:
+                self.async_stop()
+
+        return remove_listener
+
+    @callback
+    def async_stop(self, event=None):
+        """Stop polling; a new listener starts it again."""
+        if self._unsub_interval is not None:
+            self._unsub_interval()
+            self._unsub_interval = None
+            if self._resources is not None:
+                self._resources.poller_stopped()
+
+    async def _async_poll(self, now=None):
+        if self._polling or not self._devices:
+            # The previous batch is still waiting on replies.
+            return
+
+        # Half a tick of slack, so timer jitter does not push a device that
+        # is due right at a tick to the next one.
+        tick = time.monotonic()
+        soon = tick + self._interval.total_seconds() / 2
+        sids = [sid for sid, due in self._due.items() if due <= soon]
+        if not sids:
+            return
+        for sid in sids:
+            self._due[sid] = tick + self._intervals[sid]
+
+        self._polling = True
+        try:
+            if self.batch is not None:
+                batch_replies = await self.batch.async_poll([self._devices[sid] for sid in sids])
+                replies = [batch_replies.get(sid) for sid in sids]
+            else:
+                replies = await asyncio.gather(*(
+                    self._transport.async_send_cmd(self._devices[sid], self._frames[sid], CMD_STATUS)
+                    for sid in sids))
+        finally:
+            self._polling = False
+
+        for sid, resp in zip(sids, replies):
+            if resp is None:
+                _LOGGER.debug("No status reply from %s", sid)
+                continue
+            for listener, _ in list(self._listeners.get(sid, ())):
+                start = time.monotonic()
+                listener(resp)
+                if self._watchdog is not None:
+                    entity = getattr(listener, '__self__', None)
+                    self._watchdog.record_call(getattr(entity, 'entity_id', None), sid, 'status',
+                                               time.monotonic() - start, in_loop=True)
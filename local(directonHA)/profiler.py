@@ -0,0 +1,111 @@
+"""
+On-demand sampling profiler for the integration's own code.
+
+A background thread reads the stack of every other thread, the event loop
+included, at a fixed interval and keeps the samples that pass through a
+module of this integration or of the dohome_client library: the status
+poller, the transports, discovery and the entity callbacks, including the
+Home Assistant call they are in, such as a state write. Nothing is installed
+until a profile is requested and the thread exits when it is stopped, so the
+integration runs without overhead otherwise.
+
+Results are written as collapsed stacks, one ``frame;frame;frame count``
+line per distinct stack, which flame graph tools read directly.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+import dohome_client
+
+INTEGRATION_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.dirname(os.path.abspath(dohome_client.__file__))
+DEFAULT_INTERVAL = 0.005
+
+
+def _label(code):
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}:{code.co_name}'
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads for the integration's frames."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL, roots=(INTEGRATION_DIR, CLIENT_DIR)):
+        self._interval = interval
+        self._roots = tuple(roots)
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = 0
+        self.hits = 0
+        self.duration = 0.0
+        self.stacks = Counter()
+        self.self_counts = Counter()
+        self.total_counts = Counter()
+
+    def start(self):
+        """Start sampling in a helper thread; returns self."""
+        self._thread = threading.Thread(target=self._sample, name='dohome_profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and wait for the helper thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample(self):
+        own = threading.get_ident()
+        start = time.monotonic()
+        while True:
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._record(frame)
+            self.samples += 1
+            if self._stop.wait(self._interval):
+                break
+        self.duration = time.monotonic() - start
+
+    def _record(self, frame):
+        stack = []
+        leaf = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename.startswith(self._roots):
+                stack.append(_label(code))
+            elif not stack:
+                # The call out of the integration the thread is currently in.
+                leaf = _label(code)
+            frame = frame.f_back
+        if not stack:
+            return
+        self.hits += 1
+        stack.reverse()
+        if leaf is not None:
+            stack.append(leaf)
+        self.stacks[';'.join(stack)] += 1
+        self.self_counts[stack[-1]] += 1
+        self.total_counts.update(set(stack))
+
+    def write(self, path):
+        """Write the samples as collapsed stacks."""
+        with open(path, 'w', encoding='utf-8') as profile:
+            for stack, count in self.stacks.most_common():
+                profile.write(f'{stack} {count}\n')
+
+    def summary(self, top=15):
+        """Return the sample counts and the top functions by self and total samples."""
+        interval_ms = self.duration * 1000 / self.samples if self.samples else 0
+        return {
+            'duration': round(self.duration, 1),
+            'samples': self.samples,
+            'samples_in_integration': self.hits,
+            'sample_interval_ms': round(interval_ms, 2),
+            'self': [{'function': name, 'samples': count, 'ms': round(count * interval_ms, 1)}
+                     for name, count in self.self_counts.most_common(top)],
+            'total': [{'function': name, 'samples': count, 'ms': round(count * interval_ms, 1)}
+                      for name, count in self.total_counts.most_common(top)],
+        }
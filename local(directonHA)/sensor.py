@@ -1,117 +1,149 @@
 import logging
-import json
-import socket
+import time
 from datetime import timedelta
-from homeassistant.helpers.event import track_time_interval
+from functools import partial
 
-from homeassistant.const import UnitOfTemperature
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.const import PERCENTAGE, EntityCategory, UnitOfTime
+from homeassistant.core import callback
 
-from . import (DOHOME_GATEWAY, DoHomeDevice)
+from dohome_client import entity_name, entity_specs
+from dohome_client.aggregate import WindowAggregator
+
+from . import (DOHOME_METRICS, DEVICE_STATUS_INTERVAL, CONF_SENSOR_WINDOW, PACKET_BUDGET,
+               DEFAULT_SENSOR_WINDOW, DoHomeDevice, async_setup_device_platform)
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
 
 
-TEMPERATURE_KEY = "temp"
-HUMIDITY_KEY = "humi"
-ILLUMINATION_KEY = "illu"
+RTT_KEY = "rtt_p50"
+LOSS_KEY = "loss"
+
+SCAN_INTERVAL = timedelta(seconds=30)
+
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up DoHome sensors from a config entry."""
+    window = {**entry.data, **entry.options}.get(CONF_SENSOR_WINDOW, DEFAULT_SENSOR_WINDOW)
+    async_add_entities([DoHomeResourceSensor(), DoHomeBudgetSensor()])
+    await async_setup_device_platform(hass, entry, async_add_entities,
+                                      partial(build_entities, window=window))
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
-    """Perform the setup for DoHome devices."""
+
+def build_entities(hass, devices, window=DEFAULT_SENSOR_WINDOW):
+    """Return the sensor entities for devices; window is in seconds."""
     sensor_devices = []
-    devices = DOHOME_GATEWAY.devices
-    for (device_type, device_info) in devices.items():
-        for device in device_info:
-            _LOGGER.info(device)
-            if(device['type'] == '_THIMR'):
-                sensor_devices.append(DoHomeSensor(hass, 'Temperature_' + device['sid'], TEMPERATURE_KEY, device))
-                sensor_devices.append(DoHomeSensor(hass, 'Humidity_' + device['sid'], HUMIDITY_KEY, device))
-            if(device['type'] == '_THIMR'):
-                sensor_devices.append(DoHomeSensor(hass, 'illumination_' + device['sid'], ILLUMINATION_KEY, device))
-    
-    if(len(sensor_devices) > 0):
-        add_devices(sensor_devices)
-
-
-class DoHomeSensor(DoHomeDevice):
-    """Representation of a XiaomiSensor."""
-
-    def __init__(self, hass, name, data_key, device):
+    for device in devices:
+        _LOGGER.info(device)
+        for spec in entity_specs(device, 'sensor'):
+            sensor_devices.append(DoHomeSensor(hass, spec, device, window))
+        sensor_devices.append(DoHomeMetricSensor('Round trip time_' + device['sid'], RTT_KEY, device))
+        sensor_devices.append(DoHomeMetricSensor('Packet loss_' + device['sid'], LOSS_KEY, device))
+
+    return sensor_devices
+
+
+class DoHomeSensor(DoHomeDevice, SensorEntity):
+    """Temperature, humidity or illumination, published once per window.
+
+    The device is read every second. Each window publishes the mean as the
+    state, with the minimum, maximum and sample counts as attributes, so the
+    recorder stores one row per window. Long-term statistics are built from
+    the state alone: their min and max are those of the window means, and
+    the extremes within a window are only kept in the attributes.
+    """
+
+    _update_interval = DEVICE_STATUS_INTERVAL
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, hass, spec, device, window=DEFAULT_SENSOR_WINDOW):
         self._device = device
-        self.current_value = None
+        self._data_key = spec.key
+        self._unavailable = spec.unavailable
+        self._attr_native_unit_of_measurement = spec.unit
+        self._attr_device_class = spec.device_class
+        self._window = WindowAggregator(window)
+
+        DoHomeDevice.__init__(self, entity_name(spec, device), device)
+
+    @callback
+    def _handle_status(self, resp):
+        if self._data_key not in resp:
+            return
+
+        value = int(resp[self._data_key])
+        if value == self._unavailable:
+            value = None
+        summary = self._window.add(value, time.monotonic())
+        if summary is None:
+            if self._attr_native_value is not None or value is None:
+                return
+            # Publish the first reading right away rather than after a window.
+            summary = self._window.summary()
+
+        self._attr_available = summary.mean is not None
+        self._attr_native_value = round(summary.mean, 1) if summary.mean is not None else None
+        self._attr_extra_state_attributes = {
+            'min': summary.minimum,
+            'max': summary.maximum,
+            'samples': summary.samples,
+            'missing': summary.missing,
+        }
+        self.async_write_ha_state()
+
+
+class DoHomeMetricSensor(DoHomeDevice, SensorEntity):
+    """Diagnostic sensor for the link quality of one device."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, name, data_key, device):
+        DoHomeDevice.__init__(self, name, device)
         self._data_key = data_key
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        DoHomeDevice.__init__(self, name ,device)
-
-        track_time_interval(hass, self.updateStatus, timedelta(seconds=1))
-
-    @property
-    def _is_humidity(self):
-        return self._data_key == HUMIDITY_KEY
-
-    @property
-    def _is_temperature(self):
-        return self._data_key == TEMPERATURE_KEY
-
-    @property
-    def _is_illumination(self):
-        return self._data_key == ILLUMINATION_KEY
-
-
-    @property
-    def available(self):
-        """Return True if entity is available."""
-        if self._is_temperature and self.current_value != 100:
-            return True
-        elif self._is_humidity and self.current_value != 0:
-            return True
-        elif self._is_illumination and self.current_value != -1:
-            return True
-        return False
-
-    @property
-    def state(self):
-        """Return the name of the sensor."""
-        return self.current_value
-
-    @property
-    def unit_of_measurement(self):
-        """Return the unit of measurement of this entity, if any."""
-        if self._is_temperature and self.current_value != 100:
-            return UnitOfTemperature.CELSIUS
-        elif self._is_humidity and self.current_value != 0:
-            return '%'
-        elif self._is_illumination and self.current_value != -1:
-            return ''
-
-    def updateStatus(self, now):
-        resp = self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":25}', 25)
-        if resp is not None and self._data_key in resp:
-    
-            self.current_value = int(resp[self._data_key])
-            # _LOGGER.info("%s :%s", self._data_key, self.current_value)
-            self.schedule_update_ha_state()
-
-    def _send_cmd(self, device, cmd, rtn_cmd):
-
-        try:
-            self._socket.settimeout(0.5)
-            self._socket.sendto(cmd.encode(), (device["sta_ip"], 6091))
-            data, addr = self._socket.recvfrom(1024)
-        except socket.timeout:
-            return None
-
-        if data is None:
-            return None
-        dic = {i.split("=")[0]:i.split("=")[1] for i in data.decode("utf-8").split("&")}
-        resp = []
-        if(dic["dev"][8:12] == device["sid"]):
-            resp = json.loads(dic["op"])
-            if resp['cmd'] != rtn_cmd:
-                _LOGGER.debug("Non matching response. Expecting %s, but got %s", rtn_cmd, resp['cmd'])
-                return None
-            return resp
+        self._metrics = DOHOME_METRICS.get(device['sid'])
+        self._attr_unique_id = f"dohome_{device['sid']}_{data_key}"
+        if data_key == RTT_KEY:
+            self._attr_native_unit_of_measurement = UnitOfTime.MILLISECONDS
         else:
-            _LOGGER.debug("Non matching response. device %s, but got %s", device["sid"], dic["dev"][8:12])
-            return None
+            self._attr_native_unit_of_measurement = PERCENTAGE
+
+    def update(self):
+        """Read the latest metrics snapshot."""
+        snapshot = self._metrics.as_dict()
+        self._attr_native_value = snapshot.pop(self._data_key)
+        del snapshot['rtt_histogram']
+        self._attr_extra_state_attributes = snapshot
+
+
+class DoHomeResourceSensor(SensorEntity):
+    """Diagnostic sensor counting the integration's open sockets and live pollers."""
+
+    _attr_name = "DoHome open sockets"
+    _attr_unique_id = "dohome_open_sockets"
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def update(self):
+        """Read the live resource counters."""
+        counters = DOHOME_METRICS.resources.as_dict()
+        self._attr_native_value = counters.pop('sockets')
+        self._attr_extra_state_attributes = counters
+
+
+class DoHomeBudgetSensor(SensorEntity):
+    """Diagnostic sensor for the share of the site packet budget in use."""
+
+    _attr_name = "DoHome packet budget use"
+    _attr_unique_id = "dohome_packet_budget_use"
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = PERCENTAGE
+
+    def update(self):
+        """Read the last budget window."""
+        budget = PACKET_BUDGET.as_dict()
+        window = budget.pop('last_window') or {}
+        use = window.pop('use', None)
+        self._attr_native_value = round(use * 100, 1) if use is not None else None
+        self._attr_extra_state_attributes = {**budget, **window}
@@ -1,129 +1,78 @@
 import logging
-import socket
-import json
-from datetime import timedelta
-from homeassistant.helpers.event import track_time_interval
 
 from homeassistant.components.switch import SwitchEntity
+from homeassistant.core import callback
 
-from . import (DOHOME_GATEWAY, DoHomeDevice)
+from dohome_client import entity_name, entity_specs
+
+from . import (DEVICE_SHADOWS, DEVICE_STATUS_INTERVAL, DOHOME_CLIENT, DoHomeDevice,
+               async_setup_device_platform)
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.INFO)
 
-def setup_platform(hass, config, add_devices, discovery_info=None):
-    switch_devices = []
-    devices = DOHOME_GATEWAY.devices
-    
-    # Define device types that should be handled as lights
-    light_device_types = ['_STRIPE', '_DT-WYRGB']
-    
-    for (device_type, device_info) in devices.items():
-        for device in device_info:
-            _LOGGER.info(device)
-            
-            # Skip devices that should be processed as lights
-            if device['type'] in light_device_types:
-                _LOGGER.debug(f"Skipping {device['name']} in switch component as it will be handled as a light")
-                continue
-                
-            if device['type'] == '_DT-PLUG':
-                switch_devices.append(DoHomeSwitch(hass, device["name"], "soft_poweroff", device))
-            elif device['type'] == '_THIMR':
-                switch_devices.append(DoHomeSwitch(hass, device["name"], "relay", device))
-            elif device['type'] == '_REALY2':    
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_1', "relay1", device))
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_2', "relay2", device))
-            elif device['type'] == '_REALY4':    
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_1', "relay1", device))
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_2', "relay2", device))
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_3', "relay3", device))
-                switch_devices.append(DoHomeSwitch(hass, "Relay_" + device["sid"] + '_4', "relay4", device))
-    
-    if len(switch_devices) > 0:
-        add_devices(switch_devices)
+async def async_setup_entry(hass, entry, async_add_entities):
+    """Set up DoHome switches from a config entry."""
+    await async_setup_device_platform(hass, entry, async_add_entities, build_entities)
+
+
+def build_entities(hass, devices):
+    """Return the switch entities for devices."""
+    return [DoHomeSwitch(hass, spec, device)
+            for device in devices for spec in entity_specs(device, 'switch')]
 
 
 class DoHomeSwitch(DoHomeDevice, SwitchEntity):
 
-    def __init__(self, hass, name, data_key, device):
+    _update_interval = DEVICE_STATUS_INTERVAL
+
+    def __init__(self, hass, spec, device):
         self._device = device
         self._state = False
-        self._data_key = data_key
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._data_key = spec.key
+        self._inverted = spec.inverted
+        self._command = spec.command
 
+        name = entity_name(spec, device)
+        self._attr_unique_id = name
         DoHomeDevice.__init__(self, name, device)
 
-        track_time_interval(hass, self.updateStatus, timedelta(seconds=1))
-
+    async def async_added_to_hass(self):
+        """Follow the device's status and let the shadow restore a relay that lost its state."""
+        await super().async_added_to_hass()
+        self.async_on_remove(DEVICE_SHADOWS.get(self._sid).add_reconciler(
+            (self._data_key,), self._async_reconcile, self._update_interval.total_seconds()))
 
     @property
     def is_on(self):
         """Return true if plug is on."""
         return self._state
 
-    def turn_on(self, **kwargs):
+    async def async_turn_on(self, **kwargs):
         """Turn the switch on."""
         self._state = True
-        if(self._device['type'] == '_DT-PLUG' or self._device['type'] == '_THIMR'):
-            self._send_cmd(self._device,'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":5,"op":1 }', 5)
-        if(self._device['type'] == '_REALY2' or self._device['type'] == '_REALY4'):
-            self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":5,"'+ self._data_key +'":1 }', 5)
-    
-    @property
-    def unique_id(self):
-        return self._device["name"]
-        
-    def turn_off(self):
+        await self._async_set_desired(True)
+
+    async def async_turn_off(self, **kwargs):
         """Turn the switch off."""
         self._state = False
-        if(self._device['type'] == '_DT-PLUG' or self._device['type'] == '_THIMR'):
-            self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":5,"op":0 }', 5)
-        if(self._device['type'] == '_REALY2' or self._device['type'] == '_REALY4'): 
-            self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":5,"'+ self._data_key +'":0 }', 5)
-
-    def updateStatus(self, now):
-        resp = self._send_cmd(self._device, 'cmd=ctrl&devices={[' + self._device["sid"] + ']}&op={"cmd":25}', 25)
-        if resp is not None and self._data_key in resp:
-            if(self._device['type'] == '_DT-PLUG'):
-                if(resp[self._data_key]):
-                    if(self._state != False):
-                        self._state = False
-                        self.schedule_update_ha_state()
-                else:
-                    if(self._state != True):
-                        self._state = True
-                        self.schedule_update_ha_state()
-            else:
-                if(resp[self._data_key]):
-                    if(self._state != True):
-                        self._state = True
-                        self.schedule_update_ha_state()
-                else:
-                    if(self._state != False):
-                        self._state = False
-                        self.schedule_update_ha_state()
-
-    def _send_cmd(self, device, cmd, rtn_cmd):
-
-        try:
-            self._socket.settimeout(0.5)
-            self._socket.sendto(cmd.encode(), (device["sta_ip"], 6091))
-            data, addr = self._socket.recvfrom(1024)
-        except socket.timeout:
-            return None
-
-        if data is None:
-            return None
-        _LOGGER.debug("result :%s", data.decode("utf-8"))
-        dic = {i.split("=")[0]:i.split("=")[1] for i in data.decode("utf-8").split("&")}
-        resp = []
-        if(dic["dev"][8:12] == device["sid"]):
-            resp = json.loads(dic["op"])
-            if resp['cmd'] != rtn_cmd:
-                _LOGGER.debug("Non matching response. Expecting %s, but got %s", rtn_cmd, resp['cmd'])
-                return None
-            return resp
-        else:
-            _LOGGER.debug("Non matching response. device %s, but got %s", device["sid"], dic["dev"][8:12])
-            return None
\ No newline at end of file
+        await self._async_set_desired(False)
+
+    async def _async_set_desired(self, on):
+        # Nothing is sent when the relay already reports the wanted state.
+        if DEVICE_SHADOWS.set_desired(self._sid, {self._data_key: int(on != self._inverted)}):
+            await DOHOME_CLIENT.async_set_power(self._device, on, self._command)
+
+    async def _async_reconcile(self, drift):
+        on = bool(drift[self._data_key]) != self._inverted
+        await DOHOME_CLIENT.async_set_power(self._device, on, self._command)
+
+    @callback
+    def _handle_status(self, resp):
+        if self._data_key in resp:
+            value = bool(resp[self._data_key])
+            DEVICE_SHADOWS.get(self._sid).report({self._data_key: int(value)})
+            state = value != self._inverted
+            if state != self._state:
+                self._state = state
+                self.async_write_ha_state()
@@ -0,0 +1,195 @@
+"""
+Event loop lag and executor saturation watchdog.
+
+A timer on the event loop measures how late it fires, which is how long the
+loop was blocked, and samples the depth of the executor queue. The
+integration reports the duration of its own callbacks here, tagged with the
+entity and device that ran them; they are the status listeners, which run
+on the loop. DoHome polls and commands do not use the executor.
+
+When the loop lags past a threshold, the warning says how much of it DoHome
+work accounts for, and a repair issue is raised if the integration is the
+main cause. A backed up executor queue is logged with the slowest DoHome
+calls. Issues are removed again once everything has stayed below the
+thresholds for a full window.
+"""
+import logging
+import time
+from collections import deque
+from threading import Lock
+
+from homeassistant.core import callback
+from homeassistant.helpers import issue_registry as ir
+
+_LOGGER = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 0.5
+WINDOW = 60
+LAG_THRESHOLD = 0.5
+QUEUE_THRESHOLD = 32
+SLOW_CALL = 0.5
+REPORT_INTERVAL = 60
+
+ISSUE_LAG = 'event_loop_lag'
+ISSUE_EXECUTOR = 'executor_saturated'
+
+
+class DoHomeWatchdog:
+    """Measure loop lag and executor depth and attribute it to DoHome calls."""
+
+    def __init__(self, hass, domain, lag_threshold=LAG_THRESHOLD,
+                 queue_threshold=QUEUE_THRESHOLD, slow_call=SLOW_CALL):
+        self._hass = hass
+        self._domain = domain
+        self._lag_threshold = lag_threshold
+        self._queue_threshold = queue_threshold
+        self._slow_call = slow_call
+        # Appended from executor threads and read on the loop.
+        self._calls = deque(maxlen=1000)
+        self._calls_lock = Lock()
+        self._handle = None
+        self._last_check = None
+        self._last_exceeded = 0.0
+        self._last_report = {}
+        self._issues = set()
+        self.checks = 0
+        self.lag_max = 0.0
+        self.lag_total = 0.0
+        self.queue_max = 0
+        self.slow_calls = 0
+
+    @callback
+    def async_start(self):
+        loop = self._hass.loop
+        self._last_check = loop.time()
+        self._handle = loop.call_at(self._last_check + CHECK_INTERVAL, self._check,
+                                    self._last_check + CHECK_INTERVAL)
+
+    @callback
+    def async_stop(self, event=None):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def record_call(self, entity_id, sid, name, duration, in_loop=False):
+        """Record one DoHome callback; duration is in seconds."""
+        with self._calls_lock:
+            self._calls.append((time.monotonic(), duration, entity_id, sid, name, in_loop))
+        if duration >= self._slow_call:
+            self.slow_calls += 1
+            _LOGGER.warning("Slow DoHome call %s of %s (device %s) took %.2f s%s",
+                            name, entity_id, sid, duration, ' on the event loop' if in_loop else '')
+
+    @callback
+    def _check(self, expected):
+        loop = self._hass.loop
+        now = loop.time()
+        try:
+            self._measure(loop, now, expected)
+        except Exception:  # pylint: disable=broad-except
+            _LOGGER.exception("DoHome watchdog check failed")
+        finally:
+            # Always rescheduled: one failed check must not stop the watchdog.
+            self._last_check = now
+            if self._handle is not None:
+                self._handle = loop.call_at(now + CHECK_INTERVAL, self._check,
+                                            now + CHECK_INTERVAL)
+
+    def _measure(self, loop, now, expected):
+        lag = max(now - expected, 0.0)
+        depth = _executor_load(loop)
+        self.checks += 1
+        self.lag_total += lag
+        self.lag_max = max(self.lag_max, lag)
+        self.queue_max = max(self.queue_max, depth)
+
+        if lag > self._lag_threshold:
+            dohome = self._loop_time(now - self._last_check)
+            self._exceeded(ISSUE_LAG, lag, now, dohome, dohome >= lag / 2)
+        if depth > self._queue_threshold:
+            # DoHome runs nothing in the executor, so it is never the cause.
+            self._exceeded(ISSUE_EXECUTOR, depth, now, 0, False)
+        if self._issues and now - self._last_exceeded > WINDOW:
+            for issue_id in self._issues:
+                ir.async_delete_issue(self._hass, self._domain, issue_id)
+            self._issues.clear()
+
+    def _exceeded(self, issue_id, value, now, dohome, caused):
+        """Warn about one exceeded threshold and raise an issue if DoHome caused it."""
+        self._last_exceeded = now
+        if now - self._last_report.get(issue_id, -REPORT_INTERVAL) < REPORT_INTERVAL:
+            return
+        self._last_report[issue_id] = now
+
+        culprits = ', '.join(
+            f"{entity_id} ({sid}) {name} {total:.2f} s in {count}"
+            for entity_id, sid, name, total, count in self.culprits(3))
+        if issue_id == ISSUE_LAG:
+            _LOGGER.warning("Event loop lagged %.2f s; DoHome callbacks ran %.2f s on the loop "
+                            "meanwhile. Slowest DoHome calls: %s", value, dohome, culprits or 'none')
+            placeholders = {'lag': f'{value:.2f}', 'dohome': f'{dohome:.2f}'}
+        else:
+            _LOGGER.warning("Executor queue is %d jobs deep. Slowest DoHome calls: %s",
+                            value, culprits or 'none')
+            placeholders = {'depth': str(value), 'dohome': str(dohome)}
+
+        if caused:
+            placeholders['culprits'] = culprits or '-'
+            ir.async_create_issue(
+                self._hass, self._domain, issue_id, is_fixable=False,
+                severity=ir.IssueSeverity.WARNING, translation_key=issue_id,
+                translation_placeholders=placeholders)
+            self._issues.add(issue_id)
+
+    def _loop_time(self, since):
+        """Return seconds spent in DoHome callbacks on the loop in the last since seconds."""
+        start = time.monotonic() - since
+        return sum(duration for end, duration, _, _, _, in_loop in self._recent_calls()
+                   if in_loop and end >= start)
+
+    def culprits(self, count=5, window=WINDOW):
+        """Return the entities with the most DoHome callback time in the window."""
+        start = time.monotonic() - window
+        totals = {}
+        for end, duration, entity_id, sid, name, _ in self._recent_calls():
+            if end < start:
+                continue
+            key = (entity_id, sid, name)
+            total, calls = totals.get(key, (0.0, 0))
+            totals[key] = (total + duration, calls + 1)
+        ranked = sorted(totals.items(), key=lambda item: item[1][0], reverse=True)
+        return [(*key, total, calls) for key, (total, calls) in ranked[:count]]
+
+    def _recent_calls(self):
+        with self._calls_lock:
+            return list(self._calls)
+
+    def as_dict(self):
+        return {
+            'checks': self.checks,
+            'lag_max': round(self.lag_max, 3),
+            'lag_mean': round(self.lag_total / self.checks, 4) if self.checks else None,
+            'executor_queue_max': self.queue_max,
+            'slow_calls': self.slow_calls,
+            'culprits': [
+                {'entity_id': entity_id, 'sid': sid, 'call': name,
+                 'seconds': round(total, 3), 'count': calls}
+                for entity_id, sid, name, total, calls in self.culprits()
+            ],
+            'issues': sorted(self._issues),
+        }
+
+
+def _executor_load(loop):
+    """Return the queued jobs of the loop's default executor, or 0.
+
+    asyncio has no public way to ask, so this reads ThreadPoolExecutor
+    internals and gives up quietly when they are not there.
+    """
+    try:
+        executor = loop._default_executor  # pylint: disable=protected-access
+        if executor is None:
+            return 0
+        return executor._work_queue.qsize()  # pylint: disable=protected-access
+    except (AttributeError, NotImplementedError):
+        return 0
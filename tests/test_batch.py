@@ -0,0 +1,128 @@
+import asyncio
+
+from dohome_client.batch import EXCLUDE_AFTER_MISSES, MODE_BATCH, MODE_SINGLE, BatchStatusPoller
+
+BUS = '127.2.255.255'
+
+
+class FakeTransport:
+    """Devices whose firmware may or may not answer multi-device frames."""
+
+    def __init__(self, batching=(), single_only=(), silent=()):
+        self.batching = set(batching)
+        self.single_only = set(single_only)
+        self.silent = set(silent)
+        self.batches = []
+        self.singles = []
+
+    def status(self, device):
+        return None if device['sid'] in self.silent else {'cmd': 25, 'sid': device['sid']}
+
+    async def async_send_batch(self, devices, frame, rtn_cmd, target):
+        assert target == BUS
+        self.batches.append(sorted(device['sid'] for device in devices))
+        return {device['sid']: self.status(device)
+                if device['type'] in self.batching and device['sid'] not in self.single_only
+                else None
+                for device in devices}
+
+    async def async_send_cmd(self, device, frame, rtn_cmd, retries=0):
+        self.singles.append(device['sid'])
+        return self.status(device)
+
+
+def devices(device_type, count, first=0):
+    return [{'sid': f'{index:04x}', 'type': device_type} for index in range(first, first + count)]
+
+
+def poll_rounds(poller, fleet, rounds):
+    async def run():
+        return [await poller.async_poll(fleet) for _ in range(rounds)]
+
+    return asyncio.run(run())
+
+
+def test_lone_device_is_polled_singly():
+    transport = FakeTransport(batching=['_STRIPE'])
+    poller = BatchStatusPoller(transport, BUS)
+
+    poll_rounds(poller, devices('_STRIPE', 1), 2)
+
+    assert transport.batches == []
+    assert transport.singles == ['0000', '0000']
+    assert poller.modes == {}
+
+
+def test_batching_model_is_polled_in_batches():
+    transport = FakeTransport(batching=['_STRIPE'])
+    poller = BatchStatusPoller(transport, BUS, max_batch=2)
+    fleet = devices('_STRIPE', 5)
+
+    replies = poll_rounds(poller, fleet, 2)
+
+    assert all(resp is not None for round_replies in replies for resp in round_replies.values())
+    assert poller.modes['_STRIPE'][0] == MODE_BATCH
+    # Five devices in batches of two, each round.
+    assert len(transport.batches) == 6
+    assert transport.singles == []
+
+
+def test_model_that_ignores_batches_falls_back_in_the_same_round():
+    transport = FakeTransport()
+    poller = BatchStatusPoller(transport, BUS)
+    fleet = devices('_DT-PLUG', 3)
+
+    first, second = poll_rounds(poller, fleet, 2)
+
+    assert all(resp is not None for resp in first.values())
+    assert all(resp is not None for resp in second.values())
+    assert poller.modes['_DT-PLUG'][0] == MODE_SINGLE
+    # Only the first round probes with a batch.
+    assert len(transport.batches) == 1
+    assert len(transport.singles) == 6
+
+
+def test_single_model_is_probed_again_after_reprobe_rounds():
+    transport = FakeTransport()
+    poller = BatchStatusPoller(transport, BUS, reprobe_rounds=3)
+
+    poll_rounds(poller, devices('_DT-PLUG', 2), 4)
+
+    assert len(transport.batches) == 2
+
+
+def test_models_are_decided_separately():
+    transport = FakeTransport(batching=['_STRIPE'])
+    poller = BatchStatusPoller(transport, BUS)
+
+    poll_rounds(poller, devices('_STRIPE', 2) + devices('_DT-PLUG', 2, first=2), 2)
+
+    assert poller.as_dict()['modes'] == {'_STRIPE': MODE_BATCH, '_DT-PLUG': MODE_SINGLE}
+    assert transport.batches == [['0000', '0001'], ['0002', '0003'], ['0000', '0001']]
+
+
+def test_device_that_only_answers_singly_leaves_the_batch():
+    transport = FakeTransport(batching=['_STRIPE'], single_only=['0002'])
+    poller = BatchStatusPoller(transport, BUS)
+    fleet = devices('_STRIPE', 3)
+
+    poll_rounds(poller, fleet, EXCLUDE_AFTER_MISSES)
+    assert transport.singles == ['0002'] * EXCLUDE_AFTER_MISSES
+    transport.batches.clear()
+
+    poll_rounds(poller, fleet, 1)
+
+    assert transport.batches == [['0000', '0001']]
+    assert poller.as_dict()['single_devices'] == ['0002']
+
+
+def test_silent_device_is_not_taken_for_single_only():
+    transport = FakeTransport(batching=['_STRIPE'], silent=['0002'])
+    poller = BatchStatusPoller(transport, BUS)
+
+    replies = poll_rounds(poller, devices('_STRIPE', 3), EXCLUDE_AFTER_MISSES + 1)
+
+    assert replies[-1]['0002'] is None
+    assert poller.modes['_STRIPE'][0] == MODE_BATCH
+    assert poller.as_dict()['single_devices'] == []
+    assert transport.batches[-1] == ['0000', '0001', '0002']
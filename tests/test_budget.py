@@ -0,0 +1,67 @@
+import pytest
+
+from dohome_client.budget import COMMAND, COMMAND_BURST, POLL, POLL_BURST, PacketBudget
+
+RATE = 100
+COMMAND_SHARE = 0.2
+POLL_INTERVAL = 1 / (RATE * (1 - COMMAND_SHARE))
+COMMAND_INTERVAL = 1 / (RATE * COMMAND_SHARE)
+
+
+def budget():
+    return PacketBudget(RATE, COMMAND_SHARE)
+
+
+def test_burst_is_sent_at_once_then_paced():
+    packets = budget()
+
+    delays = [packets.reserve(POLL, now=10.0) for _ in range(POLL_BURST + 3)]
+
+    assert delays[:POLL_BURST + 1] == [0.0] * (POLL_BURST + 1)
+    assert delays[POLL_BURST + 1:] == pytest.approx([POLL_INTERVAL, 2 * POLL_INTERVAL])
+
+
+def test_commands_are_not_delayed_by_a_poll_backlog():
+    packets = budget()
+    for _ in range(10 * POLL_BURST):
+        packets.reserve(POLL, now=10.0)
+
+    assert packets.reserve(COMMAND, now=10.0) == 0.0
+
+
+def test_commands_are_paced_at_their_share():
+    packets = budget()
+
+    delays = [packets.reserve(COMMAND, now=10.0) for _ in range(COMMAND_BURST + 2)]
+
+    assert delays[-1] == pytest.approx(COMMAND_INTERVAL)
+
+
+def test_max_delay_skips_without_taking_a_slot():
+    packets = budget()
+    for _ in range(POLL_BURST + 5):
+        packets.reserve(POLL, now=10.0)
+
+    assert packets.reserve(POLL, max_delay=POLL_INTERVAL, now=10.0) is None
+    assert packets.deferred == 1
+    assert packets.reserve(POLL, now=10.0) == pytest.approx(5 * POLL_INTERVAL)
+
+
+def test_backlog_advances_from_the_granted_slot():
+    # Once polls are backlogged, the fair share spaces one device's polls
+    # out beyond the backlog, which must still move past every slot granted.
+    packets = budget()
+    for sid in ('a', 'b', 'c', 'd'):
+        packets.reserve(POLL, sid, now=10.0)
+    for _ in range(100):
+        packets.reserve(POLL, 'e', now=10.0)
+
+    for _ in range(6):
+        delay = packets.reserve(POLL, 'a', now=11.0)
+        assert packets._tat[POLL] >= 11.0 + delay + POLL_INTERVAL - 1e-9
+
+
+def test_no_rate_removes_the_cap():
+    packets = PacketBudget(0)
+
+    assert [packets.reserve(POLL, now=10.0) for _ in range(1000)] == [0.0] * 1000
@@ -0,0 +1,83 @@
+import pytest
+
+from dohome_client.color import DEVICE_SCALE, OP_OFF, DoHomeColorEngine, device_brightness
+
+COLORS = [
+    (255, 0, 0, 0, 0),
+    (255, 128, 0, 0, 0),
+    (12, 255, 200, 0, 0),
+    (0, 0, 0, 255, 0),
+    (0, 0, 0, 40, 255),
+    (255, 255, 255, 255, 255),
+]
+
+
+def test_full_brightness_white_is_full_scale():
+    engine = DoHomeColorEngine()
+
+    assert engine.encode((255,) * 5, 255) == (DEVICE_SCALE,) * 5
+    assert engine.encode_op((255,) * 5, 0) == OP_OFF
+
+
+@pytest.mark.parametrize('gamma', [0.5, 2.2])
+def test_gamma_table_keeps_the_ends_and_bends_the_middle(gamma):
+    linear, curved = DoHomeColorEngine(), DoHomeColorEngine(gamma)
+
+    assert curved.gamma == gamma
+    for level in (0, 255):
+        assert curved.encode((level,) * 5, 255) == linear.encode((level,) * 5, 255)
+    expected = int(DEVICE_SCALE * (128 / 255) ** gamma)
+    assert curved.encode((128, 0, 0, 0, 0), 255)[0] == pytest.approx(expected, abs=1)
+    if gamma > 1:
+        assert curved.encode((128, 0, 0, 0, 0), 255) < linear.encode((128, 0, 0, 0, 0), 255)
+
+
+def test_set_gamma_rebuilds_the_table():
+    engine = DoHomeColorEngine(2.2)
+    engine.set_gamma(None)
+
+    assert engine.gamma is None
+    assert engine.encode((128, 0, 0, 0, 0), 255) == DoHomeColorEngine().encode(
+        (128, 0, 0, 0, 0), 255)
+
+
+def test_decode_inverts_encode_at_full_brightness():
+    engine = DoHomeColorEngine()
+
+    for color in COLORS:
+        assert engine.decode(engine.encode(color, 255)) == (color, 255)
+
+
+@pytest.mark.parametrize('gamma', [None, 2.2])
+@pytest.mark.parametrize('brightness', [1, 3, 64, 128, 200, 255])
+def test_decoded_color_encodes_to_within_a_step_of_the_frame(gamma, brightness):
+    # Below full brightness several levels share a device value, so decode
+    # picks one of them and re-encoding may land one device step away.
+    engine = DoHomeColorEngine(gamma)
+
+    for color in COLORS:
+        values = engine.encode(color, brightness)
+        decoded = engine.decode(values)
+        if decoded is None:
+            assert values == (0,) * 5
+            continue
+        rgbww, decoded_brightness = decoded
+        assert device_brightness(decoded_brightness) == device_brightness(brightness)
+        again = engine.encode(rgbww, decoded_brightness)
+        assert all(abs(x - y) <= 1 for x, y in zip(again, values)), (color, again, values)
+
+
+def test_decode_of_an_off_frame_is_none():
+    assert DoHomeColorEngine().decode((0, 0, 0, 0, 0)) is None
+
+
+def test_encode_batch_matches_encode():
+    engine = DoHomeColorEngine(2.2)
+    brightness = [255, 128, 64, 3, 200, 1]
+
+    shared = engine.encode_batch(COLORS, 128)
+    each = engine.encode_batch(COLORS, brightness)
+
+    assert [tuple(row) for row in shared] == [engine.encode(color, 128) for color in COLORS]
+    assert [tuple(row) for row in each] == [
+        engine.encode(color, b) for color, b in zip(COLORS, brightness)]
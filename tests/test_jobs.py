@@ -0,0 +1,43 @@
+import asyncio
+
+from dohome_client.jobs import STATE_DONE, DiscoveryJobManager
+from dohome_client.registry import DeviceRegistry
+
+
+def test_request_after_the_scan_ended_starts_a_new_one():
+    async def scenario():
+        manager = DiscoveryJobManager(DeviceRegistry())
+        first = manager.request()
+        # Catch the gap between the task ending and its done-callback
+        # clearing manager.job.
+        while not first._task.done():
+            await asyncio.sleep(0)
+        assert manager.job is first
+        assert not manager.running
+
+        second = manager.request()
+        await second.async_wait()
+        await asyncio.sleep(0)
+        return manager, first, second
+
+    manager, first, second = asyncio.run(scenario())
+
+    assert second is not first
+    assert first.requests == second.requests == 1
+    assert first.state == second.state == STATE_DONE
+    assert manager.job is None
+    assert manager.last_job is second
+
+
+def test_request_while_the_scan_runs_joins_it():
+    async def scenario():
+        manager = DiscoveryJobManager(DeviceRegistry())
+        first = manager.request(0.05)
+        second = manager.request(0.1)
+        await first.async_wait()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    assert second is first
+    assert first.requests == 2
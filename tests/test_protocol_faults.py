@@ -0,0 +1,179 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'tools'))
+
+from simulator import DeviceSimulator, FaultModel  # noqa: E402
+
+from dohome_client.codec import CMD_STATUS, ctrl_frame  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport, DoHomeTransport  # noqa: E402
+
+TIMEOUT = 0.05
+STATUS = '{"cmd":25}'
+
+
+def poll(device):
+    return ctrl_frame(device.sid, STATUS)
+
+
+class SimulatorThread:
+    """Serve a DeviceSimulator from its own loop, for the blocking transport."""
+
+    def __init__(self, count, faults):
+        self.simulator = DeviceSimulator(count, types=['_STRIPE'], faults=faults)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self.simulator.start(), self._loop).result()
+        return self.simulator
+
+    def __exit__(self, *exc):
+        self._loop.call_soon_threadsafe(self.simulator.close)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        # Run the callbacks that close the device sockets.
+        self._loop.run_until_complete(asyncio.sleep(0))
+        self._loop.close()
+
+
+def run_async(faults, scenario, count=1):
+    """Run scenario(transport, devices) against a simulator on the same loop."""
+    async def run():
+        simulator = DeviceSimulator(count, types=['_STRIPE'], faults=faults)
+        await simulator.start()
+        transport = DoHomeAsyncTransport(timeout=TIMEOUT)
+        try:
+            result = await scenario(transport, simulator.devices)
+            # Let duplicated and late replies arrive before counting them.
+            await asyncio.sleep(0.1)
+            return result, transport.stats
+        finally:
+            transport.close()
+            simulator.close()
+
+    return asyncio.run(run())
+
+
+def test_sync_lost_requests_are_retried():
+    transport = DoHomeTransport(timeout=TIMEOUT)
+    with SimulatorThread(1, FaultModel(loss=1.0)) as simulator:
+        device = simulator.devices[0]
+        try:
+            assert transport.send_cmd(device.info, poll(device), CMD_STATUS, retries=2) is None
+        finally:
+            transport.close()
+
+    assert device.requests == 3
+    assert transport.stats.requests == transport.stats.timeouts == 3
+    assert transport.stats.replies == 0
+
+
+def test_sync_late_reply_is_drained_not_returned():
+    faults = FaultModel(latency=2 * TIMEOUT, distribution='fixed')
+    transport = DoHomeTransport(timeout=TIMEOUT)
+    with SimulatorThread(1, faults) as simulator:
+        device = simulator.devices[0]
+        try:
+            assert transport.send_cmd(device.info, poll(device), CMD_STATUS) is None
+            faults.latency = 0.0
+            # The first reply lands on the retired socket in the meantime.
+            time.sleep(2 * TIMEOUT)
+            resp = transport.send_cmd(device.info, poll(device), CMD_STATUS)
+        finally:
+            transport.close()
+
+    assert resp['seq'] == 2
+    assert transport.stats.late == 1
+    assert transport.stats.timeouts == 1
+
+
+def test_sync_duplicate_reply_is_drained_before_the_next_request():
+    transport = DoHomeTransport(timeout=TIMEOUT)
+    with SimulatorThread(1, FaultModel(duplicate=1.0)) as simulator:
+        device = simulator.devices[0]
+        try:
+            seqs = [transport.send_cmd(device.info, poll(device), CMD_STATUS)['seq']
+                    for _ in range(3)]
+            # Every copy has landed by now and is drained by the next request.
+            time.sleep(TIMEOUT)
+            seqs.append(transport.send_cmd(device.info, poll(device), CMD_STATUS)['seq'])
+        finally:
+            transport.close()
+
+    assert seqs == [1, 2, 3, 4]
+    assert transport.stats.late == 3
+    assert transport.stats.mismatched == 0
+
+
+def test_async_lost_requests_are_retried():
+    async def scenario(transport, devices):
+        return await transport.async_send_cmd(devices[0].info, poll(devices[0]), CMD_STATUS,
+                                              retries=2)
+
+    resp, stats = run_async(FaultModel(loss=1.0), scenario)
+
+    assert resp is None
+    assert stats.requests == stats.timeouts == 3
+    assert stats.replies == 0
+
+
+def test_async_retry_gets_the_fresh_reply_not_the_late_one():
+    faults = FaultModel(latency=2 * TIMEOUT, distribution='fixed')
+
+    async def scenario(transport, devices):
+        device = devices[0]
+        first = await transport.async_send_cmd(device.info, poll(device), CMD_STATUS)
+        faults.latency = 0.0
+        return first, await transport.async_send_cmd(device.info, poll(device), CMD_STATUS)
+
+    (first, second), stats = run_async(faults, scenario)
+
+    assert first is None
+    assert second['seq'] == 2
+    assert stats.timeouts == 1
+    assert stats.late == 1
+
+
+def test_async_duplicate_replies_are_counted_late():
+    async def scenario(transport, devices):
+        device = devices[0]
+        return [(await transport.async_send_cmd(device.info, poll(device), CMD_STATUS))['seq']
+                for _ in range(3)]
+
+    seqs, stats = run_async(FaultModel(duplicate=1.0, latency=0.002, distribution='fixed'),
+                            scenario)
+
+    assert seqs == [1, 2, 3]
+    assert stats.replies == 3
+    assert stats.late == 3
+
+
+def test_async_replies_are_matched_on_sid_and_cmd():
+    faults = FaultModel(latency=0.01, jitter=0.01, reorder=0.3, reorder_delay=0.02, seed=1)
+
+    async def scenario(transport, devices):
+        for index, device in enumerate(devices):
+            device.state['r'] = index
+        # A poll and a command in flight to every device at once, answered
+        # out of order.
+        requests = []
+        for device in devices:
+            requests.append(transport.async_send_cmd(device.info, poll(device), CMD_STATUS))
+            requests.append(transport.async_send_cmd(
+                device.info, ctrl_frame(device.sid, '{"cmd":6,"g":1}'), 6))
+        return await asyncio.gather(*requests)
+
+    replies, stats = run_async(faults, scenario, count=20)
+
+    for index in range(20):
+        status, command = replies[2 * index], replies[2 * index + 1]
+        assert status['cmd'] == 25
+        assert status['r'] == index
+        assert command == {'cmd': 6, 'res': 0, 'seq': command['seq']}
+    assert stats.replies == 40
+    assert stats.late == stats.mismatched == 0
@@ -0,0 +1,130 @@
+import asyncio
+
+from dohome_client.shadow import SETTLE_INTERVALS, ShadowStore
+
+SID = 'a1b2'
+STALE_AFTER = 30.0
+SETTLE = 5.0
+MAX_ATTEMPTS = 3
+
+
+def store():
+    return ShadowStore(STALE_AFTER, SETTLE, MAX_ATTEMPTS)
+
+
+class Reconciler:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, values):
+        self.calls.append(values)
+
+
+def reconcile(shadows, now):
+    return asyncio.run(shadows.async_reconcile(now))
+
+
+def test_desired_state_the_device_reports_is_not_sent():
+    shadows = store()
+    shadows.get(SID).report({'relay': 1, 'temp': 22}, now=0.0)
+
+    assert shadows.set_desired(SID, {'relay': 1}, now=1.0) == {}
+    assert shadows.set_desired(SID, {'relay': 0}, now=1.0) == {'relay': 0}
+    assert (shadows.sent, shadows.suppressed) == (1, 1)
+
+
+def test_report_confirms_the_pending_value():
+    shadows = store()
+    shadow = shadows.get(SID)
+    shadow.report({'relay': 0}, now=0.0)
+    shadows.set_desired(SID, {'relay': 1}, now=1.0)
+    assert shadow.pending() == {'relay': (1, 0)}
+
+    shadow.report({'relay': 1}, now=2.0)
+
+    assert shadow.pending() == {}
+    # Confirmed now, so asking again sends nothing.
+    assert shadows.set_desired(SID, {'relay': 1}, now=3.0) == {}
+
+
+def test_unconfirmed_value_is_resent_after_settle_then_adopted():
+    shadows = store()
+    shadow = shadows.get(SID)
+    reconciler = Reconciler()
+    shadow.add_reconciler(['relay'], reconciler)
+    shadow.report({'relay': 0}, now=0.0)
+    shadows.set_desired(SID, {'relay': 1}, now=0.0)
+
+    assert reconcile(shadows, SETTLE - 1) == 0
+    for attempt in range(1, MAX_ATTEMPTS):
+        assert reconcile(shadows, attempt * SETTLE) == 1
+    assert reconciler.calls == [{'relay': 1}] * (MAX_ATTEMPTS - 1)
+
+    # Sent MAX_ATTEMPTS times without a confirming report: give up.
+    assert reconcile(shadows, MAX_ATTEMPTS * SETTLE) == 0
+    assert shadow.desired['relay'] == 0
+    assert shadow.pending() == {}
+    assert (shadows.reconciled, shadows.adopted) == (MAX_ATTEMPTS - 1, 1)
+
+
+def test_change_made_at_the_device_is_followed():
+    shadows = store()
+    shadow = shadows.get(SID)
+    reconciler = Reconciler()
+    shadow.add_reconciler(['relay'], reconciler)
+    shadow.report({'relay': 0}, now=0.0)
+    shadows.set_desired(SID, {'relay': 1}, now=0.0)
+    shadow.report({'relay': 1}, now=1.0)
+
+    # Switched off at the device while it stayed reachable.
+    shadow.report({'relay': 0}, now=2.0)
+
+    assert shadow.desired['relay'] == 0
+    assert reconcile(shadows, 2.0 + 10 * SETTLE) == 0
+    assert reconciler.calls == []
+
+
+def test_state_lost_while_offline_is_restored():
+    shadows = store()
+    shadow = shadows.get(SID)
+    reconciler = Reconciler()
+    shadow.add_reconciler(['r', 'g'], reconciler)
+    shadow.report({'r': 0, 'g': 0}, now=0.0)
+    shadows.set_desired(SID, {'r': 5000, 'g': 2500}, now=0.0)
+    shadow.report({'r': 5000, 'g': 2500}, now=1.0)
+
+    # Silent past stale_after, then back in its power-on default.
+    reconcile(shadows, 1.0 + STALE_AFTER + 1)
+    back = 1.0 + STALE_AFTER + 2
+    shadow.report({'r': 0, 'g': 0}, now=back)
+
+    assert reconcile(shadows, back + SETTLE) == 1
+    assert reconciler.calls == [{'r': 5000, 'g': 2500}]
+
+
+def test_settle_waits_for_the_slowest_report_interval():
+    shadows = store()
+    shadow = shadows.get(SID)
+    reconciler = Reconciler()
+    shadow.add_reconciler(['relay'], reconciler, report_interval=10.0)
+    shadow.report({'relay': 0}, now=0.0)
+    shadows.set_desired(SID, {'relay': 1}, now=0.0)
+
+    assert shadow.settle(SETTLE) == 10.0 * SETTLE_INTERVALS
+    assert reconcile(shadows, 10.0 * SETTLE_INTERVALS - 1) == 0
+    assert reconcile(shadows, 10.0 * SETTLE_INTERVALS) == 1
+
+
+def test_reconciler_only_gets_its_own_keys():
+    shadows = store()
+    shadow = shadows.get(SID)
+    relays, lights = Reconciler(), Reconciler()
+    shadow.add_reconciler(['relay1'], relays)
+    remove = shadow.add_reconciler(['r'], lights)
+    shadow.report({'relay1': 0, 'r': 0}, now=0.0)
+    shadows.set_desired(SID, {'relay1': 1, 'r': 100}, now=0.0)
+    remove()
+
+    assert reconcile(shadows, SETTLE) == 1
+    assert relays.calls == [{'relay1': 1}]
+    assert lights.calls == []
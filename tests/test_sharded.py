@@ -0,0 +1,39 @@
+from dohome_client.sharded import partition, shard_of, status_delta
+
+
+def test_first_reply_is_all_delta():
+    known = {}
+
+    assert status_delta(known, {'cmd': 25, 'op': 1, 'seq': 3}) == {'cmd': 25, 'op': 1}
+    assert known == {'cmd': 25, 'op': 1}
+
+
+def test_unchanged_reply_has_no_delta():
+    known = {'cmd': 25, 'op': 1}
+
+    assert status_delta(known, {'cmd': 25, 'op': 1, 'seq': 4}) == {}
+
+
+def test_only_changed_values_are_sent():
+    known = {'cmd': 25, 'r': 0, 'g': 0}
+
+    assert status_delta(known, {'cmd': 25, 'r': 0, 'g': 5000}) == {'g': 5000}
+    assert known == {'cmd': 25, 'r': 0, 'g': 5000}
+
+
+def test_none_is_a_value_not_a_missing_key():
+    known = {}
+
+    assert status_delta(known, {'temperature': None}) == {'temperature': None}
+    assert status_delta(known, {'temperature': None}) == {}
+
+
+def test_partition_is_stable_and_complete():
+    devices = [{'sid': f'{index:04x}'} for index in range(100)]
+
+    parts = partition(devices, 4)
+
+    assert sorted(device['sid'] for part in parts for device in part) == \
+        sorted(device['sid'] for device in devices)
+    for shard, part in enumerate(parts):
+        assert all(shard_of(device['sid'], 4) == shard for device in part)
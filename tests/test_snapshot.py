@@ -0,0 +1,59 @@
+import asyncio
+import json
+
+from dohome_client.codec import CMD_STATUS
+from dohome_client.snapshot import async_restore, restore_frames
+
+LIGHT = {'sid': 'a1b2', 'name': 'DT-WYRGB_a1b2', 'sta_ip': '127.0.0.1', 'type': '_DT-WYRGB'}
+PLUG = {'sid': 'c3d4', 'name': 'DT-PLUG_c3d4', 'sta_ip': '127.0.0.2', 'type': '_DT-PLUG'}
+
+
+class FakeTransport:
+    """Devices that apply the ops they are sent and report them in cmd 25."""
+
+    def __init__(self, states):
+        self.states = states
+        self.sent = []
+
+    async def async_send_cmd(self, device, frame, rtn_cmd, retries=0):
+        op = json.loads(frame.decode().split('&op=', 1)[1])
+        state = self.states[device['sid']]
+        if rtn_cmd == CMD_STATUS:
+            return dict(state)
+        self.sent.append((device['sid'], op))
+        state.update((key, value) for key, value in op.items() if key != 'cmd')
+        return {'cmd': rtn_cmd, 'res': 0}
+
+
+def snapshot_of(device, values):
+    return {'devices': {device['sid']: {'device': device, 'values': values}}}
+
+
+def test_restore_resends_matching_channels_of_a_light():
+    wanted = {'r': 5000, 'g': 0, 'b': 5000, 'w': 0, 'm': 0}
+    transport = FakeTransport({LIGHT['sid']: {'r': 5000, 'g': 5000, 'b': 5000, 'w': 0, 'm': 0}})
+
+    summary = asyncio.run(async_restore(transport, snapshot_of(LIGHT, wanted)))
+
+    assert transport.states[LIGHT['sid']] == wanted
+    assert summary['restored'] == 1
+    assert summary['rounds'] == 1
+    assert summary['commands'] == 1
+    assert summary['failed'] == []
+
+
+def test_restore_leaves_matching_devices_alone():
+    transport = FakeTransport({PLUG['sid']: {'soft_poweroff': 1}})
+
+    summary = asyncio.run(async_restore(transport, snapshot_of(PLUG, {'soft_poweroff': 1})))
+
+    assert transport.sent == []
+    assert summary['unchanged'] == 1
+    assert summary['rounds'] == 0
+
+
+def test_restore_frames_sends_missing_channels_as_zero():
+    (frame, _), = restore_frames(LIGHT, {'g': 300})
+
+    op = json.loads(frame.decode().split('&op=', 1)[1])
+    assert (op['r'], op['g'], op['b'], op['w'], op['m']) == (0, 300, 0, 0, 0)
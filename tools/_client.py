@@ -0,0 +1,26 @@
+"""
+Import helper for the developer tools.
+
+The tools exercise the dohome_client library, which does not depend on Home
+Assistant. Putting the repository root on the import path makes it
+importable from a checkout without installing it.
+"""
+import resource
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+def load_client():
+    """Make the ``dohome_client`` package at the repository root importable."""
+    if str(REPO_DIR) not in sys.path:
+        sys.path.insert(0, str(REPO_DIR))
+
+
+def raise_fd_limit(wanted):
+    """Raise the soft open-file limit to at least wanted, if allowed."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < wanted:
+        target = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
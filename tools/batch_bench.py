@@ -0,0 +1,93 @@
+"""
+Packets per polling round with multi-device status frames.
+
+Serves a simulated fleet and polls it for a number of rounds twice: with a
+single-device cmd 25 frame per device, then through BatchStatusPoller,
+which probes each model and asks batching models with one frame per group
+of devices. Reports frames sent per round, polls per second, the answered
+ratio and the mode recorded for each model.
+
+    python3 tools/batch_bench.py [--devices 1000] [--single-types _MOTION] [--max-batch 64]
+
+``--single-types`` makes those models' simulated firmware ignore
+multi-device frames, to exercise the fallback; their devices still answer
+every round.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from bench import SimulatorProcess
+from _client import load_client, raise_fd_limit
+
+load_client()
+
+from dohome_client.batch import BatchStatusPoller  # noqa: E402
+from dohome_client.codec import CMD_STATUS, status_frame  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport  # noqa: E402
+
+ROUNDS = 10
+
+
+async def bench_single(devices, rounds):
+    transport = DoHomeAsyncTransport()
+    start = time.perf_counter()
+    answered = 0
+    for _ in range(rounds):
+        replies = await asyncio.gather(*(
+            transport.async_send_cmd(device, status_frame(device['sid']), CMD_STATUS)
+            for device in devices))
+        answered += sum(resp is not None for resp in replies)
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return summary(transport, devices, rounds, answered, elapsed)
+
+
+async def bench_batched(devices, rounds, target, max_batch):
+    transport = DoHomeAsyncTransport()
+    poller = BatchStatusPoller(transport, target, max_batch)
+    # The first round is the probe; measure the rounds after it.
+    await poller.async_poll(devices)
+    probe_frames = transport.stats.frames
+    transport.stats.frames = 0
+    start = time.perf_counter()
+    answered = 0
+    for _ in range(rounds):
+        replies = await poller.async_poll(devices)
+        answered += sum(resp is not None for resp in replies.values())
+    elapsed = time.perf_counter() - start
+    transport.close()
+    return {**summary(transport, devices, rounds, answered, elapsed),
+            'probe_frames': probe_frames, 'poller': poller.as_dict()}
+
+
+def summary(transport, devices, rounds, answered, elapsed):
+    polls = rounds * len(devices)
+    return {
+        'frames_per_round': round(transport.stats.frames / rounds, 1),
+        'polls_per_second': round(polls / elapsed, 1),
+        'answered': round(answered / polls, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--max-batch', type=int, default=64)
+    parser.add_argument('--single-types', type=lambda value: value.split(','), default=(),
+                        help='comma separated types whose firmware ignores multi-device frames')
+    args = parser.parse_args()
+    raise_fd_limit(args.devices + 256)
+
+    with SimulatorProcess(args.devices, single_types=args.single_types) as simulator:
+        devices = simulator.fleet['devices']
+        single = asyncio.run(bench_single(devices, args.rounds))
+        batched = asyncio.run(bench_batched(devices, args.rounds, simulator.fleet['broadcast'],
+                                            args.max_batch))
+    print(json.dumps({'devices': args.devices, 'single': single, 'batched': batched}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Throughput benchmark against the device simulator.
+
+For each fleet size the simulator runs in its own process while this
+process drives the integration's protocol code:
+
+* discovery: unicast probe sweep of the simulator's address range
+* poll: rounds of concurrent cmd 25 status polls over the shared transport
+* command: sequential cmd 5/6 round trips, reporting latency percentiles
+
+CPU time and open file descriptors are recorded for each phase.
+
+    python3 tools/bench.py [--sizes 10,100,1000] [--baseline FILE] [--save FILE]
+
+With ``--baseline`` the run is compared against a saved result and exits
+non-zero when a hot path regressed by more than ``--tolerance``.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+from _client import load_client, raise_fd_limit
+from simulator import DeviceSimulator, bus_address
+
+load_client()
+
+from dohome_client.codec import ctrl_frame  # noqa: E402
+from dohome_client.discovery import expand_hosts, probe_hosts  # noqa: E402
+from dohome_client.metrics import DoHomeMetrics  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport  # noqa: E402
+
+POLL_ROUNDS = 5
+COMMANDS = 200
+
+# Metric name -> True when larger is better.
+TRACKED = {
+    'discovery.seconds': False,
+    'poll.polls_per_second': True,
+    'command.p50_ms': False,
+    'command.p99_ms': False,
+    'poll.cpu_ms_per_poll': False,
+}
+
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_simulator(count, types, ready, conn, faults=None, first=0, single_types=()):
+    """Child process: serve count devices from index first until told to stop."""
+    async def serve():
+        simulator = DeviceSimulator(count, types, faults=faults, first=first,
+                                    single_types=single_types)
+        await simulator.start()
+        conn.send({'cidr': simulator.cidr, 'broadcast': bus_address(simulator.network),
+                   'devices': [d.info for d in simulator.devices]})
+        ready.set()
+        await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+        conn.send(sum(d.requests for d in simulator.devices))
+        simulator.close()
+
+    asyncio.run(serve())
+
+
+class SimulatorProcess:
+    """Run the simulator in a child process for the duration of a block."""
+
+    def __init__(self, count, types=None, faults=None, first=0, single_types=()):
+        self._ready = multiprocessing.Event()
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=run_simulator,
+            args=(count, types, self._ready, child_conn, faults, first, single_types),
+            daemon=True)
+        self.fleet = None
+        self.requests_served = None
+
+    def __enter__(self):
+        self._process.start()
+        self.fleet = self._conn.recv()
+        self._ready.wait()
+        return self
+
+    def __exit__(self, *exc):
+        self._conn.send('stop')
+        self.requests_served = self._conn.recv()
+        self._process.join()
+
+
+def bench_discovery(fleet):
+    hosts = expand_hosts([fleet['cidr']])
+    cpu, start = time.process_time(), time.perf_counter()
+    found = probe_hosts(hosts)
+    return {
+        'seconds': round(time.perf_counter() - start, 3),
+        'cpu_ms': round((time.process_time() - cpu) * 1000, 1),
+        'hosts': len(hosts),
+        'found': len(found),
+    }
+
+
+async def bench_poll(transport, devices, rounds=POLL_ROUNDS):
+    frames = [ctrl_frame(device['sid'], '{"cmd":25}') for device in devices]
+    cpu, start = time.process_time(), time.perf_counter()
+    answered = 0
+    for _ in range(rounds):
+        replies = await asyncio.gather(*(
+            transport.async_send_cmd(device, frame, 25) for device, frame in zip(devices, frames)))
+        answered += sum(reply is not None for reply in replies)
+    elapsed = time.perf_counter() - start
+    polls = rounds * len(devices)
+    return {
+        'polls': polls,
+        'answered': answered,
+        'seconds': round(elapsed, 3),
+        'polls_per_second': round(polls / elapsed, 1),
+        'cpu_ms_per_poll': round((time.process_time() - cpu) * 1000 / polls, 4),
+    }
+
+
+async def bench_commands(transport, devices, count=COMMANDS):
+    latencies = []
+    failed = 0
+    cpu = time.process_time()
+    for index in range(count):
+        device = devices[index % len(devices)]
+        if device['type'] == '_STRIPE':
+            op, rtn = '{"cmd": 6, "r": 5000, "g": 0, "b": 0, "w": 0, "m": 0}', 6
+        else:
+            op, rtn = '{"cmd":5,"op":%d }' % (index % 2), 5
+        start = time.perf_counter()
+        if await transport.async_send_cmd(device, ctrl_frame(device['sid'], op), rtn) is None:
+            failed += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'commands': count,
+        'failed': failed,
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'cpu_ms': round((time.process_time() - cpu) * 1000, 1),
+    }
+
+
+async def bench_transport(devices):
+    transport = DoHomeAsyncTransport(metrics=DoHomeMetrics())
+    try:
+        poll = await bench_poll(transport, devices)
+        command = await bench_commands(transport, devices)
+    finally:
+        transport.close()
+    return poll, command, transport.stats.as_dict()
+
+
+def bench_size(count):
+    fds_before = open_fds()
+    with SimulatorProcess(count) as sim:
+        devices = sim.fleet['devices']
+        discovery = bench_discovery(sim.fleet)
+        poll, command, stats = asyncio.run(bench_transport(devices))
+        fds_peak = open_fds()
+    return {
+        'devices': count,
+        'discovery': discovery,
+        'poll': poll,
+        'command': command,
+        'transport': stats,
+        'fds': {'before': fds_before, 'during': fds_peak, 'after': open_fds()},
+    }
+
+
+def lookup(result, path):
+    value = result
+    for part in path.split('.'):
+        value = value[part]
+    return value
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions of results against baseline."""
+    previous = {run['devices']: run for run in baseline['runs']}
+    regressions = []
+    for run in results['runs']:
+        old = previous.get(run['devices'])
+        if old is None:
+            continue
+        for path, larger_is_better in TRACKED.items():
+            new_value, old_value = lookup(run, path), lookup(old, path)
+            if not new_value or not old_value:
+                continue
+            ratio = old_value / new_value if larger_is_better else new_value / old_value
+            if ratio > 1 + tolerance:
+                regressions.append(f"{run['devices']} devices: {path} {old_value} -> {new_value}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000',
+                        type=lambda value: [int(size) for size in value.split(',')])
+    parser.add_argument('--baseline', help='compare against a saved result')
+    parser.add_argument('--save', help='write the result to this file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative slowdown before failing (default 0.25)')
+    args = parser.parse_args()
+
+    raise_fd_limit(max(args.sizes) * 2 + 256)
+    results = {'python': sys.version.split()[0], 'runs': [bench_size(size) for size in args.sizes]}
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as result_file:
+            json.dump(results, result_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Discovery burst load test.
+
+Starts 1,000 simulated DoHome responders on loopback addresses. Each answers
+the discovery ping with a pong at the same instant, which is the burst a
+large installation sends back to a broadcast. The test then checks that a
+DiscoveryJobManager job, the path the integration and the daemon discover
+through, sees every device from that one burst: the job runs for
+broadcast_window(1), so it pings once and a lost pong is not made up by a
+repeated ping.
+
+    python3 tools/discovery_load.py [--devices 1000] [--legacy]
+
+``--legacy`` runs the receive loop from before the burst path (default
+buffer, decode and log per datagram) for ``--duration`` seconds for
+comparison. Exits non-zero if any device is lost or answered twice.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import socket
+import sys
+import time
+
+from _client import load_client, raise_fd_limit
+
+load_client()
+
+from dohome_client.codec import PING, parse_pong  # noqa: E402
+from dohome_client.jobs import DiscoveryJobManager, broadcast_window  # noqa: E402
+from dohome_client.registry import DeviceRegistry  # noqa: E402
+
+RESPONDER_PORT = 16091
+DISCOVERY_PORT = 16092
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def responder_address(index):
+    """Return the loopback address of responder index."""
+    return f'127.1.{index // 250}.{index % 250 + 1}'
+
+
+def pong_frame(index):
+    """Return the pong a _DT-PLUG responder sends."""
+    ip = responder_address(index)
+    return (f'cmd=pong&device_name=DT-PLUG_{index:04x}&device_type=_DT-PLUG'
+            f'&sta_ip={ip}&mac=0000000{index:05x}&version=1.0.0&ap_ssid=loadtest').encode()
+
+
+def run_responders(count, ready):
+    """Bind count responders and answer each ping with a burst of pongs."""
+    sockets = []
+    for index in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind((responder_address(index), RESPONDER_PORT))
+        sockets.append((sock, pong_frame(index)))
+    listener = sockets[0][0]
+    ready.set()
+
+    while True:
+        data, addr = listener.recvfrom(1024)
+        if data == b'stop':
+            return
+        if data != PING:
+            continue
+        for sock, frame in sockets:
+            sock.sendto(frame, addr)
+
+
+def legacy_discover(target, duration, bind):
+    """The receive loop discovery used before the burst path."""
+    devices = {}
+    received = 0
+    _socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    _socket.bind(bind)
+    try:
+        _socket.sendto(PING, target)
+        _socket.settimeout(duration)
+        while True:
+            data, _ = _socket.recvfrom(1024)
+            received += 1
+            device = parse_pong(data)
+            if device is not None and device["name"] not in devices:
+                devices[device["name"]] = device
+                _LOGGER.info("Discovered DoHome Device: %s", device)
+    except socket.timeout:
+        pass
+    finally:
+        _socket.close()
+    return list(devices.values()), {'received': received, 'devices': len(devices)}
+
+
+async def job_discover(target, bind):
+    """Discover through a DiscoveryJobManager job that sends a single ping."""
+    job = DiscoveryJobManager(DeviceRegistry()).request(broadcast_window(1), target=target,
+                                                        bind=bind)
+    await job.async_wait()
+    return job.devices, job.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr, format='%(message)s')
+    raise_fd_limit(args.devices + 64)
+
+    ready = multiprocessing.Event()
+    responders = multiprocessing.Process(target=run_responders, args=(args.devices, ready))
+    responders.start()
+    ready.wait()
+
+    target = (responder_address(0), RESPONDER_PORT)
+    bind = ('127.0.0.1', DISCOVERY_PORT)
+    start = time.perf_counter()
+    try:
+        if args.legacy:
+            devices, stats = legacy_discover(target, args.duration, bind)
+        else:
+            devices, stats = asyncio.run(job_discover(target, bind))
+            stats = stats.as_dict()
+    finally:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b'stop', target)
+        responders.join()
+
+    result = {
+        'path': 'legacy' if args.legacy else 'job',
+        'responders': args.devices,
+        'found': len(devices),
+        'lost': args.devices - len(devices),
+        'elapsed': round(time.perf_counter() - start, 3),
+        'stats': stats,
+    }
+    print(json.dumps(result, indent=2))
+    # A duplicate means a device answered more than one ping, so the count no
+    # longer measures the single burst
+    return 1 if result['lost'] or stats.get('duplicates') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Polling and command paths under injected network faults.
+
+Runs the simulator with loss, latency, duplication and reordering scenarios
+and pushes traffic through both transports:
+
+* poll: rounds of concurrent cmd 25 polls over DoHomeAsyncTransport, the
+  path the status poller and lights use
+* command: sequential cmd 5/6 requests over DoHomeTransport with retries,
+  the path switches and sensors use
+
+Every simulated reply carries a per-device ``seq``, so a reply the transport
+hands back that is older than one it already returned counts as stale.
+Each scenario asserts a lower bound on answered requests and throughput, an
+upper bound on median command latency, and no stale replies.
+
+    python3 tools/fault_bench.py [--scenario wifi] [--timeout 0.5] [--retries 1]
+
+Exits non-zero when any bound is violated. Vary ``--timeout`` and
+``--retries`` to see how they trade latency against delivery.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from bench import SimulatorProcess, percentile
+from simulator import FaultModel
+from _client import load_client
+
+load_client()
+
+from dohome_client.codec import ctrl_frame  # noqa: E402
+from dohome_client.metrics import DoHomeMetrics  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport, DoHomeTransport  # noqa: E402
+
+DEVICES = 50
+POLL_ROUNDS = 10
+COMMANDS = 100
+MARGIN = 0.05
+
+SCENARIOS = {
+    'clean': {},
+    'loss': {'loss': 0.05},
+    'latency': {'latency': 0.05, 'jitter': 0.02, 'distribution': 'normal'},
+    'tail': {'latency': 0.01, 'jitter': 0.05, 'distribution': 'exponential'},
+    'duplicate': {'duplicate': 0.2, 'latency': 0.002, 'jitter': 0.002},
+    'reorder': {'reorder': 0.2, 'latency': 0.005},
+    'wifi': {'loss': 0.03, 'latency': 0.02, 'jitter': 0.02, 'distribution': 'exponential',
+             'duplicate': 0.05, 'reorder': 0.05},
+}
+
+
+class StaleCheck:
+    """Count replies older than the newest one already accepted per device."""
+
+    def __init__(self):
+        self._last = {}
+        self.stale = 0
+
+    def check(self, sid, resp):
+        seq = resp.get('seq', 0)
+        if seq <= self._last.get(sid, 0):
+            self.stale += 1
+        else:
+            self._last[sid] = seq
+
+
+def command_for(device, index):
+    if device['type'] == '_STRIPE':
+        return '{"cmd": 6, "r": %d, "g": 0, "b": 0, "w": 0, "m": 0}' % (index % 5000), 6
+    return '{"cmd":5,"op":%d }' % (index % 2), 5
+
+
+async def run_polls(devices, timeout, stale):
+    transport = DoHomeAsyncTransport(timeout=timeout, metrics=DoHomeMetrics())
+    frames = [ctrl_frame(device['sid'], '{"cmd":25}') for device in devices]
+    answered = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(POLL_ROUNDS):
+            replies = await asyncio.gather(*(
+                transport.async_send_cmd(device, frame, 25)
+                for device, frame in zip(devices, frames)))
+            for device, resp in zip(devices, replies):
+                if resp is not None:
+                    answered += 1
+                    stale.check(device['sid'], resp)
+    finally:
+        transport.close()
+    elapsed = time.perf_counter() - start
+    polls = POLL_ROUNDS * len(devices)
+    return {
+        'answered': round(answered / polls, 3),
+        'polls_per_second': round(polls / elapsed, 1),
+        'transport': transport.stats.as_dict(),
+    }
+
+
+def run_commands(devices, timeout, retries, stale):
+    transport = DoHomeTransport(timeout=timeout, metrics=DoHomeMetrics())
+    latencies = []
+    try:
+        for index in range(COMMANDS):
+            device = devices[index % len(devices)]
+            op, rtn_cmd = command_for(device, index)
+            start = time.perf_counter()
+            resp = transport.send_cmd(device, ctrl_frame(device['sid'], op), rtn_cmd, retries)
+            if resp is not None:
+                latencies.append((time.perf_counter() - start) * 1000)
+                stale.check(device['sid'], resp)
+    finally:
+        transport.close()
+    return {
+        'answered': round(len(latencies) / COMMANDS, 3),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'transport': transport.stats.as_dict(),
+    }
+
+
+def bounds(faults, timeout, retries):
+    """Return the limits a scenario must meet given its fault parameters."""
+    delivered = (1 - faults.loss) ** 2
+    slow = faults.latency + 3 * faults.jitter + faults.reorder * faults.reorder_delay
+    return {
+        'poll_answered': delivered - MARGIN,
+        'command_answered': 1 - (1 - delivered) ** (retries + 1) - MARGIN,
+        'polls_per_second': DEVICES / (timeout + 0.25),
+        'command_p50_ms': (slow + 0.02) * 1000,
+    }
+
+
+def run_scenario(name, params, timeout, retries):
+    faults = FaultModel(seed=1, **params)
+    stale = StaleCheck()
+    with SimulatorProcess(DEVICES, faults=faults) as sim:
+        devices = sim.fleet['devices']
+        poll = asyncio.run(run_polls(devices, timeout, stale))
+        command = run_commands(devices, timeout, retries, stale)
+
+    limits = bounds(faults, timeout, retries)
+    failures = []
+    if poll['answered'] < limits['poll_answered']:
+        failures.append(f"poll answered {poll['answered']} < {limits['poll_answered']:.3f}")
+    if poll['polls_per_second'] < limits['polls_per_second']:
+        failures.append(f"poll rate {poll['polls_per_second']} < {limits['polls_per_second']:.1f}/s")
+    if command['answered'] < limits['command_answered']:
+        failures.append(f"command answered {command['answered']} < {limits['command_answered']:.3f}")
+    if command['p50_ms'] is None or command['p50_ms'] > limits['command_p50_ms']:
+        failures.append(f"command p50 {command['p50_ms']} ms > {limits['command_p50_ms']:.1f} ms")
+    if stale.stale:
+        failures.append(f"{stale.stale} stale replies accepted")
+
+    return {
+        'scenario': name,
+        'faults': faults.as_dict(),
+        'poll': poll,
+        'command': command,
+        'stale': stale.stale,
+        'failures': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', choices=list(SCENARIOS), action='append',
+                        help='scenario to run, repeatable (default: all)')
+    parser.add_argument('--timeout', type=float, default=0.5)
+    parser.add_argument('--retries', type=int, default=1)
+    args = parser.parse_args()
+
+    results = [run_scenario(name, SCENARIOS[name], args.timeout, args.retries)
+               for name in args.scenario or SCENARIOS]
+    print(json.dumps(results, indent=2))
+
+    failed = False
+    for result in results:
+        for failure in result['failures']:
+            failed = True
+            print(f"FAIL {result['scenario']}: {failure}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
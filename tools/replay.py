@@ -0,0 +1,286 @@
+"""
+Record and replay DoHome traffic.
+
+A capture is the packet trace saved by the ``dohome.save_capture`` service
+(or by ``record`` below): the known devices plus every frame with its time,
+direction and outcome. The replayer stands up one loopback device per
+captured device and answers each request with the reply that was recorded
+for it, after the recorded delay. Requests that timed out in the capture get
+no answer, and late replies arrive late again.
+
+    python3 tools/replay.py record capture.jsonl.gz [--devices 20] [--loss 0.05]
+    python3 tools/replay.py serve capture.jsonl.gz [--speed 1]
+    python3 tools/replay.py check capture.jsonl.gz [--speed 10] [--timeout 1.0]
+
+``serve`` prints the replayed devices with their loopback addresses and
+answers until interrupted, for pointing a development Home Assistant at a
+customer's devices. ``check`` sends the recorded requests at their recorded
+offsets through the integration's async transport and exits non-zero when
+any request gets a different outcome than in the capture, so a capture can
+be kept as a regression and timing test. ``--speed`` divides every delay,
+offset and the timeout.
+"""
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import time
+from collections import defaultdict, deque
+
+from bench import SimulatorProcess, percentile
+from simulator import DEVICE_PORT, FaultModel, device_address
+from _client import load_client
+
+load_client()
+
+from dohome_client.codec import ctrl_frame, parse_reply  # noqa: E402
+from dohome_client.metrics import DoHomeMetrics  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport, DoHomeTransport  # noqa: E402
+from dohome_client.trace import TX, PacketTrace, load_capture  # noqa: E402
+
+RECORD_ROUNDS = 5
+
+
+def request_cmd(frame):
+    """Return the op cmd of a cmd=ctrl request frame, or None."""
+    _, _, op = frame.decode('utf-8', 'replace').partition('&op=')
+    try:
+        return json.loads(op).get('cmd')
+    except ValueError:
+        return None
+
+
+class Exchange:
+    """One recorded request and the replies that came back for it."""
+
+    __slots__ = ('offset', 'sid', 'frame', 'cmd', 'expected', 'replies')
+
+    def __init__(self, offset, sid, frame, cmd):
+        self.offset = offset
+        self.sid = sid
+        self.frame = frame
+        self.cmd = cmd
+        self.expected = None
+        self.replies = []
+
+
+def build_script(frames):
+    """Pair every recorded request with its replies.
+
+    A reply the transport accepted belongs to the newest request for that
+    device and cmd; late and mismatched replies belong to the oldest one
+    still unanswered.
+    """
+    exchanges = []
+    by_key = defaultdict(list)
+    for offset, sid, direction, outcome, data in frames:
+        if direction == TX:
+            cmd = request_cmd(data)
+            if cmd is None:
+                continue
+            exchange = Exchange(offset, sid, data, cmd)
+            exchanges.append(exchange)
+            by_key[(sid, cmd)].append(exchange)
+            continue
+        if data is None:
+            continue
+        try:
+            reply_sid, op = parse_reply(data)
+        except ValueError:
+            continue
+        candidates = by_key.get((reply_sid, op.get('cmd')))
+        if not candidates:
+            continue
+        if outcome == 'reply':
+            exchange = candidates[-1]
+            if exchange.expected is None:
+                exchange.expected = op
+        else:
+            exchange = next((e for e in candidates if not e.replies), candidates[-1])
+        exchange.replies.append((offset - exchange.offset, data))
+    return exchanges
+
+
+class ReplayDevice(asyncio.DatagramProtocol):
+    """A loopback device answering with the replies of a capture."""
+
+    def __init__(self, info, address, exchanges, speed):
+        self.info = dict(info, sta_ip=address)
+        self.address = address
+        self.speed = speed
+        self.queues = defaultdict(deque)
+        for exchange in exchanges:
+            self.queues[exchange.cmd].append(exchange)
+        self.unscripted = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data.strip() == b'cmd=ping':
+            info = self.info
+            self.transport.sendto(
+                (f"cmd=pong&device_name={info['name']}&device_type={info['type']}"
+                 f"&sta_ip={self.address}&version=replay").encode(), addr)
+            return
+        queue = self.queues.get(request_cmd(data))
+        if not queue:
+            self.unscripted += 1
+            return
+        loop = asyncio.get_running_loop()
+        for delay, reply in queue.popleft().replies:
+            loop.call_later(max(delay, 0) / self.speed, self._deliver, reply, addr)
+
+    def _deliver(self, reply, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(reply, addr)
+
+
+class Replayer:
+    """Serve a capture from loopback addresses."""
+
+    def __init__(self, devices, exchanges, speed=1.0):
+        by_sid = defaultdict(list)
+        for exchange in exchanges:
+            by_sid[exchange.sid].append(exchange)
+        self.devices = [ReplayDevice(info, device_address(index), by_sid[info['sid']], speed)
+                        for index, info in enumerate(devices)]
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for device in self.devices:
+            await loop.create_datagram_endpoint(
+                lambda device=device: device, local_addr=(device.address, DEVICE_PORT))
+
+    def close(self):
+        for device in self.devices:
+            if device.transport is not None:
+                device.transport.close()
+
+
+async def check(devices, exchanges, speed, timeout):
+    replayer = Replayer(devices, exchanges, speed)
+    await replayer.start()
+    addresses = {device.info['sid']: device.info for device in replayer.devices}
+    transport = DoHomeAsyncTransport(timeout=timeout / speed, metrics=DoHomeMetrics())
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    latencies = []
+
+    async def replay(exchange):
+        await asyncio.sleep(max(0, start + exchange.offset / speed - loop.time()))
+        sent = loop.time()
+        resp = await transport.async_send_cmd(addresses[exchange.sid], exchange.frame, exchange.cmd)
+        if resp is not None:
+            latencies.append((loop.time() - sent) * 1000)
+        return resp
+
+    try:
+        results = await asyncio.gather(*(replay(exchange) for exchange in exchanges))
+    finally:
+        transport.close()
+        replayer.close()
+    elapsed = loop.time() - start
+
+    diverged = [
+        {'offset': exchange.offset, 'sid': exchange.sid, 'cmd': exchange.cmd,
+         'recorded': exchange.expected, 'replayed': resp}
+        for exchange, resp in zip(exchanges, results) if resp != exchange.expected
+    ]
+    return {
+        'requests': len(exchanges),
+        'answered': sum(resp is not None for resp in results),
+        'diverged': len(diverged),
+        'first_divergences': diverged[:10],
+        'recorded_seconds': round(exchanges[-1].offset, 3) if exchanges else 0,
+        'replayed_seconds': round(elapsed, 3),
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'unscripted': sum(device.unscripted for device in replayer.devices),
+        'transport': transport.stats.as_dict(),
+    }
+
+
+async def serve(devices, exchanges, speed):
+    replayer = Replayer(devices, exchanges, speed)
+    await replayer.start()
+    print(json.dumps({'devices': [device.info for device in replayer.devices]}, indent=1))
+    sys.stdout.flush()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    replayer.close()
+
+
+def record(path, count, faults):
+    """Capture polls and commands against the simulator."""
+    trace = PacketTrace()
+    trace.enable(10000)
+    with SimulatorProcess(count, faults=faults) as sim:
+        devices = sim.fleet['devices']
+
+        async def poll():
+            transport = DoHomeAsyncTransport(trace=trace)
+            try:
+                for _ in range(RECORD_ROUNDS):
+                    await asyncio.gather(*(
+                        transport.async_send_cmd(device, ctrl_frame(device['sid'], '{"cmd":25}'), 25)
+                        for device in devices))
+            finally:
+                transport.close()
+
+        asyncio.run(poll())
+        transport = DoHomeTransport(trace=trace)
+        try:
+            for index, device in enumerate(devices * 2):
+                op = '{"cmd":5,"op":%d }' % (index % 2)
+                transport.send_cmd(device, ctrl_frame(device['sid'], op), 5, retries=1)
+        finally:
+            transport.close()
+    return trace.save(path, devices)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    record_parser = commands.add_parser('record', help='capture traffic against the simulator')
+    record_parser.add_argument('--devices', type=int, default=20)
+    record_parser.add_argument('--loss', type=float, default=0.0)
+    record_parser.add_argument('--latency', type=float, default=0.0, help='mean reply latency in ms')
+    record_parser.add_argument('--jitter', type=float, default=0.0, help='latency spread in ms')
+    for name in ('serve', 'check'):
+        replay_parser = commands.add_parser(name)
+        replay_parser.add_argument('--speed', type=float, default=1.0)
+        if name == 'check':
+            replay_parser.add_argument('--timeout', type=float, default=1.0,
+                                       help='request timeout in recorded seconds')
+    for sub in commands.choices.values():
+        sub.add_argument('capture')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        faults = FaultModel(args.loss, args.latency / 1000, args.jitter / 1000, seed=1)
+        frames = record(args.capture, args.devices, faults)
+        print(f"{frames} frames from {args.devices} devices written to {args.capture}")
+        return 0
+
+    devices, frames = load_capture(args.capture)
+    exchanges = build_script(frames)
+    if args.command == 'serve':
+        asyncio.run(serve(devices, exchanges, args.speed))
+        return 0
+
+    started = time.perf_counter()
+    result = asyncio.run(check(devices, exchanges, args.speed, args.timeout))
+    result['wall_seconds'] = round(time.perf_counter() - started, 3)
+    print(json.dumps(result, indent=2))
+    return 1 if result['diverged'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
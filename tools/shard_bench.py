@@ -0,0 +1,104 @@
+"""
+Polling throughput of the sharded multi-process poller.
+
+Serves a large simulated fleet split over several simulator processes, so
+the simulator is not the bottleneck, and polls it back to back for a fixed
+time: first from one event loop in this process, then from a ShardedPoller
+with each worker count. Reports polls per second, the answered ratio and
+the speedup over in-process polling.
+
+    python3 tools/shard_bench.py [--devices 1000] [--workers 1,2,4] [--seconds 5]
+
+Scaling needs free cores: with as many workers as cores the simulators
+compete for the same CPUs, so compare worker counts below the core count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import ExitStack
+
+from bench import SimulatorProcess
+from _client import load_client, raise_fd_limit
+
+load_client()
+
+from dohome_client.codec import CMD_STATUS, status_frame  # noqa: E402
+from dohome_client.protocol import DoHomeAsyncTransport  # noqa: E402
+from dohome_client.sharded import ShardedPoller  # noqa: E402
+
+
+async def bench_in_process(devices, seconds):
+    loop = asyncio.get_running_loop()
+    transport = DoHomeAsyncTransport()
+    frames = [status_frame(device['sid']) for device in devices]
+    polls = answered = 0
+    start = loop.time()
+    while loop.time() - start < seconds:
+        replies = await asyncio.gather(*(
+            transport.async_send_cmd(device, frame, CMD_STATUS)
+            for device, frame in zip(devices, frames)))
+        polls += len(replies)
+        answered += sum(resp is not None for resp in replies)
+    elapsed = loop.time() - start
+    transport.close()
+    return {
+        'workers': 0,
+        'polls_per_second': round(polls / elapsed, 1),
+        'answered': round(answered / polls, 4),
+    }
+
+
+async def bench_sharded(devices, workers, seconds):
+    poller = ShardedPoller(workers, interval=0)
+    poller.start(devices)
+    # Let the workers spawn and finish their first round before measuring.
+    while not all(stats.rounds for stats in poller.stats):
+        await asyncio.sleep(0.05)
+    before = sum(stats.polls for stats in poller.stats), sum(stats.answered for stats in poller.stats)
+    start = time.perf_counter()
+    await asyncio.sleep(seconds)
+    polls = sum(stats.polls for stats in poller.stats) - before[0]
+    answered = sum(stats.answered for stats in poller.stats) - before[1]
+    elapsed = time.perf_counter() - start
+    poller.stop()
+    return {
+        'workers': workers,
+        'polls_per_second': round(polls / elapsed, 1),
+        'answered': round(answered / polls, 4) if polls else None,
+        'states': len(poller.states),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=1000)
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated worker counts')
+    parser.add_argument('--simulators', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='simulator processes to split the fleet over')
+    parser.add_argument('--seconds', type=float, default=5.0, help='measuring time per configuration')
+    args = parser.parse_args()
+    raise_fd_limit(args.devices + 256)
+
+    share = -(-args.devices // args.simulators)
+    with ExitStack() as stack:
+        devices = []
+        for first in range(0, args.devices, share):
+            simulator = stack.enter_context(
+                SimulatorProcess(min(share, args.devices - first), first=first))
+            devices += simulator.fleet['devices']
+
+        results = [asyncio.run(bench_in_process(devices, args.seconds))]
+        for workers in (int(count) for count in args.workers.split(',')):
+            results.append(asyncio.run(bench_sharded(devices, workers, args.seconds)))
+
+    baseline = results[0]['polls_per_second']
+    for result in results:
+        result['speedup'] = round(result['polls_per_second'] / baseline, 2) if baseline else None
+    print(json.dumps({'devices': args.devices, 'cpus': os.cpu_count(),
+                      'simulators': args.simulators, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
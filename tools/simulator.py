@@ -0,0 +1,326 @@
+"""
+Local DoHome device simulator.
+
+Emulates _THIMR, _DT-PLUG, _REALY2, _REALY4, _STRIPE and _MOTION devices on
+loopback addresses. Every device owns a UDP socket on its own 127.x address
+and port 6091, answers ``cmd=ping`` with a ``pong`` frame and handles the
+cmd 5 (relay), cmd 6 (color) and cmd 25 (status) control frames the
+integration sends.
+
+    python3 tools/simulator.py --devices 100 [--types _DT-PLUG,_STRIPE]
+
+Prints the simulated devices as JSON and serves until interrupted.
+
+Frames sent to ``127.2.255.255:6091`` reach every device they name, as a
+broadcast would; ``--single-types`` lists types whose firmware ignores
+frames naming more than one device.
+
+Fault injection options (``--loss``, ``--latency``, ``--jitter``,
+``--distribution``, ``--duplicate``, ``--reorder``) make the devices behave
+like they sit behind a congested Wi-Fi network. Loss applies separately to
+requests and replies, and every control reply carries a per-device ``seq``
+so a client can tell a stale reply from a fresh one.
+"""
+import argparse
+import asyncio
+import json
+import random
+import signal
+import sys
+
+from _client import raise_fd_limit
+
+DEVICE_PORT = 6091
+BASE_NETWORK = '127.2'
+
+DEVICE_TYPES = {
+    '_THIMR': ('THIMR', {'relay': 0, 'temp': 22, 'humi': 45, 'illu': 300, 'motion': 0}),
+    '_DT-PLUG': ('Plug', {'soft_poweroff': 1}),
+    '_REALY2': ('Relay2', {'relay1': 0, 'relay2': 0}),
+    '_REALY4': ('Relay4', {'relay1': 0, 'relay2': 0, 'relay3': 0, 'relay4': 0}),
+    '_STRIPE': ('Light strip', {'r': 0, 'g': 0, 'b': 0, 'w': 0, 'm': 0}),
+    '_MOTION': ('Motion', {'motion': 0}),
+}
+
+
+class FaultModel:
+    """Loss, latency, duplication and reordering applied to device traffic."""
+
+    DISTRIBUTIONS = ('fixed', 'uniform', 'normal', 'exponential')
+
+    def __init__(self, loss=0.0, latency=0.0, jitter=0.0, distribution='uniform',
+                 duplicate=0.0, reorder=0.0, reorder_delay=0.05, seed=None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"unknown latency distribution {distribution}")
+        self.loss = loss
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.reorder_delay = reorder_delay
+        self._random = random.Random(seed)
+
+    def drop(self):
+        """Return True when the next datagram is lost."""
+        return self.loss > 0 and self._random.random() < self.loss
+
+    def copies(self):
+        """Return how many times the next reply is delivered."""
+        return 2 if self.duplicate > 0 and self._random.random() < self.duplicate else 1
+
+    def delay(self):
+        """Return the delivery delay of the next reply in seconds."""
+        if self.distribution == 'fixed' or not self.jitter:
+            delay = self.latency
+        elif self.distribution == 'uniform':
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        elif self.distribution == 'normal':
+            delay = self._random.gauss(self.latency, self.jitter)
+        else:
+            delay = self.latency + self._random.expovariate(1 / self.jitter)
+        if self.reorder > 0 and self._random.random() < self.reorder:
+            # Held back long enough for later replies to overtake it.
+            delay += self.reorder_delay
+        return max(delay, 0.0)
+
+    def as_dict(self):
+        return {
+            'loss': self.loss, 'latency': self.latency, 'jitter': self.jitter,
+            'distribution': self.distribution, 'duplicate': self.duplicate,
+            'reorder': self.reorder,
+        }
+
+
+def device_address(index, network=BASE_NETWORK):
+    """Return the loopback address of simulated device index."""
+    return f'{network}.{index // 250}.{index % 250 + 1}'
+
+
+def bus_address(network=BASE_NETWORK):
+    """Return the loopback address that stands in for the broadcast address."""
+    return f'{network}.255.255'
+
+
+def device_network(count, network=BASE_NETWORK):
+    """Return the smallest CIDR range covering count simulated devices."""
+    prefix = 24
+    while 250 * (1 << (24 - prefix)) < count:
+        prefix -= 1
+    return f'{network}.0.0/{prefix}'
+
+
+class SimulatedDevice(asyncio.DatagramProtocol):
+    """One emulated DoHome device."""
+
+    def __init__(self, index, device_type, network=BASE_NETWORK, faults=None):
+        prefix, state = DEVICE_TYPES[device_type]
+        self.sid = f'{index:04x}'
+        self.mac = f'a0b1c2d3{self.sid}'
+        self.name = f'{prefix}_{self.sid}'
+        self.type = device_type
+        self.address = device_address(index, network)
+        self.state = dict(state)
+        self.faults = faults
+        self.requests = 0
+        self.seq = 0
+        self.transport = None
+
+    @property
+    def info(self):
+        """Return the device dict the integration builds from a pong."""
+        return {'sid': self.sid, 'name': self.name, 'sta_ip': self.address, 'type': self.type}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        if self.faults is not None and self.faults.drop():
+            return
+        reply = self.handle(data)
+        if reply is not None:
+            self.send(reply, addr)
+
+    def send(self, reply, addr):
+        faults = self.faults
+        if faults is None:
+            self.transport.sendto(reply, addr)
+            return
+        if faults.drop():
+            return
+        loop = asyncio.get_running_loop()
+        for _ in range(faults.copies()):
+            delay = faults.delay()
+            if delay:
+                loop.call_later(delay, self._deliver, reply, addr)
+            else:
+                self.transport.sendto(reply, addr)
+
+    def _deliver(self, reply, addr):
+        if not self.transport.is_closing():
+            self.transport.sendto(reply, addr)
+
+    def handle(self, data):
+        """Return the reply frame for a request, or None to stay silent."""
+        try:
+            text = data.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            return None
+        if text == 'cmd=ping':
+            return self.pong()
+
+        fields = dict(part.split('=', 1) for part in text.split('&') if '=' in part)
+        if fields.get('cmd') != 'ctrl' or self.sid not in fields.get('devices', ''):
+            return None
+        try:
+            op = json.loads(fields['op'])
+        except (KeyError, ValueError):
+            return None
+        return self.control(op)
+
+    def pong(self):
+        return (f'cmd=pong&device_name={self.name}&device_type={self.type}'
+                f'&sta_ip={self.address}&mac={self.mac}&version=1.2.0&ap_ssid=simulator').encode()
+
+    def control(self, op):
+        cmd = op.get('cmd')
+        if cmd == 5:
+            self.set_power(op)
+            result = {'cmd': 5, 'res': 0}
+        elif cmd == 6 and self.type == '_STRIPE':
+            for channel in ('r', 'g', 'b', 'w', 'm'):
+                if channel in op:
+                    self.state[channel] = int(op[channel])
+            result = {'cmd': 6, 'res': 0}
+        elif cmd == 25:
+            self.drift()
+            result = {'cmd': 25, **self.state}
+        else:
+            return None
+        self.seq += 1
+        result['seq'] = self.seq
+        return f'cmd=ctrl&dev={self.mac}&op={json.dumps(result)}'.encode()
+
+    def set_power(self, op):
+        if 'op' in op:
+            if self.type == '_DT-PLUG':
+                self.state['soft_poweroff'] = 0 if op['op'] else 1
+            elif 'relay' in self.state:
+                self.state['relay'] = 1 if op['op'] else 0
+        for key, value in op.items():
+            if key.startswith('relay') and key in self.state:
+                self.state[key] = 1 if value else 0
+
+    def drift(self):
+        if 'temp' in self.state:
+            self.state['temp'] = 22 + random.randint(-1, 1)
+        if 'motion' in self.state:
+            self.state['motion'] = 1 if random.random() < 0.05 else 0
+
+
+class SimulatedBus(asyncio.DatagramProtocol):
+    """The broadcast address: hands each frame to every device it names.
+
+    Devices of single_types have firmware that ignores frames naming more
+    than one device.
+    """
+
+    def __init__(self, devices, single_types=()):
+        self.by_sid = {device.sid: device for device in devices}
+        self.single_types = set(single_types)
+        self.frames = 0
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.frames += 1
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        fields = dict(part.split('=', 1) for part in text.split('&') if '=' in part)
+        sids = fields.get('devices', '').strip('{[]}').split(',')
+        for sid in sids:
+            device = self.by_sid.get(sid)
+            if device is not None and (len(sids) == 1 or device.type not in self.single_types):
+                device.datagram_received(data, addr)
+
+
+class DeviceSimulator:
+    """A fleet of simulated devices served from one event loop."""
+
+    def __init__(self, count, types=None, network=BASE_NETWORK, faults=None, first=0,
+                 single_types=()):
+        types = types or list(DEVICE_TYPES)
+        self.network = network
+        self.devices = [SimulatedDevice(index, types[index % len(types)], network, faults)
+                        for index in range(first, first + count)]
+        self.bus = SimulatedBus(self.devices, single_types)
+
+    @property
+    def cidr(self):
+        return device_network(len(self.devices), self.network)
+
+    async def start(self):
+        raise_fd_limit(len(self.devices) + 256)
+        loop = asyncio.get_running_loop()
+        for device in self.devices:
+            await loop.create_datagram_endpoint(
+                lambda device=device: device, local_addr=(device.address, DEVICE_PORT))
+        try:
+            await loop.create_datagram_endpoint(
+                lambda: self.bus, local_addr=(bus_address(self.network), DEVICE_PORT))
+        except OSError:
+            # Another simulator on the same network already serves the bus.
+            pass
+
+    def close(self):
+        for device in self.devices:
+            if device.transport is not None:
+                device.transport.close()
+        if self.bus.transport is not None:
+            self.bus.transport.close()
+
+
+async def serve(args):
+    faults = None
+    if args.loss or args.latency or args.duplicate or args.reorder:
+        faults = FaultModel(args.loss, args.latency / 1000, args.jitter / 1000, args.distribution,
+                            args.duplicate, args.reorder, seed=args.seed)
+    simulator = DeviceSimulator(args.devices, args.types, faults=faults,
+                                single_types=args.single_types)
+    await simulator.start()
+    print(json.dumps({'cidr': simulator.cidr, 'broadcast': bus_address(simulator.network),
+                      'devices': [d.info for d in simulator.devices]}, indent=1))
+    sys.stdout.flush()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    simulator.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--types', type=lambda value: value.split(','), default=None,
+                        help='comma separated device types to cycle through')
+    parser.add_argument('--loss', type=float, default=0.0, help='loss probability per direction')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean reply latency in ms')
+    parser.add_argument('--jitter', type=float, default=0.0, help='latency spread in ms')
+    parser.add_argument('--distribution', choices=FaultModel.DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--duplicate', type=float, default=0.0, help='reply duplication probability')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability a reply is held back')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--single-types', type=lambda value: value.split(','), default=(),
+                        help='comma separated types whose firmware ignores multi-device frames')
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()